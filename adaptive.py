@@ -0,0 +1,96 @@
+"""
+Timeouts and waits learned from the instrument instead of fixed values.
+
+AdaptiveTimeouts keeps the response times of the latest successful attempts per RPC and uses a high percentile of
+them plus a margin as timeout of the first attempt. Retries fall back to the fixed timeout of the method, so a slow
+but valid reply costs one retry at most. RPCs whose duration depends on the aim (motor positioning, ATR, distance
+measurement) keep their fixed timeouts. RPCs taking an incline mode keep their response times per mode, measuring
+the incline as the compensator polling does takes longer than using the modelled one.
+
+wait_for_compensator polls the inclines until they are stable instead of sleeping a fixed time.
+"""
+
+import collections
+
+from geocom_dicts import *
+from instrumentation import rpc_number
+from logger import log
+
+
+FIXED_TIMEOUT_RPCS = {9027, 9037, 2167}  # AUT_MakePositioning, AUT_FineAdjust, TMC_GetFullMeas
+MODE_RPCS = {2003, 2008, 2107}  # TMC_GetAngle1, TMC_DoMeasure, TMC_GetAngle5, duration depends on the incline mode
+
+COMPENSATOR_POLL_INTERVAL = 0.2  # s
+COMPENSATOR_TOLERANCE = 0.0001*3.141592653589793/200  # rad, 0.1 mgon between two consecutive incline readings
+
+
+class AdaptiveTimeouts:
+    def __init__(self, percentile=99, factor=1.5, margin=0.3, min_timeout=0.5, window=200, min_samples=20):
+        """
+        timeout = factor * percentile of the last window response times + margin, within [min_timeout, fixed timeout]
+        :param min_samples: response times needed before the fixed timeout is replaced
+        """
+        self.percentile = percentile
+        self.factor = factor
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.window = window
+        self.min_samples = min_samples
+
+        self.samples = {}  # key -> deque of seconds
+        self.learned = {}  # key -> timeout, dropped whenever a new sample arrives
+
+    @staticmethod
+    def key(request):
+        # rpc number, (rpc number, parameters) for MODE_RPCS
+        rpc = rpc_number(request)
+        if rpc in MODE_RPCS:
+            return rpc, request.partition(':')[2].rstrip()
+        return rpc
+
+    def observe(self, request, seconds):
+        """
+        :param request: string sent, e.g. "%R1Q,2003:1\r\n"
+        """
+        key = self.key(request)
+        samples = self.samples.get(key)
+        if samples is None:
+            samples = self.samples[key] = collections.deque(maxlen=self.window)
+        samples.append(seconds)
+        self.learned.pop(key, None)
+
+    def timeout(self, request, fixed_timeout):
+        key = self.key(request)
+        if rpc_number(request) in FIXED_TIMEOUT_RPCS:
+            return fixed_timeout
+        learned = self.learned.get(key)
+        if learned is None:
+            samples = self.samples.get(key)
+            if samples is None or len(samples) < self.min_samples:
+                return fixed_timeout
+            ordered = sorted(samples)
+            high = ordered[min(len(ordered) - 1, int(len(ordered)*self.percentile/100))]
+            learned = self.learned[key] = self.factor*high + self.margin
+        return min(max(learned, self.min_timeout), fixed_timeout)
+
+
+def wait_for_compensator(geocom, max_wait, tolerance=COMPENSATOR_TOLERANCE, poll_interval=COMPENSATOR_POLL_INTERVAL):
+    """
+    Polls the cross and length incline via TMC_GetAngle1 until two consecutive readings differ by less than
+    tolerance, but at most max_wait seconds.
+    :return: seconds waited
+    """
+    clock = geocom.sercon.clock  # the time of the trace when replaying
+    start = clock()
+    previous = None
+    while clock() - start < max_wait:
+        rsp = geocom.TMC_GetAngle1(TMC_INCLINE_PRG["TMC_MEA_INC"])
+        if rsp and rsp.ok:
+            inclines = rsp.cross_incline, rsp.length_incline
+            if previous is not None and abs(inclines[0] - previous[0]) < tolerance \
+                    and abs(inclines[1] - previous[1]) < tolerance:
+                return clock() - start
+            previous = inclines
+        geocom.sercon.sleep(min(poll_interval, max(max_wait - (clock() - start), 0)))
+    log.warning("Compensator not stable after " + str(max_wait) + "s")
+    return clock() - start
@@ -0,0 +1,93 @@
+"""
+Reorders the aims of a set to shorten motor travel between them. Both axes of the TM50 move at the same time, so
+the travel time between two directions is max(|dHz|, |dV|)/SLEW_SPEED with dHz taken the short way around the
+circle. Every face is planned on its own (all face I aims, then all face II aims), starting where the previous group
+ended, with a nearest neighbour tour improved by 2-opt.
+"""
+
+import numpy as np
+
+from set_reduction import wrap
+
+
+SLEW_SPEED = 50.0  # gon/s, effective speed including acceleration for the short moves between prisms
+HOME = (0.0, 200.0)  # hz, v in gon the instrument starts a set from, see HandlerAutoMeasurement.go_home
+MAX_2OPT_PASSES = 50
+
+
+def travel_times(hz, v, slew_speed=SLEW_SPEED):
+    d_hz = np.abs(wrap(hz[:, None] - hz[None, :]))
+    d_v = np.abs(v[:, None] - v[None, :])
+    return np.maximum(d_hz, d_v)/slew_speed
+
+
+def route_time(hz, v, order, start=HOME, slew_speed=SLEW_SPEED):
+    """
+    Predicted travel time in seconds when visiting the aims in order, starting at start.
+    """
+    hz = np.concatenate(([start[0]], np.asarray(hz, dtype=np.float64)[order]))
+    v = np.concatenate(([start[1]], np.asarray(v, dtype=np.float64)[order]))
+    d_hz = np.abs(wrap(np.diff(hz)))
+    d_v = np.abs(np.diff(v))
+    return float(np.maximum(d_hz, d_v).sum()/slew_speed)
+
+
+def plan_group(hz, v, start, slew_speed=SLEW_SPEED):
+    """
+    :return: visiting order (indices into hz, v) of an open tour from start
+    """
+    n = len(hz)
+    if n < 2:
+        return np.arange(n)
+
+    # node 0 is the start, node n + 1 a free end with zero cost to everyone so 2-opt can also reverse the tail
+    costs = np.zeros((n + 2, n + 2))
+    costs[:n + 1, :n + 1] = travel_times(np.concatenate(([start[0]], hz)), np.concatenate(([start[1]], v)),
+                                         slew_speed)
+
+    path = [0]
+    unvisited = np.ones(n + 1, dtype=bool)
+    unvisited[0] = False
+    for _ in range(n):
+        candidates = np.where(unvisited, costs[path[-1], :n + 1], np.inf)
+        path.append(int(np.argmin(candidates)))
+        unvisited[path[-1]] = False
+    path = np.array(path + [n + 1])
+
+    for _ in range(MAX_2OPT_PASSES):
+        improved = False
+        for i in range(1, n):
+            # gain of reversing path[i:j + 1] for all j at once
+            a, b = path[i - 1], path[i]
+            c, d = path[i + 1:n + 1], path[i + 2:n + 2]
+            delta = costs[a, c] + costs[b, d] - costs[a, b] - costs[c, d]
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                path[i:i + j + 2] = path[i:i + j + 2][::-1]
+                improved = True
+        if not improved:
+            break
+    return path[1:n + 1] - 1
+
+
+def plan_route(hz, v, start=HOME, slew_speed=SLEW_SPEED, groups=None):
+    """
+    Plans face I aims (v <= 200 gon) first and face II aims afterwards, each face starting where the previous one
+    ended.
+    :param groups: group of every aim, within a face the aims of a group are visited one after the other and the
+        groups in the order they first appear
+    :return: (visiting order as indices into hz and v, predicted travel time in seconds)
+    """
+    hz, v = np.asarray(hz, dtype=np.float64), np.asarray(v, dtype=np.float64)
+    groups = np.zeros(len(hz), dtype=np.int64) if groups is None else np.asarray(groups)
+    order = []
+    position = start
+    for face in (np.flatnonzero(v <= 200), np.flatnonzero(v > 200)):
+        _, first = np.unique(groups[face], return_index=True)
+        for group in groups[face][np.sort(first)]:
+            members = face[groups[face] == group]
+            group_order = members[plan_group(hz[members], v[members], position, slew_speed)]
+            order.extend(group_order)
+            position = (hz[group_order[-1]], v[group_order[-1]])
+    order = np.array(order, dtype=np.int64)
+    return order, route_time(hz, v, order, start=start, slew_speed=slew_speed)
@@ -0,0 +1,211 @@
+"""
+Aims of a setup held column wise: one structured NumPy array for the numbers and flags of the aims as set up, one
+list for their names. A table selects rows of these arrays and marks which of them are measured in face II, the
+face II direction (hz + 200 mod 400, 400 - v) is computed when asked for. Indexing, reordering and adding the second
+circle therefore never copy aims.
+
+AimTable behaves like the list of Aim objects it replaces, indexing and iterating give read-only AimRows with the
+fields of Aim, indexing with a slice, index array or mask gives a table again. The AimRows of all aims as set up, in
+face I and in face II, are made in one pass over the columns when first asked for and shared by all tables selected
+from the same data, so the tables selected for every set only pick existing rows. Code working on all aims at once
+uses the columns:
+
+    aims = AimTable.from_aims([Aim("P1", 12.3, 98.7, 0, 3)]).with_second_circle()
+    aims.hz, aims.v, aims.column("priority")
+"""
+
+import collections
+import itertools
+
+import numpy as np
+
+from geocom_dicts import *
+
+
+AIM_DTYPE = np.dtype([
+    ("hz", np.float64),  # gon
+    ("v", np.float64),  # gon
+    ("target", np.int8),  # BAP_TARGET_TYPE
+    ("prism", np.int8),  # PrismType, -1 if not defined
+    ("group", np.int16),  # index into AimTable.groups
+    ("every", np.uint16),  # measured in every n-th full set
+    ("atr", np.bool_),  # automatic target recognition for reflector aims
+    ("retries", np.int8),  # repetitions at the end of the set if failed, -1 for the default of the handler
+    ("face_one_only", np.bool_),  # not measured again in face II
+    ("priority", np.bool_),  # also measured in the priority sets
+])
+
+
+def face_two(hz, v):
+    # works on scalars and arrays alike
+    return (hz + 200) % 400, 400 - v
+
+
+class Aim:
+    __slots__ = ("name", "hz", "v", "target", "prism", "priority", "group", "every", "atr", "retries",
+                 "face_one_only")
+
+    def __init__(self, name, hz, v, target: BAP_TARGET_TYPE, prism: PrismType, priority=False, group="", every=1,
+                 atr=True, retries=None, face_one_only=False):
+        self.name = name
+        self.hz = hz
+        self.v = v
+        self.target = target
+        self.prism = prism
+        self.priority = priority  # also measured in the priority sets between the full sets
+        self.group = group
+        self.every = every
+        self.atr = atr
+        self.retries = retries  # None for the default of the handler
+        self.face_one_only = face_one_only
+
+
+AimRow = collections.namedtuple("AimRow", Aim.__slots__)  # read-only Aim of an AimTable
+
+
+class AimTable:
+    def __init__(self, names=(), data=None, groups=None, rows=None, face_two=None, shared=None):
+        """
+        :param names: names of the rows of data
+        :param data: AIM_DTYPE array of the aims as set up, shared between the tables derived from this one
+        :param rows: indices into data in measuring order, all rows of data if None
+        :param face_two: True where the row is measured in face II, face I only if None
+        :param shared: dict of the tables on the same data, holds their AimRows once made
+        """
+        self.names = names if isinstance(names, list) else list(names)
+        self.data = np.zeros(len(self.names), dtype=AIM_DTYPE) if data is None else data
+        self.groups = [""] if groups is None else groups  # group names, "" for aims without group
+        self.rows = np.arange(len(self.data)) if rows is None else rows
+        self.face_two = np.zeros(len(self.rows), dtype=np.bool_) if face_two is None else face_two
+        self.shared = {} if shared is None else shared
+        self.cached_rows = None
+
+    @classmethod
+    def from_aims(cls, aims):
+        table = cls()
+        table.extend(aims)
+        return table
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.aim_rows())
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.aim(index)
+        if not isinstance(index, slice):
+            index = np.asarray(index)
+            if index.dtype == np.bool_:
+                index = np.flatnonzero(index)
+        return AimTable(self.names, self.data, self.groups, self.rows[index], self.face_two[index], self.shared)
+
+    def __add__(self, other):
+        table = AimTable(self.names, self.data, self.groups, self.rows, self.face_two)
+        table.extend(other)
+        return table
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    @property
+    def hz(self):
+        hz = self.data["hz"][self.rows]
+        return np.where(self.face_two, (hz + 200) % 400, hz)
+
+    @property
+    def v(self):
+        v = self.data["v"][self.rows]
+        return np.where(self.face_two, 400 - v, v)
+
+    def column(self, name):
+        return self.data[name][self.rows]
+
+    def names_in_order(self):
+        names = self.names
+        return [names[row] for row in self.rows.tolist()]
+
+    def aim(self, i):
+        return self.aim_rows()[i]
+
+    def aim_rows(self):
+        """
+        :return: list of AimRow in measuring order, picked from the rows of data_rows
+        """
+        if self.cached_rows is None:
+            # data_rows holds face I then face II, face II rows are len(data) further on
+            self.cached_rows = list(map(self.data_rows().__getitem__,
+                                        (self.rows + self.face_two * len(self.data)).tolist()))
+        return self.cached_rows
+
+    def data_rows(self):
+        """
+        :return: AimRows of all rows of data in face I followed by the same in face II, made from the columns converted
+            to Python lists on first use and kept for all tables on data
+        """
+        if "rows" not in self.shared:
+            data = self.data
+            groups = self.groups
+            hz, v = data["hz"], data["v"]
+            columns = [self.names, hz.tolist(), v.tolist(), data["target"].tolist(), data["prism"].tolist(),
+                       data["priority"].tolist(), [groups[group] for group in data["group"].tolist()],
+                       data["every"].tolist(), data["atr"].tolist(),
+                       [None if retries < 0 else retries for retries in data["retries"].tolist()],
+                       data["face_one_only"].tolist()]
+            # tuple.__new__ skips the argument handling of the named tuple constructor
+            rows = list(map(tuple.__new__, itertools.repeat(AimRow), zip(*columns)))
+            columns[1], columns[2] = (x.tolist() for x in face_two(hz, v))
+            rows.extend(map(tuple.__new__, itertools.repeat(AimRow), zip(*columns)))
+            self.shared["rows"] = rows
+        return self.shared["rows"]
+
+    def group_index(self, group):
+        if group not in self.groups:
+            self.groups = self.groups + [group]  # the list may be shared with other tables
+        return self.groups.index(group)
+
+    def append(self, aim):
+        self.extend([aim])
+
+    def extend(self, aims):
+        if isinstance(aims, AimTable):
+            groups = np.array([self.group_index(group) for group in aims.groups], dtype=np.int16)
+            data = aims.data.copy()
+            data["group"] = groups[data["group"]]
+            self.rows = np.concatenate((self.rows, aims.rows + len(self.data)))
+            self.face_two = np.concatenate((self.face_two, aims.face_two))
+            self.names = self.names + aims.names
+            self.data = np.concatenate((self.data, data))
+            self.shared = {}
+            self.cached_rows = None
+            return
+
+        aims = list(aims)
+        data = np.zeros(len(aims), dtype=AIM_DTYPE)
+        for row, aim in zip(data, aims):
+            row["hz"], row["v"], row["target"], row["prism"] = aim.hz, aim.v, aim.target, aim.prism
+            row["group"] = self.group_index(aim.group)
+            row["every"] = aim.every
+            row["atr"] = aim.atr
+            row["retries"] = -1 if aim.retries is None else aim.retries
+            row["face_one_only"] = aim.face_one_only
+            row["priority"] = aim.priority
+        self.rows = np.concatenate((self.rows, np.arange(len(self.data), len(self.data) + len(aims))))
+        self.face_two = np.concatenate((self.face_two, np.zeros(len(aims), dtype=np.bool_)))
+        self.names = self.names + [aim.name for aim in aims]
+        self.data = np.concatenate((self.data, data))
+        self.shared = {}
+        self.cached_rows = None
+
+    def select(self, mask):
+        return self[np.asarray(mask, dtype=np.bool_)]
+
+    def with_second_circle(self):
+        """
+        The aims followed by the face II aims in reverse order, face_one_only aims are left out in face II.
+        """
+        second = np.flatnonzero(~self.column("face_one_only"))[::-1]
+        return AimTable(self.names, self.data, self.groups, np.concatenate((self.rows, self.rows[second])),
+                        np.concatenate((self.face_two, ~self.face_two[second])), self.shared)
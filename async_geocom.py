@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+
+from geocom import GeoCom, MAX_TRANSACTION_ID, REPLY_TERMINATOR
+from instrumentation import rpc_number
+from logger import log
+from transport import TransportError
+
+
+class AsyncGeoCom(GeoCom):
+    """
+    asyncio GeoCOM client. Every request is sent as %R1Q,<rpc>,<trid>: and its reply is matched by the echoed
+    transaction id, so independent requests can be queued back to back. All GeoCom methods return awaitables here:
+
+        angle1_rsp, temperature_rsp = await asyncio.gather(geocom.TMC_GetAngle1(mode), geocom.CSV_GetIntTemp())
+
+    The instrument works off requests one after another, so the timeout of a request only starts once the
+    request queued before it has finished. AdaptiveTimeouts learn from the same span, from the end of the previous
+    request to the reply.
+    """
+    def __init__(self, sercon, adaptive_timeouts=None):
+        super().__init__(sercon, adaptive_timeouts)
+        self.pending = {}  # trid -> (future, decode)
+        self.transaction_id = 0
+        self.last_future = None
+        self.slots = None
+        self.loop = None
+        self.reader = None
+        self.running = False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(MAX_TRANSACTION_ID)  # one in flight request per transaction id
+        self.running = True
+        self.reader = threading.Thread(target=self.read_replies, daemon=True)
+        self.reader.start()
+
+    async def stop(self):
+        self.running = False
+        await self.loop.run_in_executor(None, self.reader.join)
+
+    def read_replies(self):
+        # runs in its own thread, hands complete reply lines to the event loop
+        buffer = bytearray()
+        while self.running:
+            try:
+                chunk = self.sercon.ser.read(self.sercon.ser.in_waiting or 1)
+            except TransportError:
+                log.error("USB unplugged!")
+                buffer.clear()
+                self.sercon.establish_serial_connection()
+                continue
+
+            buffer += chunk
+            while True:
+                end = buffer.find(REPLY_TERMINATOR)
+                if end < 0:
+                    break
+                line = bytes(buffer[:end])
+                del buffer[:end + len(REPLY_TERMINATOR)]
+                self.loop.call_soon_threadsafe(self.dispatch, line)
+
+    def dispatch(self, line):
+        try:
+            line = line.decode("UTF-8")
+        except (UnicodeDecodeError, ):
+            log.error("Geocom response garbled")
+            return
+
+        header, separator, body = line.partition(':')
+        header_fields = header.split(',')
+        if not header.startswith("%R1P") or len(header_fields) != 3:
+            return  # line noise
+
+        entry = self.pending.pop(header_fields[2], None)
+        if entry is None:
+            log.warning("Discarding stale Geocom response " + line)
+            return
+
+        future, decode = entry
+        if future.done():
+            return
+        if not separator:
+            log.error("Geocom response index error")
+            future.set_result(False)
+        else:
+            future.set_result(decode(body))
+
+    def next_transaction_id(self):
+        while True:
+            self.transaction_id = self.transaction_id % MAX_TRANSACTION_ID + 1
+            if str(self.transaction_id) not in self.pending:
+                return str(self.transaction_id)
+
+    async def request(self, string, decode, timeout=10):
+        """
+        One attempt of a request, returns the decoded reply, False if it failed or None if it timed out.
+        """
+        async with self.slots:
+            trid = self.next_transaction_id()
+            header, separator, params = string.partition(':')
+
+            future = self.loop.create_future()
+            previous, self.last_future = self.last_future, future
+            self.pending[trid] = (future, decode)
+            try:
+                try:
+                    self.sercon.ser.write((header + ',' + trid + separator + params).encode("UTF-8"))
+                except TransportError:
+                    log.error("USB unplugged!")
+                    return False
+
+                if previous is not None and not previous.done():
+                    await asyncio.wait([previous])
+                start = time.perf_counter()
+                try:
+                    recv = await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    self.sercon.timeouts += 1
+                    log.error("Geocom Timeout, no response")
+                    return None
+                if recv and self.adaptive_timeouts is not None:
+                    self.adaptive_timeouts.observe(string, time.perf_counter() - start)
+                return recv
+            finally:
+                self.pending.pop(trid, None)
+                if not future.done():
+                    future.cancel()
+
+    async def save_send_and_receive(self, string, decode, retry_amount=3, timeout=10):
+        start = time.perf_counter()
+        rpc = rpc_number(string)
+        attempts = 0
+        timeouts = 0
+
+        recv = False
+        while retry_amount:
+            attempts += 1
+            attempt_timeout = timeout
+            if self.adaptive_timeouts is not None and attempts == 1:
+                attempt_timeout = self.adaptive_timeouts.timeout(string, timeout)  # retries fall back to the fixed one
+            recv = await self.request(string, decode, timeout=attempt_timeout)
+            if recv:
+                break
+            if recv is None:
+                timeouts += 1
+            log.error("Retrying command")
+            retry_amount -= 1
+        else:
+            log.error("Geocom did not receive response")
+
+        # bytes are not attributed to single requests here, several share the link at the same time
+        self.sercon.metrics.rpc(rpc, time.perf_counter() - start, retries=attempts - 1,
+                                timeouts=timeouts, rc=recv.rc if recv else None)
+        return recv if recv else False
+
+    async def pipeline(self, *calls):
+        return list(await asyncio.gather(*[getattr(self, call[0])(*call[1:]) for call in calls]))
+
+
+class PipelinedGeoCom(GeoCom):
+    """
+    Blocking GeoCom for HandlerAutoMeasurement backed by an AsyncGeoCom whose event loop runs in a background thread.
+    pipeline() queues its requests back to back instead of waiting out one round trip after another.
+    adaptive_timeouts is the one of the client, observed and used in the event loop thread.
+    """
+    def __init__(self, sercon, adaptive_timeouts=None):
+        self.client = AsyncGeoCom(sercon)
+        super().__init__(sercon, adaptive_timeouts)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.run(self.client.start())
+
+    @property
+    def adaptive_timeouts(self):
+        return self.client.adaptive_timeouts
+
+    @adaptive_timeouts.setter
+    def adaptive_timeouts(self, adaptive_timeouts):
+        self.client.adaptive_timeouts = adaptive_timeouts
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        self.run(self.client.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def save_send_and_receive(self, string, decode, retry_amount=3, timeout=10):
+        return self.run(self.client.save_send_and_receive(string, decode, retry_amount=retry_amount,
+                                                          timeout=timeout))
+
+    def pipeline(self, *calls):
+        return self.run(self.client.pipeline(*calls))
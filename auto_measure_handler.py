@@ -1,53 +1,98 @@
-import time
-import copy
-import datetime as dt
 import os
-import pysftp
-
+import time
 from geocom import GeoCom
 from geocom_dicts import *
 from geocom import GON2RAD
+from adaptive import wait_for_compensator
 from logger import log
+from rotating_file import days
+from measurement_store import MeasurementStore, MeasurementRecord
+from set_reduction import reduce_set_records, write_reduced_set, FLAG_INCOMPLETE
+from aim_planner import plan_route, route_time, HOME
+from aim_table import Aim, AimTable
+from scheduler import SetScheduler
+from deformation_alerts import DeformationMonitor, AlertSink
+from telemetry import Telemetry
+from recovery import classify, SetCheckpoint, RETRY_NOW, RETRY_LATER, REINITIALIZE
+from uploader import UploadWorker, REMOTE_MEASUREMENT_FOLDER, REMOTE_LOG_FOLDER
 
 
 MEASUREMENT_FOLDER = "measurements/"
-COMPENSATOR_CHILL_TIME = 2
+COMPENSATOR_CHILL_TIME = 2  # s, fixed wait or upper bound of the incline polling when adaptive
+AIM_PAUSE = 1  # s after every aim, skipped when adaptive
+RETRY_NOW_AMOUNT = 2  # repetitions of an aim right away while the instrument reports busy or timeout
+AIM_RETRY_AMOUNT = 2  # repetitions of a failed aim at the end of the set
+CHECKPOINT_MAX_AGE = 60*60  # s, an interrupted set is resumed within this time if measuring without interval
+DEFORMATION_STATE_FILE_NAME = "deformation_state.json"
 
 
-class Aim:
-    def __init__(self, name, hz, v, target: BAP_TARGET_TYPE, prism: PrismType):
-        self.name = name
-        self.hz = hz
-        self.v = v
-        self.target = target
-        self.prism = prism
+def value_or_nan(value):
+    return float("nan") if value is None else value
 
 
 class HandlerAutoMeasurement:
-    def __init__(self, geocom: GeoCom):
+    def __init__(self, geocom: GeoCom, adaptive=False, uploader=None, name=None, alert_sink=None):
+        """
+        :param adaptive: poll the compensator until stable instead of fixed waits, see adaptive.py
+        :param uploader: UploadWorker the files are queued on, a new one is started if None
+        :param name: instrument name if several are run, measurements are kept and uploaded in a subfolder of it
+        :param alert_sink: file path or tcp://host:port deformation alerts are sent to, see deformation_alerts.py.
+            Alerts are only logged if None
+        """
         self.geocom = geocom
-        self.aims = []
+        self.metrics = geocom.sercon.metrics  # one per instrument, see instrumentation.py
+        self.adaptive = adaptive
+        self.name = name
+        if name is None:
+            self.measurement_folder = MEASUREMENT_FOLDER
+            self.remote_measurement_folder = REMOTE_MEASUREMENT_FOLDER
+            self.remote_log_folder = REMOTE_LOG_FOLDER
+        else:
+            self.measurement_folder = MEASUREMENT_FOLDER + name + "/"
+            self.remote_measurement_folder = REMOTE_MEASUREMENT_FOLDER + "/" + name
+            self.remote_log_folder = REMOTE_LOG_FOLDER + "/" + name
+        self.owns_uploader = uploader is None  # a shared uploader is stopped by its owner
+        if uploader is None:
+            uploader = UploadWorker()
+            uploader.start()
+        self.uploader = uploader
+        self.aims = AimTable()
         self.last_start_time = None
-
-        self.current_measurement_file_name = MEASUREMENT_FOLDER + dt.datetime.now().strftime("%Y%m%d") + ".txt"
-
-        if not os.path.isdir(MEASUREMENT_FOLDER):
-            os.mkdir(MEASUREMENT_FOLDER)
-            with open(MEASUREMENT_FOLDER + "README.txt", 'w') as f:
-                f.write("One Measurement file for each day is created. The format is given by\n"
-                        "str_datetime str_aim_name str_hz_angle[g] str_hz_angle_raw[g] str_v_angle[g] str_v_angle_raw[g]"
-                        " str_slope_dist[m] str_cross_incline[g] str_length_incline[g] str_internal_temperature[°C]\n")
+        self.last_set_end_time = None
+        self.sets_completed = 0
+        self.last_upload_day = None
+        self.closed = False
+
+        self.store = MeasurementStore(self.measurement_folder)  # recovers measurements of a crashed run
+        self.checkpoint = SetCheckpoint(self.measurement_folder, CHECKPOINT_MAX_AGE)
+
+        sink = None
+        if alert_sink is not None:
+            sink = AlertSink(alert_sink, metrics=self.metrics)
+            sink.start()
+        self.deformation_monitor = DeformationMonitor(sink, os.path.join(self.measurement_folder,
+                                                                         DEFORMATION_STATE_FILE_NAME))
+        # internal temperature of the records comes from its latest sample
+        self.telemetry = Telemetry(metrics=self.metrics)
 
     def add_second_circle(self):
-        for aim in reversed(copy.deepcopy(self.aims)):
-            new_aim = copy.deepcopy(aim)
-            new_aim.hz += 200
-            new_aim.v = 400 - new_aim.v
-            self.aims.append(new_aim)
+        self.aims = self.aims.with_second_circle()
+
+    def optimize_aim_order(self):
+        """
+        Reorders the aims to minimise motor travel, face I aims stay before face II aims and the aims of a group
+        stay together.
+        """
+        hz, v = self.aims.hz, self.aims.v
+        order, planned_time = plan_route(hz, v, start=HOME, groups=self.aims.column("group"))
+        input_time = route_time(hz, v, list(range(len(self.aims))), start=HOME)
+        self.aims = self.aims[order]
+        log.info("Optimized aim order, predicted travel " + str(round(planned_time, 1)) + "s instead of " +
+                 str(round(input_time, 1)) + "s, saving " + str(round(input_time - planned_time, 1)) + "s per set")
 
     def go_home(self):
         log.info("Going to home position")
-        self.geocom.AUT_MakePositioning(0, 200, AUT_POSMODE["AUT_PRECISE"], AUT_ATRMODE["AUT_POSITION"])
+        self.geocom.AUT_MakePositioning(HOME[0], HOME[1], AUT_POSMODE["AUT_PRECISE"], AUT_ATRMODE["AUT_POSITION"])
 
     def initialize(self, retry_amount=3):
         current_try = 0
@@ -56,13 +101,15 @@ class HandlerAutoMeasurement:
 
             if current_try == 2:
                 log.info("Initializing failed, trying again in 10 seconds")
-                time.sleep(10)
+                self.geocom.sercon.sleep(10)
             elif current_try == 3:
                 log.info("Initializing failed, trying again in 90 seconds")
-                time.sleep(90)
+                self.geocom.sercon.sleep(90)
             elif current_try > 3:
                 log.info("Initializing failed, trying again in 10 min")
-                time.sleep(10*60)
+                self.geocom.sercon.sleep(10*60)
+
+            self.geocom.invalidate_cache()  # initializing means the instrument state is unknown
 
             if not self.geocom.TMC_SetInclineSwitch(ON_OFF_TYPE["ON"]):  # if off, no values for length and cross inclination
                 continue
@@ -79,163 +126,272 @@ class HandlerAutoMeasurement:
             log.info("Successfully (re)initialized TS")
             break
         else:
-            log.info("Initializing failed, stopping program")
-            self.upload_measurement_files_and_log()
-            exit()
+            log.error("Initializing failed")
             return False
         return True
 
+    def reduce_set(self, records):
+        if not records:
+            return
+        reduced, names = reduce_set_records(records)
+        if (reduced["flags"] & FLAG_INCOMPLETE).all():
+            return  # no aim measured in both faces
+        write_reduced_set(self.measurement_folder, reduced, names)
+
+    @property
+    def current_measurement_file_name(self):
+        return self.measurement_folder + days.today() + ".txt"
+
     def upload_measurement_files_and_log(self):
-        try:
-            srv = pysftp.Connection(host="matlab.tugraz.at", username="atraxoo", password=None)  # enter password if no ssh key in authorized keys
-            with srv.cd('/home/a/atraxoo/Desktop/Sensorik/measurements'):
-                srv.put(self.current_measurement_file_name)
-            with srv.cd('/home/a/atraxoo/Desktop/Sensorik/logs'):
-                srv.put(log.get_current_file_name())
-            srv.close()
-            log.info("Uploaded file via SFTP")
-        except:
-            log.error("Failed updating file via SFTP")
-
-    def run(self, interval=None, set_amount=None, distance_measurement_retry_amount=2):
+        # returns at once, the upload worker sends the appended bytes in the background. The files of the day of the
+        # last upload go as well, a set or a wait over midnight appended their last lines since.
+        today = days.today()
+        upload_days = [today] if self.last_upload_day in (None, today) else [self.last_upload_day, today]
+        for day in upload_days:
+            self.uploader.enqueue(self.measurement_folder + day + ".txt", self.remote_measurement_folder)
+            self.uploader.enqueue(log.get_file_name(day, self.name), self.remote_log_folder)
+        self.last_upload_day = today
+
+    def measure_aim(self, aim, distance_measurement_retry_amount=2):
+        """
+        One attempt of an aim, from setting its target type to reading the temperature.
+        :return: (record, action), record is None if no measurement was read, action is None on success or the
+            recovery action of the failed step, see recovery.classify
+        """
+        # independent setters, queued back to back if the geocom pipelines
+        setup_calls = [("AUS_SetUserAtrState", ON_OFF_TYPE["ON"]),  # important that this is here and first to execute
+                       ("BAP_SetTargetType", aim.target)]
+        if aim.target == BAP_TARGET_TYPE["BAP_REFL_USE"]:
+            setup_calls.append(("BAP_SetPrismType", aim.prism))
+
+        with self.phase("setup"):
+            setup_rsps = self.geocom.pipeline(*setup_calls)
+        for rsp in setup_rsps:
+            action = classify(rsp)
+            if action is not None:
+                log.error("Setting up aim failed (" + (str(rsp.rc) if rsp else "no response") + ")")
+                return None, action
+
+        atr = aim.atr and aim.target == BAP_TARGET_TYPE["BAP_REFL_USE"]
+        if atr:
+            atr_mode = AUT_ATRMODE["AUT_TARGET"]
+        else:
+            atr_mode = AUT_ATRMODE["AUT_POSITION"]
+        with self.phase("positioning"):
+            positioning_rsp = self.geocom.AUT_MakePositioning(aim.hz, aim.v, AUT_POSMODE["AUT_PRECISE"], atr_mode)
+        action = classify(positioning_rsp)
+        if action is not None:
+            log.error("Positioning failed (" + (str(positioning_rsp.rc) if positioning_rsp else "no response") + ")")
+            return None, action
+
+        if atr:
+            with self.phase("fine_adjust"):
+                fine_adjust_rsp = self.geocom.AUT_FineAdjust(2, 2)
+            action = classify(fine_adjust_rsp)
+            if action is not None:
+                log.error("Fine adjust failed (" + (str(fine_adjust_rsp.rc) if fine_adjust_rsp else "no response") +
+                          ")")
+                return None, action
+
+        full_measure_rsp = False
+        for distance_measurement_retry_i in range(max(distance_measurement_retry_amount, 1)):  # at least one
+            if distance_measurement_retry_i:
+                log.info("Retrying")
+            with self.phase("measure"):
+                do_measure_rsp = self.geocom.TMC_DoMeasure(TMC_MEASURE_PRG["TMC_DEF_DIST"], TMC_INCLINE_PRG["TMC_AUTO_INC"])
+            if not do_measure_rsp:
+                return None, REINITIALIZE
+
+            if self.adaptive:
+                with self.phase("compensator_wait"):
+                    wait_for_compensator(self.geocom, COMPENSATOR_CHILL_TIME)
+            else:
+                # let compensator chill a bit
+                self.pause("compensator_wait", COMPENSATOR_CHILL_TIME)
+
+            timeout = 15000  # ms
+            with self.phase("measure"):
+                full_measure_rsp = self.geocom.TMC_GetFullMeas(timeout, TMC_INCLINE_PRG["TMC_AUTO_INC"])
+
+            if not full_measure_rsp:
+                return None, REINITIALIZE  # failed communication
+
+            if full_measure_rsp.ok:
+                break  # successful distance measurement
+            log.error("Distance measurement Failed")
+
+        if full_measure_rsp.hz is None:
+            log.error("Full measurement returned no values (" + str(full_measure_rsp.rc) + ")")
+            return None, classify(full_measure_rsp) or RETRY_LATER
+
+        with self.phase("read"):
+            angle1_rsp = self.geocom.TMC_GetAngle1(TMC_INCLINE_PRG["TMC_AUTO_INC"])
+
+        if not angle1_rsp:
+            return None, REINITIALIZE
+
+        if not full_measure_rsp.ok:
+            log.error("Distance measurement failed (" + str(full_measure_rsp.rc) + ")")
+        if not angle1_rsp.ok:
+            log.error("Angle response failed (" + str(angle1_rsp.rc) + ")")
+
+        # sampled between the sets, see telemetry.py
+        internal_temperature, rc_temperature = self.telemetry.temperature()
+
+        # a reply carrying only its failed return code has no values, they are stored as NaN and null by the rc
+        record = MeasurementRecord(
+            time.time(), aim.name, full_measure_rsp.hz, value_or_nan(angle1_rsp.hz), full_measure_rsp.v,
+            value_or_nan(angle1_rsp.v), full_measure_rsp.slope_dist, full_measure_rsp.cross_incline,
+            full_measure_rsp.length_incline, internal_temperature, rc_full_measure=full_measure_rsp.rc,
+            rc_angle=angle1_rsp.rc, rc_temperature=rc_temperature)
+        # a failed distance is measured again later, the angles are kept if the aim never succeeds
+        return record, classify(full_measure_rsp)
+
+    def measure_set(self, aims, full_set, distance_measurement_retry_amount=2):
+        """
+        Measures the aims one after another. Aims that failed are tried again after the others, a set interrupted
+        by a restart of the process continues with the aims still missing.
+        :return: records of the set, None if the instrument could not be initialized again
+        """
+        set_records = self.checkpoint.resume(aims, full_set)
+        if set_records is None:
+            set_records = []
+            self.checkpoint.start(aims, full_set, self.sets_completed)
+        else:
+            log.info("Resuming set, " + str(len(self.checkpoint.done())) + " of " + str(len(aims)) +
+                     " aims measured before the restart")
+
+        queue = [i for i in range(len(aims)) if i not in self.checkpoint.done()]
+        attempts = {}
+        while queue:
+            index = queue.pop(0)
+            aim = aims[index]
+            attempts[index] = attempts.get(index, 0) + 1
+            log.info("Measuring " + aim.name)
+
+            for _ in range(RETRY_NOW_AMOUNT + 1):
+                record, action = self.measure_aim(aim, distance_measurement_retry_amount)
+                if action != RETRY_NOW:
+                    break
+                log.warning("Instrument busy, trying " + aim.name + " again")
+
+            if action == REINITIALIZE and not self.initialize():
+                return None  # progress stays checkpointed
+
+            last_attempt = attempts[index] > (AIM_RETRY_AMOUNT if aim.retries is None else aim.retries)
+            if record is not None and (action is None or last_attempt):
+                self.store.append(record)
+                set_records.append(record)
+                self.checkpoint.mark_done(index, record)
+                with self.phase("deformation_check"):
+                    self.deformation_monitor.update(record)
+                if not self.adaptive:
+                    self.pause("aim_pause", AIM_PAUSE)
+            elif not last_attempt:
+                log.warning("Trying " + aim.name + " again at the end of the set")
+                queue.append(index)
+            else:
+                log.error("Giving up on " + aim.name + " for this set")
+        return set_records
+
+    def run(self, interval=None, set_amount=None, distance_measurement_retry_amount=2, overrun_policy="skip",
+            priority_interval=None, align=True, control=None):
         """
         :param interval: in seconds or None for continuous measuring
-        :param set_amount: None for infinite amount of sets
-        :param distance_measurement_retry_amount:
+        :param set_amount: None for infinite amount of sets, priority sets are not counted
+        :param distance_measurement_retry_amount: distance measurement attempts per aim, one if 0
+        :param overrun_policy: what happens if a set is not finished at the next epoch, see scheduler.py
+        :param priority_interval: seconds between sets of the priority aims only, None for no priority sets
+        :param align: start sets at multiples of interval on the wall clock
+        :param control: RunControl of daemon.py, its commands are taken between sets and cut the wait for the next
+            set short
+        :return: True if all sets are measured or control stopped the run, False if the instrument could not be
+            initialized again
         """
+        scheduler = None
+        if interval is not None:
+            sleep = self.geocom.sercon.sleep if control is None else control.sleep
+            scheduler = SetScheduler(interval, overrun_policy=overrun_policy, priority_interval=priority_interval,
+                                     align=align, clock=self.geocom.sercon.clock, sleep=sleep,
+                                     wall=self.geocom.sercon.wall, metrics=self.metrics)
+        self.checkpoint.max_age = interval or CHECKPOINT_MAX_AGE
+
+        interrupted = self.checkpoint.interrupted()  # a set interrupted by a restart goes on right away
+        if self.telemetry.due(self.geocom.sercon.clock()):
+            self.sample_telemetry()
         while set_amount is None or set_amount > 0:
+            if control is not None and not control.between_sets():
+                log.info("Measurements stopped by control command")
+                break
+            full_set = True
+            if interrupted is not None:
+                # the same kind of set with the same aims due, or the checkpoint would not match them
+                full_set, self.sets_completed = interrupted
+                interrupted = None
+            elif scheduler is not None and not (control is not None and control.take_trigger()):
+                slot = scheduler.wait()
+                if slot is None:
+                    continue  # woken up by a control command before the epoch
+                full_set = slot.full
             self.last_start_time = time.time()
+            set_start = self.geocom.sercon.clock()
+
+            if full_set:
+                log.info("Starting new set")
+                aims = self.aims.select(self.sets_completed % self.aims.column("every") == 0)
+            else:
+                log.info("Starting new priority set")
+                aims = self.aims.select(self.aims.column("priority"))
+
+            # the instrument may have been power cycled since the last set without the port noticing
+            self.geocom.invalidate_cache()
+            set_records = self.measure_set(aims, full_set, distance_measurement_retry_amount)
+            if set_records is None:
+                log.error("Initializing failed, stopping measurements")
+                return False
+
+            self.store.commit_set()
+            self.checkpoint.clear()
+            self.last_set_end_time = time.time()
+            self.metrics.record_phase("set" if full_set else "priority_set", self.geocom.sercon.clock() - set_start)
+            self.reduce_set(set_records)
+            self.deformation_monitor.save()
+            self.metrics.dump_set()
+            with self.phase("upload"):
+                self.upload_measurement_files_and_log()
+            if not full_set:
+                continue
+            self.sets_completed += 1
 
-            self.current_measurement_file_name = MEASUREMENT_FOLDER + dt.datetime.now().strftime("%Y%m%d") + ".txt"
-            log.set_new_file_name()
-
-            log.info("Starting new set")
-
-            for aim in self.aims:
-                log.info("Measuring " + aim.name)
-
-                if not self.geocom.AUS_SetUserAtrState(ON_OFF_TYPE["ON"]):  # important that this is here and first to execute
-                    self.initialize()  # stops program if not initializing again
-                    continue
-
-                if not self.geocom.BAP_SetTargetType(aim.target):
-                    self.initialize()  # stops program if not initializing again
-                    continue
-
-                if aim.target == BAP_TARGET_TYPE["BAP_REFL_USE"]:
-                    if not self.geocom.BAP_SetPrismType(aim.prism):
-                        self.initialize()  # stops program if not initializing again
-                        continue
-
-                if aim.target == BAP_TARGET_TYPE["BAP_REFL_USE"]:
-                    if not self.geocom.AUT_MakePositioning(aim.hz, aim.v, AUT_POSMODE["AUT_PRECISE"],
-                                                    AUT_ATRMODE["AUT_TARGET"]):
-                        self.initialize()  # stops program if not initializing again
-                        continue
-                else:
-                    if not self.geocom.AUT_MakePositioning(aim.hz, aim.v, AUT_POSMODE["AUT_PRECISE"],
-                                                    AUT_ATRMODE["AUT_POSITION"]):
-                        self.initialize()  # stops program if not initializing again
-                        continue
-
-                if aim.target == BAP_TARGET_TYPE["BAP_REFL_USE"]:
-                    if not self.geocom.AUT_FineAdjust(2, 2):
-                        self.initialize()  # stops program if not initializing again
-                        continue
-
-                distance_measurement_retry_i = 0
-
-                full_measure_rsp = False
-                while distance_measurement_retry_i < distance_measurement_retry_amount:
-                    if not self.geocom.TMC_DoMeasure(TMC_MEASURE_PRG["TMC_DEF_DIST"], TMC_INCLINE_PRG["TMC_AUTO_INC"]):
-                        self.initialize()  # stops program if not initializing again
-                        continue
-
-                    time.sleep(COMPENSATOR_CHILL_TIME)  # let compensator chill a bit
-
-                    timeout = 15000  # ms
-                    # RC, Hz[double], V[double], AccAngle[double], C[double], L[double], AccIncl[double], SlopeDist[double], DistTime[double]
-                    full_measure_rsp = self.geocom.TMC_GetFullMeas(timeout, TMC_INCLINE_PRG["TMC_AUTO_INC"])
-
-                    if not full_measure_rsp:
-                        break  # failed communication breaking out
-
-                    distance_rsp_code = int(full_measure_rsp[0])
-
-                    if distance_rsp_code == 0:
-                        break  # successful distance measurement
-                    log.error("Distance measurement Failed")
-                    distance_measurement_retry_i += 1
-                    if distance_measurement_retry_i < distance_measurement_retry_amount:
-                        log.info("Retrying")
-
-                if not full_measure_rsp:
-                    self.initialize()  # stops program if not initializing again
-                    continue
-
-                rc_full_measure, hz_angle, v_angle, cross_incline, length_incline, slope_dist = int(
-                    full_measure_rsp[0]), float(full_measure_rsp[1]), float(full_measure_rsp[2]), float(
-                    full_measure_rsp[4]), float(full_measure_rsp[5]), float(full_measure_rsp[7])
-
-                # %R1P,0,0:RC,Hz[double],V[double],AngleAccuracy[double],AngleTime[long],CrossIncline[double],LengthIncline[double], AccuracyIncline[double],InclineTime[long],FaceDef[long]
-                angle1_rsp = self.geocom.TMC_GetAngle1(TMC_INCLINE_PRG["TMC_AUTO_INC"])
-
-                if not angle1_rsp:
-                    self.initialize()  # stops program if not initializing again
-                    continue
-
-                rc_getAngle1, hz_angle_raw, v_angle_raw = int(angle1_rsp[0]), float(angle1_rsp[1]), float(
-                            angle1_rsp[2])
-
-                temperature_rsp = self.geocom.CSV_GetIntTemp()
-
-                if not temperature_rsp:
-                    self.initialize()  # stops program if not initializing again
-                    continue
-
-                rc_temperature, internal_temperature = int(temperature_rsp[0]), float(temperature_rsp[1])
-
-                rt = 5  # round to
-                str_datetime = str(dt.datetime.now().strftime('%Y%m%d_%H%M%S'))
-                str_aim_name = aim.name
-                str_hz_angle = str(round(hz_angle/GON2RAD, rt))
-                str_hz_angle_raw = str(round(hz_angle_raw/GON2RAD, rt))
-                str_v_angle = str(round(v_angle/GON2RAD, rt))
-                str_v_angle_raw = str(round(v_angle_raw/GON2RAD, rt))
-                str_slope_dist = str(round(slope_dist, rt))
-                str_cross_incline = str(round(cross_incline/GON2RAD, rt))
-                str_length_incline = str(round(length_incline/GON2RAD, rt))
-                str_internal_temperature = str(round(internal_temperature, rt))
-
-                if rc_full_measure != 0:
-                    str_slope_dist = "NaN"
-                    log.error("Distance measurement failed (" + str(rc_full_measure) + ")")
-                if rc_getAngle1 != 0:
-                    str_hz_angle, str_hz_angle_raw, str_v_angle, str_v_angle_raw = "Nan", "Nan", "Nan", "Nan"
-                    log.error("Angle response failed (" + str(rc_getAngle1) + ")")
-                if rc_temperature != 0:
-                    str_internal_temperature = "Nan"
-                    log.error("Internal temperature measurement failed ( " + str(rc_temperature) + ")")
-
-                with open(self.current_measurement_file_name, 'a+') as f:
-                    f.write(str_datetime + ' ' + str_aim_name  + ' ' + str_hz_angle + ' ' + str_hz_angle_raw + ' '
-                            + str_v_angle + ' ' + str_v_angle_raw + ' ' + str_slope_dist + ' '
-                            + str_cross_incline + ' ' + str_length_incline + ' ' + str_internal_temperature + "\n")
-
-                time.sleep(1)
-
-            self.upload_measurement_files_and_log()
-
+            if self.telemetry.due(self.geocom.sercon.clock()):
+                self.sample_telemetry()  # still aimed at the last aim of the set, before the idle time
             if interval is not None:
-                # get in home position
+                # get in home position, the scheduler waits for the next epoch
                 self.go_home()
-
-                try:
-                    log.info("Sleeping for " + str(int(interval - (time.time() - self.last_start_time))) + "s")
-                    time.sleep(interval - (time.time() - self.last_start_time))
-                except ValueError:
-                    log.warning("Interval too short")
             if set_amount is not None:
                 set_amount -= 1
         else:
             log.info("Finished all sets")
+        return True
+
+    def sample_telemetry(self):
+        with self.phase("telemetry"):
+            self.telemetry.sample(self.geocom)
+
+    def phase(self, name):
+        # timed on the clock of the serial connection like the schedule, the simulated one of a benchmark or replay
+        return self.metrics.phase(name, self.geocom.sercon.clock)
+
+    def pause(self, name, seconds):
+        self.metrics.sleep(name, seconds, self.geocom.sercon.sleep, self.geocom.sercon.clock)
+
+    def close(self):
+        # called on every way out of the program, only the first call does anything
+        if self.closed:
+            return
+        self.closed = True
+        self.store.close()
+        self.deformation_monitor.close()
+        self.upload_measurement_files_and_log()
+        if self.owns_uploader:
+            self.uploader.stop(timeout=60)
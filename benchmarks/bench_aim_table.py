@@ -0,0 +1,95 @@
+"""
+Cost of building the aims of a set, adding the second circle and going through them, for the AimTable against the
+list of Aim objects with deep copies used before. "first iterate" goes through a table whose rows are not made yet,
+"set iterate" through a table selected from one that made them, as every set does, "iterate" through a table that
+made them already.
+
+    python benchmarks/bench_aim_table.py 100 1000 10000
+"""
+
+import copy
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aim_table import Aim, AimTable  # noqa: E402
+
+
+class LegacyAim:
+    def __init__(self, name, hz, v, target, prism):
+        self.name = name
+        self.hz = hz
+        self.v = v
+        self.target = target
+        self.prism = prism
+
+
+def legacy_set(rows):
+    aims = [LegacyAim(*row) for row in rows]
+    for aim in reversed(copy.deepcopy(aims)):
+        new_aim = copy.deepcopy(aim)
+        new_aim.hz += 200
+        new_aim.v = 400 - new_aim.v
+        aims.append(new_aim)
+    return aims
+
+
+def legacy_iterate(aims):
+    return sum(aim.hz + aim.v for aim in aims)
+
+
+def legacy_directions(aims):
+    return [aim.hz for aim in aims], [aim.v for aim in aims]
+
+
+def table_set(rows):
+    return AimTable.from_aims([Aim(*row) for row in rows]).with_second_circle()
+
+
+def table_iterate(aims):
+    return sum(aim.hz + aim.v for aim in aims)
+
+
+def table_first_iterate(aims):
+    return table_iterate(AimTable(aims.names, aims.data, aims.groups, aims.rows, aims.face_two))  # no rows made yet
+
+
+def table_set_iterate(aims):
+    return table_iterate(aims.select(np.ones(len(aims), dtype=np.bool_)))
+
+
+def table_directions(aims):
+    return aims.hz, aims.v
+
+
+def best_of(function, argument, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes):
+    print("aims     step            legacy [ms]  table [ms]")
+    for n in sizes:
+        rows = [("P" + str(i), random.uniform(0, 400), random.uniform(80, 120), 0, 3) for i in range(n)]
+        legacy, table = legacy_set(rows), table_set(rows)
+        for step, legacy_function, legacy_argument, table_function, table_argument in (
+                ("build", legacy_set, rows, table_set, rows),
+                ("first iterate", legacy_iterate, legacy, table_first_iterate, table),
+                ("set iterate", legacy_iterate, legacy, table_set_iterate, table),
+                ("iterate", legacy_iterate, legacy, table_iterate, table),
+                ("directions", legacy_directions, legacy, table_directions, table)):
+            print("%-8d %-15s %11.3f %11.3f" % (n, step, best_of(legacy_function, legacy_argument)*1000,
+                                                best_of(table_function, table_argument)*1000))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [100, 1000, 10000])
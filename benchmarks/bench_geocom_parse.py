@@ -0,0 +1,137 @@
+"""
+Cost of encoding the requests and parsing the replies of one aim (positioning, full measurement, angles,
+temperature), for the RPCS encoders and decoders against the string concatenation and split with casts at the call
+site used before. "encode" sends every direction once, as in the first set, "encode sets" the directions of
+AIM_COUNT aims in every set. Replies are taken from a trace if given, else generated.
+
+Decoding stays slower than the legacy parse, RPCS converts every field of a reply to its type while the legacy
+parse only converted the fields the handler read.
+
+    python benchmarks/bench_geocom_parse.py [TRACE]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from geocom_dicts import *  # noqa: E402
+from geocom_rpc import RPCS, GON2RAD  # noqa: E402
+
+REPLY_COUNT = 10000
+AIM_COUNT = 100
+
+
+def generated_replies(n):
+    replies = []
+    for _ in range(n):
+        hz, v = random.uniform(0, 2*3.14159), random.uniform(1.3, 1.8)
+        cross, length = random.gauss(0, 1e-5), random.gauss(0, 1e-5)
+        replies.append(("TMC_GetFullMeas", "0,%r,%r,1e-05,%r,%r,1e-05,%r,%r" % (
+            hz, v, cross, length, random.uniform(5, 500), round(random.uniform(0, 1), 3))))
+        replies.append(("TMC_GetAngle1", "0,%r,%r,1e-05,1000,%r,%r,1e-05,1000,0" % (hz, v, cross, length)))
+        replies.append(("CSV_GetIntTemp", "0,%r" % round(21.0 + random.gauss(0, 0.05), 2)))
+    return replies
+
+
+def trace_replies(path):
+    # (name, body) of every reply of an RPC in RPCS, paired with the request sent last
+    from serial_trace import read_trace, SENT, RECEIVED
+    names = {rpc.number: name for name, rpc in RPCS.items()}
+    _, events = read_trace(path)
+    replies, request, received = [], None, b""
+    for event in events:
+        if event.kind == SENT:
+            request = names.get(int(event.data[5:].split(b':')[0].split(b',')[0]))
+        elif event.kind == RECEIVED:
+            received += event.data
+            *lines, received = received.split(b"\r\n")
+            for line in lines:
+                header, _, body = line.decode("UTF-8", "replace").partition(':')
+                if request is not None and header.startswith("%R1P"):
+                    replies.append((request, body))
+    return replies
+
+
+def legacy_encode(hz, v):
+    return ("%R1Q,9027:" + str(hz*GON2RAD) + ',' + str(v*GON2RAD) + ',' + str(AUT_POSMODE["AUT_NORMAL"]) + ',' +
+            str(AUT_ATRMODE["AUT_POSITION"]) + ',' + str(BOOLE[False]) + "\r\n",
+            "%R1Q,2167:" + str(1000) + ',' + str(TMC_INCLINE_PRG["TMC_AUTO_INC"]) + "\r\n",
+            "%R1Q,2003:" + str(TMC_INCLINE_PRG["TMC_AUTO_INC"]) + "\r\n",
+            "%R1Q,5011:\r\n")
+
+
+def rpcs_encode(hz, v):
+    return (RPCS["AUT_MakePositioning"].encode(hz, v, AUT_POSMODE["AUT_NORMAL"], AUT_ATRMODE["AUT_POSITION"]),
+            RPCS["TMC_GetFullMeas"].encode(1000, TMC_INCLINE_PRG["TMC_AUTO_INC"]),
+            RPCS["TMC_GetAngle1"].encode(TMC_INCLINE_PRG["TMC_AUTO_INC"]),
+            RPCS["CSV_GetIntTemp"].encode())
+
+
+def legacy_decode(replies):
+    # split_response_body, then the casts of the handler: the return code is parsed for the success check, for the
+    # record and by recovery.classify
+    values = []
+    for name, body in replies:
+        fields = body.split(',')
+        if len(fields) != len(RPCS[name].fields) + 1 or int(fields[0]) != 0:
+            continue
+        if name == "TMC_GetFullMeas":
+            values.append((int(fields[0]), float(fields[1]), float(fields[2]), float(fields[4]), float(fields[5]),
+                           float(fields[7])))
+        elif name == "TMC_GetAngle1":
+            values.append((int(fields[0]), float(fields[1]), float(fields[2])))
+        elif name == "CSV_GetIntTemp":
+            values.append((int(fields[0]), float(fields[1])))
+        else:
+            values.append((int(fields[0]), ))
+        int(fields[0])
+    return values
+
+
+def rpcs_decode(replies):
+    values = []
+    for name, body in replies:
+        reply = RPCS[name].decode(body)
+        if reply and reply.ok:
+            values.append(reply)
+    return values
+
+
+def best_of(function, *arguments, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*arguments)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(trace=None):
+    replies = trace_replies(trace) if trace else generated_replies(REPLY_COUNT)
+    directions = [(random.uniform(0, 400), random.uniform(80, 120)) for _ in range(REPLY_COUNT)]
+    set_directions = directions[:AIM_COUNT]*(REPLY_COUNT//AIM_COUNT)
+    assert [legacy_encode(hz, v) for hz, v in directions[:100]] == [rpcs_encode(hz, v) for hz, v in directions[:100]]
+
+    def legacy_encode_all(directions):
+        for hz, v in directions:
+            legacy_encode(hz, v)
+
+    def rpcs_encode_all(directions):
+        for hz, v in directions:
+            rpcs_encode(hz, v)
+
+    print("step         count   legacy [us/item]  rpcs [us/item]")
+    for step, count, legacy, rpcs in (
+            ("encode", len(directions), best_of(legacy_encode_all, directions),
+             best_of(rpcs_encode_all, directions)),
+            ("encode sets", len(set_directions), best_of(legacy_encode_all, set_directions),
+             best_of(rpcs_encode_all, set_directions)),
+            ("decode", len(replies), best_of(legacy_decode, replies), best_of(rpcs_decode, replies))):
+        print("%-11s %6d %17.3f %15.3f" % (step, count, legacy/max(count, 1)*1e6, rpcs/max(count, 1)*1e6))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,268 @@
+"""
+Throughput of whole measurement sets: HandlerAutoMeasurement.run against a seeded SimulatedTM50 on a
+VirtualTimeTransport, for every combination of aim count, failure rate and reply latency. Waits and sleeps of the
+handler pass on the simulated clock, so a case reports aims per second of instrument time as well as the CPU and
+wall seconds the code around the instrument needs, the seconds of instrument time spent in each phase of
+instrumentation.metrics and the peak of the traced memory. Writing the measurement files, logging and uploading are timed on their own as well.
+
+Everything is written to a temporary folder. Results can be saved as JSON and compared with the results of another
+commit, values worse by more than the tolerance are listed and make the exit code 1:
+
+    python benchmarks/bench_sets.py --output before.json
+    python benchmarks/bench_sets.py --compare before.json
+    python benchmarks/bench_sets.py --aims 10 100 --failure-rates 0 0.2 --latencies 0.02 --sets 5
+"""
+
+import argparse
+import datetime as dt
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPOSITORY)
+
+AIM_COUNTS = [10, 50]
+FAILURE_RATES = [0.0, 0.1]
+LATENCIES = [0.02, 0.2]  # s of processing added to every reply
+SET_AMOUNT = 3
+STAGE_RECORDS = 10000  # records written, logged and uploaded by the stage benchmarks
+RECORDS_PER_SET = 100  # of the store stage, committed together
+SEED = 1
+TOLERANCE = 0.1  # relative
+
+# compared by --compare, lower is better
+CASE_VALUES = ("instrument_seconds", "cpu_seconds", "wall_seconds", "peak_memory")
+STAGE_VALUES = ("seconds", )
+
+
+def make_aims(aim_count):
+    from aim_table import Aim, AimTable
+    from geocom_dicts import BAP_TARGET_TYPE, PrismType
+
+    return AimTable.from_aims([Aim("P" + str(i), i*400/aim_count, 90 + i % 20, BAP_TARGET_TYPE["BAP_REFL_USE"],
+                                   PrismType["BAP_PRISM_360"]) for i in range(aim_count)]).with_second_circle()
+
+
+def run_sets(name, aim_count, failure_rate, latency, set_amount):
+    """
+    :return: dict of the measured values
+    """
+    from geocom import SerialConnection, GeoCom
+    from auto_measure_handler import HandlerAutoMeasurement
+    from instrumentation import metrics
+    from simulator import SimulatedTM50, SimulatedTarget, VirtualTimeTransport
+    from uploader import UploadWorker, LocalSftpStandIn
+
+    aims = make_aims(aim_count)
+    targets = [SimulatedTarget(aim.hz, aim.v, 20.0 + i) for i, aim in enumerate(aims[:aim_count])]
+    instrument = SimulatedTM50(targets=targets, latency=latency, error_rate=failure_rate, seed=SEED)
+    transport = VirtualTimeTransport(instrument)
+    uploader = UploadWorker(connect=lambda: LocalSftpStandIn("remote/"), queue_file=name + "_upload_queue.json")
+    uploader.start()
+    handler = HandlerAutoMeasurement(GeoCom(SerialConnection(name, transport=transport)), uploader=uploader,
+                                     name=name)
+    handler.aims = aims
+
+    metrics.reset()
+    instrument_start, cpu_start, wall_start = transport.clock(), time.process_time(), time.perf_counter()
+    handler.initialize()
+    handler.run(set_amount=set_amount)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    instrument_seconds = transport.clock() - instrument_start
+    summary = metrics.summary()
+    handler.close()
+    uploader.stop(timeout=60)
+
+    attempts = set_amount*len(aims)
+    return {
+        "aims_per_instrument_second": attempts/instrument_seconds,
+        "aims_per_cpu_second": attempts/cpu if cpu else None,
+        "instrument_seconds": instrument_seconds,
+        "cpu_seconds": cpu,
+        "wall_seconds": wall,
+        "records": handler.store.seq,
+        "rpcs": sum(rpc["duration"]["count"] for rpc in summary["rpcs"].values()),
+        "phases": {phase: histogram["sum"] for phase, histogram in summary["phases"].items()},
+    }
+
+
+def bench_case(aim_count, failure_rate, latency, set_amount):
+    name = "%d_%g_%g" % (aim_count, failure_rate, latency)
+    case = {"aims": aim_count, "failure_rate": failure_rate, "latency": latency, "sets": set_amount}
+    case.update(run_sets(name, aim_count, failure_rate, latency, set_amount))
+
+    # tracing slows the run down, the peak is taken from a second run
+    tracemalloc.start()
+    run_sets(name + "_memory", aim_count, failure_rate, latency, set_amount)
+    case["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return case
+
+
+def stage_records(count):
+    from measurement_store import MeasurementRecord
+
+    start = time.time()
+    return [MeasurementRecord(start + i, "P" + str(i % 100), 1.0 + i*1e-6, 1.0, 1.5, 1.5, 20.0 + i % 100, 1e-5, 2e-5,
+                              21.0) for i in range(count)]
+
+
+def bench_store(count):
+    from measurement_store import MeasurementStore
+
+    records = stage_records(count)
+    store = MeasurementStore("stage_store/")
+    start = time.perf_counter()
+    for i, record in enumerate(records, 1):
+        store.append(record)
+        if i % RECORDS_PER_SET == 0:
+            store.commit_set()
+    store.close()
+    return time.perf_counter() - start
+
+
+def bench_log(count):
+    from logger import log
+
+    policy, log.queue_full_policy = log.queue_full_policy, "block"  # every record is written, none dropped
+    start = time.perf_counter()
+    for i in range(count):
+        log.info("Measuring P" + str(i % 100), rc=0)
+    log.flush()
+    seconds = time.perf_counter() - start
+    log.queue_full_policy = policy
+    return seconds
+
+
+def bench_upload(count):
+    from uploader import UploadWorker, LocalSftpStandIn
+
+    path = "stage_upload.txt"
+    with open(path, 'w') as f:
+        f.writelines(record.to_text_line() for record in stage_records(count))
+    uploader = UploadWorker(connect=lambda: LocalSftpStandIn("stage_remote/"), queue_file="stage_upload_queue.json")
+    uploader.start()
+    start = time.perf_counter()
+    uploader.enqueue(path, "/measurements")
+    uploader.stop(timeout=60)  # returns once the queue is drained
+    return time.perf_counter() - start
+
+
+def bench_stages(count):
+    stages = []
+    for stage, function in (("store", bench_store), ("log", bench_log), ("upload", bench_upload)):
+        seconds = function(count)
+        stages.append({"stage": stage, "records": count, "seconds": seconds, "records_per_second": count/seconds})
+    return stages
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPOSITORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print("aims  failure  latency  aims/s instrument  aims/s CPU  CPU [s]  wall [s]  peak [MiB]")
+    for case in results["cases"]:
+        print("%-5d %7.2f %8.3f %18.3f %11.1f %8.3f %9.3f %11.2f" % (
+            case["aims"], case["failure_rate"], case["latency"], case["aims_per_instrument_second"],
+            case["aims_per_cpu_second"] or 0, case["cpu_seconds"], case["wall_seconds"],
+            case["peak_memory"]/2**20))
+        phases = sorted(case["phases"].items(), key=lambda item: -item[1])
+        print("      " + "  ".join(phase + " " + str(round(seconds, 3)) for phase, seconds in phases))
+    print()
+    print("stage    records  seconds  records/s")
+    for stage in results["stages"]:
+        print("%-8s %7d %8.3f %10.0f" % (stage["stage"], stage["records"], stage["seconds"],
+                                          stage["records_per_second"]))
+
+
+def compare(baseline, results, tolerance=TOLERANCE):
+    """
+    Prints the change of every compared value against baseline.
+    :return: list of (case or stage, value) worse by more than tolerance
+    """
+    def case_key(case):
+        return case["aims"], case["failure_rate"], case["latency"], case["sets"]
+
+    pairs = []
+    baseline_cases = {case_key(case): case for case in baseline["cases"]}
+    for case in results["cases"]:
+        if case_key(case) in baseline_cases:
+            pairs.append(("%d aims %g failure %g latency" % case_key(case)[:3], baseline_cases[case_key(case)], case,
+                          CASE_VALUES))
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    for stage in results["stages"]:
+        if stage["stage"] in baseline_stages and stage["records"] == baseline_stages[stage["stage"]]["records"]:
+            pairs.append((stage["stage"] + " stage", baseline_stages[stage["stage"]], stage, STAGE_VALUES))
+
+    print("Compared with " + str(baseline.get("commit")) + " of " + baseline.get("started", "?"))
+    regressions = []
+    for label, old, new, values in pairs:
+        for value in values:
+            if not old.get(value):
+                continue
+            change = new[value]/old[value] - 1
+            worse = change > tolerance
+            if worse:
+                regressions.append((label, value))
+            print("%-40s %-20s %12.4g %12.4g %+7.1f%%%s" % (label, value, old[value], new[value], change*100,
+                                                            "  worse" if worse else ""))
+    return regressions
+
+
+def main(args):
+    cwd, folder = os.getcwd(), tempfile.mkdtemp(prefix="bench_sets_")
+    os.chdir(folder)  # before the imports, the logger opens logs/ in the working directory
+    from logger import log
+    log.echo = False
+
+    try:
+        results = {
+            "started": dt.datetime.now().isoformat(timespec="seconds"),
+            "commit": commit(),
+            "python": platform.python_version(),
+            "cases": [bench_case(aim_count, failure_rate, latency, args.sets) for aim_count, failure_rate, latency
+                      in itertools.product(args.aims, args.failure_rates, args.latencies)],
+            "stages": bench_stages(args.stage_records),
+        }
+    finally:
+        log.close()
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print()
+        if compare(baseline, results, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark measurement sets against the simulator")
+    parser.add_argument("--aims", type=int, nargs='+', default=AIM_COUNTS, help="aims per face")
+    parser.add_argument("--failure-rates", type=float, nargs='+', default=FAILURE_RATES)
+    parser.add_argument("--latencies", type=float, nargs='+', default=LATENCIES)
+    parser.add_argument("--sets", type=int, default=SET_AMOUNT)
+    parser.add_argument("--stage-records", type=int, default=STAGE_RECORDS)
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,247 @@
+"""
+Station local coordinates from the stored polar observations, computed in one batch over a set or the whole archive
+with NumPy. The handler measures with TMC_SetAtmPpm(0), so the slope distances are uncorrected and the atmospheric
+correction is applied here:
+
+    ppm = 286.338 - (0.29535*p/(1 + t/273.15) - 4.126e-4*h/(1 + t/273.15)*10**(7.5*t/(237.3 + t) + 0.7857))
+
+with air temperature t in °C, pressure p in hPa and relative humidity h in % (Leica TPS formula, about 0 ppm at 12 °C,
+1013.25 hPa and 60 %). Temperature, pressure and humidity come from a meteo file, interpolated to the time of every
+observation. Where there is none the internal temperature of the instrument and the standard pressure and humidity
+are used if use_internal_temperature, else the standard atmosphere.
+
+A meteo file is a CSV file with header, time as YYYYMMDD_HHMMSS or seconds since epoch:
+
+    time,temperature,pressure,humidity
+    20211205_133000,4.2,968.1,81
+
+The handler measures with the incline switch on, hz and v are corrected by the instrument already. For angles
+measured without compensation apply_inclines corrects them from cross and length incline.
+
+Coordinates have the station as origin, y towards hz = orientation and z up, in m.
+
+    history = MeasurementHistory()
+    history.update()
+    coordinates, names = archive_coordinates(history, meteo=read_meteo_file("meteo.csv"))
+
+    python coordinates.py [meteo.csv]  # writes YYYYMMDD_coordinates.txt for every day of the archive
+"""
+
+import datetime as dt
+import itertools
+import os
+import sys
+
+import numpy as np
+
+from geocom import GON2RAD
+from measurement_store import NULL_HZ, NULL_V, NULL_SLOPE_DIST, NULL_CROSS_INCLINE, NULL_LENGTH_INCLINE, \
+    NULL_INTERNAL_TEMPERATURE
+
+
+COORDINATES_FILE_SUFFIX = "_coordinates.txt"
+STANDARD_TEMPERATURE = 12.0  # °C
+STANDARD_PRESSURE = 1013.25  # hPa
+STANDARD_HUMIDITY = 60.0  # %
+MAX_METEO_GAP = 2*60*60  # s, observations further from the next meteo value use the fallback
+
+
+def polar_to_local(hz, v, slope_dist):
+    # gon, gon, m to x, y, z in m, works on scalars and arrays alike
+    horizontal = slope_dist*np.sin(v*GON2RAD)
+    return horizontal*np.sin(hz*GON2RAD), horizontal*np.cos(hz*GON2RAD), slope_dist*np.cos(v*GON2RAD)
+
+
+def atmospheric_ppm(temperature, pressure, humidity):
+    """
+    :param temperature: dry air temperature in °C
+    :param pressure: in hPa
+    :param humidity: relative humidity in %
+    :return: correction in ppm, added to distances measured with TMC_SetAtmPpm(0), about 0 at the reference
+        atmosphere of the instrument:
+
+        >>> abs(float(atmospheric_ppm(12, 1013.25, 60))) < 0.05
+        True
+    """
+    temperature, pressure, humidity = (np.asarray(values, dtype=np.float64)
+                                       for values in (temperature, pressure, humidity))
+    alpha = 1 + temperature/273.15
+    x = 7.5*temperature/(237.3 + temperature) + 0.7857
+    return 286.338 - (0.29535*pressure/alpha - 4.126e-4*humidity/alpha*10**x)
+
+
+def correct_inclines(hz, v, cross_incline, length_incline):
+    """
+    Angles measured without compensation to angles on the plumb line, all in gon. Where an incline is NaN the angle
+    is left as is.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hz_correction = cross_incline/np.tan(v*GON2RAD)
+    return (np.where(np.isfinite(hz_correction), hz + hz_correction, hz) % 400,
+            np.where(np.isfinite(length_incline), v + length_incline, v))
+
+
+def read_meteo_file(path):
+    """
+    :return: dict column -> np.ndarray of time, temperature, pressure, humidity sorted by time, NaN for empty fields
+    """
+    def parse_time(text):
+        if '_' in text:
+            return dt.datetime.strptime(text, "%Y%m%d_%H%M%S").timestamp()
+        return float(text)
+
+    with open(path, 'r') as f:
+        header = [column.strip() for column in f.readline().split(',')]
+        lines = [line.split(',') for line in f if line.strip() and not line.startswith('#')]
+
+    columns = {column: [] for column in header}
+    for fields in lines:
+        for column, text in zip(header, fields):
+            text = text.strip()
+            if column == "time":
+                columns[column].append(parse_time(text))
+            else:
+                columns[column].append(float(text) if text else np.nan)
+
+    meteo = {column: np.array(values, dtype=np.float64) for column, values in columns.items()}
+    order = np.argsort(meteo["time"], kind="stable")
+    return {column: values[order] for column, values in meteo.items()}
+
+
+def interpolate_meteo(meteo, column, time, max_gap=MAX_METEO_GAP):
+    # meteo column at the given times, NaN where no value lies within max_gap
+    if meteo is None or column not in meteo:
+        return np.full(len(time), np.nan)
+    known = np.isfinite(meteo[column])
+    meteo_time, values = meteo["time"][known], meteo[column][known]
+    if not len(meteo_time):
+        return np.full(len(time), np.nan)
+
+    interpolated = np.interp(time, meteo_time, values)
+    after = np.clip(np.searchsorted(meteo_time, time), 0, len(meteo_time) - 1)
+    before = np.clip(after - 1, 0, len(meteo_time) - 1)
+    gap = np.minimum(np.abs(meteo_time[after] - time), np.abs(time - meteo_time[before]))
+    interpolated[gap > max_gap] = np.nan
+    return interpolated
+
+
+def compute_coordinates(time, hz, v, slope_dist, cross_incline=None, length_incline=None,
+                        internal_temperature=None, meteo=None, use_internal_temperature=False, apply_inclines=False,
+                        station=(0.0, 0.0, 0.0), orientation=0.0):
+    """
+    Angles and inclines in gon, slope_dist in m, NaN for values the instrument did not deliver.
+    :param meteo: dict as of read_meteo_file or None
+    :param orientation: hz in gon of the y axis
+    :return: dict of arrays with one entry per observation: time, hz, v, slope_dist (corrected), ppm,
+        horizontal_dist, x, y, z
+    """
+    time, hz, v, slope_dist = (np.asarray(values, dtype=np.float64) for values in (time, hz, v, slope_dist))
+
+    if apply_inclines:
+        hz, v = correct_inclines(hz, v, np.asarray(cross_incline, dtype=np.float64),
+                                 np.asarray(length_incline, dtype=np.float64))
+
+    temperature = interpolate_meteo(meteo, "temperature", time)
+    if use_internal_temperature and internal_temperature is not None:
+        temperature = np.where(np.isfinite(temperature), temperature, internal_temperature)
+    temperature = np.where(np.isfinite(temperature), temperature, STANDARD_TEMPERATURE)
+    pressure = interpolate_meteo(meteo, "pressure", time)
+    pressure = np.where(np.isfinite(pressure), pressure, STANDARD_PRESSURE)
+    humidity = interpolate_meteo(meteo, "humidity", time)
+    humidity = np.where(np.isfinite(humidity), humidity, STANDARD_HUMIDITY)
+
+    ppm = atmospheric_ppm(temperature, pressure, humidity)
+    corrected = slope_dist*(1 + ppm*1e-6)
+    x, y, z = polar_to_local((hz - orientation) % 400, v, corrected)
+    return {
+        "time": time,
+        "hz": hz,
+        "v": v,
+        "slope_dist": corrected,
+        "ppm": ppm,
+        "horizontal_dist": corrected*np.sin(v*GON2RAD),
+        "x": x + station[0],
+        "y": y + station[1],
+        "z": z + station[2],
+    }
+
+
+def record_coordinates(records, **options):
+    """
+    Coordinates of a list of MeasurementRecords, e.g. one set, options as of compute_coordinates.
+    :return: (coordinates dict with an additional aim column, list of aim names indexed by it)
+    """
+    names = sorted({record.aim_name for record in records})
+    codes = {name: code for code, name in enumerate(names)}
+    null_masks = np.array([record.null_mask for record in records], dtype=np.int64)
+
+    def column(attribute, null_bit, factor):
+        values = np.array([getattr(record, attribute) for record in records], dtype=np.float64)*factor
+        values[(null_masks & null_bit) != 0] = np.nan
+        return values
+
+    coordinates = compute_coordinates(
+        [record.timestamp for record in records], column("hz", NULL_HZ, 1/GON2RAD), column("v", NULL_V, 1/GON2RAD),
+        column("slope_dist", NULL_SLOPE_DIST, 1.0), column("cross_incline", NULL_CROSS_INCLINE, 1/GON2RAD),
+        column("length_incline", NULL_LENGTH_INCLINE, 1/GON2RAD),
+        column("internal_temperature", NULL_INTERNAL_TEMPERATURE, 1.0), **options)
+    coordinates["aim"] = np.array([codes[record.aim_name] for record in records], dtype=np.int64)
+    return coordinates, names
+
+
+def archive_coordinates(history, start=None, end=None, **options):
+    """
+    Coordinates of every observation of a MeasurementHistory in [start, end] in one batch, options as of
+    compute_coordinates.
+    :return: (coordinates dict with an additional aim column, list of aim names indexed by it)
+    """
+    rows, names = history.load(start=start, end=end)
+    coordinates = compute_coordinates(rows["time"], rows["hz"], rows["v"], rows["slope_dist"], rows["cross_incline"],
+                                      rows["length_incline"], rows["internal_temperature"], **options)
+    coordinates["aim"] = rows["aim"].astype(np.int64)
+    return coordinates, names
+
+
+def local_time_strings(time):
+    """
+    YYYYMMDD_HHMMSS in local time of every timestamp. The UTC offset is looked up once per hour and the dates once
+    per day, formatting a year of observations with datetime one by one takes longer than computing them.
+    """
+    seconds = np.floor(np.asarray(time, dtype=np.float64)).astype(np.int64)
+    hours, hour_index = np.unique(seconds//3600, return_inverse=True)
+    offsets = np.array([dt.datetime.fromtimestamp(hour*3600).astimezone().utcoffset().total_seconds()
+                        for hour in hours.tolist()], dtype=np.int64)
+    local = seconds + offsets[hour_index]
+    days, day_index = np.unique(local//86400, return_inverse=True)
+    dates = [(dt.datetime(1970, 1, 1) + dt.timedelta(days=day)).strftime("%Y%m%d") for day in days.tolist()]
+    of_day = local % 86400
+    clock = of_day//3600*10000 + of_day % 3600//60*100 + of_day % 60
+    return ["%s_%06d" % (dates[day], hhmmss) for day, hhmmss in zip(day_index.tolist(), clock.tolist())]
+
+
+def write_coordinates(folder, coordinates, names):
+    """
+    Writes YYYYMMDD_coordinates.txt for every day of the coordinates, replacing existing files, one line per
+    observation: str_datetime str_aim_name x[m] y[m] z[m] slope_dist[m] ppm
+    """
+    if not len(coordinates["time"]):
+        return
+    times = local_time_strings(coordinates["time"])
+    aims = [names[aim] for aim in coordinates["aim"].tolist()]
+    columns = [coordinates[column].tolist() for column in ("x", "y", "z", "slope_dist", "ppm")]
+    lines = ["%s %s %.5f %.5f %.5f %.5f %.2f\n" % fields for fields in zip(times, aims, *columns)]
+
+    # observations are sorted by time, so the lines of a day follow each other
+    for day, day_lines in itertools.groupby(zip(times, lines), key=lambda item: item[0][:8]):
+        with open(os.path.join(folder, day + COORDINATES_FILE_SUFFIX), 'w') as f:
+            f.writelines(line for _, line in day_lines)
+
+
+if __name__ == "__main__":
+    from measurement_history import MeasurementHistory
+
+    history = MeasurementHistory()
+    history.update()
+    meteo = read_meteo_file(sys.argv[1]) if len(sys.argv) > 1 else None
+    coordinates, names = archive_coordinates(history, meteo=meteo, use_internal_temperature=meteo is None)
+    write_coordinates(history.folder, coordinates, names)
@@ -0,0 +1,442 @@
+"""
+Unattended measuring without the prompts of main.py: one TM50 configured by a JSON file, started at boot by systemd
+or cron and controlled through a local Unix socket.
+
+    {
+        "port": "/dev/ttyUSB0",
+        "setup_file": "setup.csv",
+        "interval": 900,
+        "set_amount": null, "overrun_policy": "skip", "priority_interval": null,
+        "second_circle": true, "optimize_aim_order": false, "adaptive": false, "pipelined": false,
+        "cache_settings": false, "alert_sink": null, "capture_trace": false, "metrics_port": null,
+        "compress_closed_days": false,
+        "control_socket": "tm50.sock",
+        "restart_delay": 60
+    }
+
+If the instrument cannot be initialized or the measurement loop stops, it is started again after restart_delay
+seconds, an interrupted set goes on from its checkpoint.
+
+The control socket takes one JSON object per line and answers each with one JSON object, "ok" tells whether the
+command was accepted:
+
+    {"command": "status"}
+    {"command": "pause"}            no new set is started until resume
+    {"command": "resume"}
+    {"command": "trigger"}          start a full set now, the schedule stays as it is
+    {"command": "add_aim", "aim": {"name": "P9", "hz": 12.3456, "v": 98.7654, "target": 0, "prism": 3}}
+    {"command": "remove_aim", "name": "P9"}
+    {"command": "stop"}
+
+Commands take effect between sets, a set already running is measured to its end. Aims take the columns of a setup
+file, see setup_file.py, and the changed aims are written back to setup_file so they are kept over restarts.
+The same script sends commands to a running daemon:
+
+    python daemon.py daemon.json
+    python daemon.py daemon.json status
+    python daemon.py daemon.json add_aim '{"aim": {"name": "P9", "hz": 12.3456, "v": 98.7654, "target": 1}}'
+
+Sending a command imports nothing of the measurement code but the logger, the daemon itself imports the optional
+parts only if they are configured.
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from logger import log, LOG_FOLDER
+
+
+CONTROL_SOCKET = "tm50.sock"
+RESTART_DELAY = 60  # s before the measurement loop is started again
+COMMAND_TIMEOUT = 10  # s a client waits for the answer
+DAEMON_DEFAULTS = {
+    "interval": None,
+    "set_amount": None,
+    "overrun_policy": "skip",
+    "priority_interval": None,
+    "second_circle": True,
+    "optimize_aim_order": False,
+    "adaptive": False,
+    "pipelined": False,
+    "cache_settings": False,
+    "alert_sink": None,
+    "capture_trace": False,
+    "metrics_port": None,
+    "compress_closed_days": False,
+    "control_socket": CONTROL_SOCKET,
+    "restart_delay": RESTART_DELAY,
+}
+REQUIRED_KEYS = ("port", "setup_file")
+
+
+def load_config(path):
+    with open(path, 'r') as f:
+        config = json.load(f)
+    for key in REQUIRED_KEYS:
+        if key not in config:
+            raise ValueError(path + ": no " + key)
+    unknown = set(config) - set(DAEMON_DEFAULTS) - set(REQUIRED_KEYS)
+    if unknown:
+        raise ValueError(path + ": unknown keys " + ", ".join(sorted(unknown)))
+    return dict(DAEMON_DEFAULTS, **config)
+
+
+def parse_aim(fields):
+    """
+    :param fields: column -> value of one aim as in a setup file, numbers and flags may be given as JSON values
+    :return: Aim, raises ValueError if it is not valid
+    """
+    from aim_table import Aim
+    from setup_file import parse_row
+
+    if not isinstance(fields, dict):
+        raise ValueError("aim has to be an object")
+    text = {column: "" if value is None else str(int(value)) if isinstance(value, bool) else str(value)
+            for column, value in fields.items()}
+    name, group, (hz, v, target, prism, _, every, atr, retries, face_one_only, priority) = parse_row(text)
+    return Aim(name, hz, v, target, prism, priority=priority, group=group, every=every, atr=atr,
+               retries=None if retries < 0 else retries, face_one_only=face_one_only)
+
+
+class RunControl:
+    """
+    Commands for a running HandlerAutoMeasurement.run given from other threads. The run takes them between sets,
+    every command wakes up the wait for the next set.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.paused = False
+        self.stopping = False
+        self.triggered = False
+        self.pending = []  # functions called by the measuring thread before the next set
+        self.state = "starting"  # starting, initializing, waiting, measuring, paused, restarting, stopped
+
+    def notify(self):
+        self.wake_up.set()
+
+    def sleep(self, seconds):
+        # sleep of the scheduler, returns early on any command
+        self.state = "waiting"
+        self.wake_up.wait(seconds)
+        self.wake_up.clear()
+
+    def pause(self):
+        with self.lock:
+            self.paused = True
+        self.notify()
+
+    def resume(self):
+        with self.lock:
+            self.paused = False
+        self.notify()
+
+    def trigger(self):
+        with self.lock:
+            self.triggered = True
+        self.notify()
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+        self.notify()
+
+    def call_between_sets(self, function):
+        with self.lock:
+            self.pending.append(function)
+        self.notify()
+
+    def take_trigger(self):
+        with self.lock:
+            triggered, self.triggered = self.triggered, False
+        return triggered
+
+    def between_sets(self):
+        """
+        Calls the pending functions and blocks while paused.
+        :return: False if the run is to stop
+        """
+        while True:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            for function in pending:
+                function()
+            with self.lock:
+                if self.stopping:
+                    return False
+                if not self.paused and not self.pending:
+                    break
+            self.state = "paused"
+            self.wake_up.wait()
+            self.wake_up.clear()
+        self.state = "measuring"
+        return True
+
+
+class Daemon:
+    def __init__(self, config):
+        """
+        :param config: as returned by load_config
+        """
+        from setup_file import read_setup_file
+
+        self.config = config
+        self.aims = read_setup_file(config["setup_file"])  # face I aims as set up, raises SetupFileError
+        self.control = RunControl()
+        self.sercon = None
+        self.handler = None
+        self.uploader = None
+        self.compressor = None
+        self.server = None
+        self.starts = 0
+        self.last_error = None
+
+    def connect(self):
+        from geocom import SerialConnection
+
+        capture_path = None
+        if self.config["capture_trace"]:
+            capture_path = "traces/" + time.strftime("%Y%m%d_%H%M%S") + ".trace"
+        return SerialConnection(self.config["port"], capture_path=capture_path)
+
+    def create_handler(self):
+        from geocom import GeoCom
+        from auto_measure_handler import HandlerAutoMeasurement
+
+        if self.config["pipelined"]:
+            from async_geocom import PipelinedGeoCom
+            geocom = PipelinedGeoCom(self.sercon)
+        else:
+            geocom = GeoCom(self.sercon)
+        if self.config["adaptive"]:
+            from adaptive import AdaptiveTimeouts
+            geocom.adaptive_timeouts = AdaptiveTimeouts()
+        if self.config["cache_settings"]:
+            from geocom_cache import CachedGeoCom
+            geocom = CachedGeoCom(geocom)
+        return HandlerAutoMeasurement(geocom, adaptive=self.config["adaptive"], uploader=self.uploader,
+                                      alert_sink=self.config["alert_sink"])
+
+    def measuring_aims(self):
+        self.handler.aims = self.aims
+        if self.config["second_circle"]:
+            self.handler.add_second_circle()
+        if self.config["optimize_aim_order"]:
+            self.handler.optimize_aim_order()
+
+    def save_aims(self):
+        from setup_file import write_setup_file
+
+        write_setup_file(self.config["setup_file"], self.aims)
+
+    def add_aim(self, aim):
+        # called by the measuring thread between sets
+        if aim.name in self.aims.names_in_order():
+            log.warning("Aim " + aim.name + " not added, the name is already used")
+            return
+        self.aims = self.aims + [aim]
+        self.save_aims()
+        self.measuring_aims()
+        log.info("Aim " + aim.name + " added", hz=aim.hz, v=aim.v, target=aim.target, prism=aim.prism)
+
+    def remove_aim(self, name):
+        self.aims = self.aims.select([aim_name != name for aim_name in self.aims.names_in_order()])
+        self.save_aims()
+        self.measuring_aims()
+        log.info("Aim " + name + " removed")
+
+    def measure(self):
+        """
+        One start of the measurement loop.
+        :return: True if it ended because all sets are measured or it was stopped
+        """
+        self.starts += 1
+        self.control.state = "initializing"
+        if self.sercon is None:
+            self.sercon = self.connect()
+        self.handler = self.create_handler()
+        try:
+            if not self.handler.initialize():
+                log.error("Initializing failed")
+                return False
+            self.measuring_aims()
+            return self.handler.run(interval=self.config["interval"], set_amount=self.config["set_amount"],
+                                    overrun_policy=self.config["overrun_policy"],
+                                    priority_interval=self.config["priority_interval"], control=self.control)
+        finally:
+            self.handler.close()  # measurements of an unfinished set are kept for its checkpoint
+            if hasattr(self.handler.geocom, "close"):
+                self.handler.geocom.close()  # PipelinedGeoCom
+
+    def run(self):
+        """
+        Measures until all sets are measured or the daemon is stopped, starting again after failures.
+        """
+        from uploader import UploadWorker
+        from instrumentation import metrics
+        if self.config["metrics_port"] is not None:
+            metrics.serve(self.config["metrics_port"])
+        self.uploader = UploadWorker()
+        self.uploader.start()
+        if self.config["compress_closed_days"]:
+            from rotating_file import Compressor
+            from auto_measure_handler import MEASUREMENT_FOLDER
+            self.compressor = Compressor([LOG_FOLDER], measurement_folders=[MEASUREMENT_FOLDER],
+                                         uploaded=self.uploader.is_uploaded)
+            self.compressor.start()
+        if self.config["control_socket"]:
+            self.serve(self.config["control_socket"])
+
+        log.info("Daemon started", port=self.config["port"], aims=len(self.aims))
+        while not self.control.stopping:
+            try:
+                if self.measure():
+                    break
+                self.last_error = "initializing failed"
+            except Exception as e:
+                self.last_error = repr(e)
+                log.error("Measurement stopped: " + repr(e))
+            if self.control.stopping:
+                break
+            self.control.state = "restarting"
+            log.info("Starting again in " + str(self.config["restart_delay"]) + "s")
+            self.control.sleep(self.config["restart_delay"])  # cut short by stop
+        self.control.state = "stopped"
+        log.info("Daemon stopped")
+
+    def status(self):
+        handler, sercon = self.handler, self.sercon
+        latest = handler.telemetry.buffer.latest() if handler else None
+        return {
+            "state": self.control.state,
+            "paused": self.control.paused,
+            "starts": self.starts,
+            "last_error": self.last_error,
+            "aims": self.aims.names_in_order(),
+            "sets_completed": handler.sets_completed if handler else 0,
+            "last_set_start": handler.last_start_time if handler else None,
+            "last_set_end": handler.last_set_end_time if handler else None,
+            "telemetry": {name: latest[name].item() for name in latest.dtype.names} if latest is not None else None,
+            "upload_queue": len(self.uploader.pending) if self.uploader else 0,
+            "serial": {
+                "bytes_sent": sercon.bytes_sent,
+                "bytes_received": sercon.bytes_received,
+                "timeouts": sercon.timeouts,
+            } if sercon else None,
+        }
+
+    def execute(self, request):
+        """
+        :param request: dict with the command and its arguments
+        :return: dict answered on the control socket, raises ValueError or KeyError for invalid requests
+        """
+        command = request["command"]
+        if command == "status":
+            return dict(ok=True, **self.status())
+        if command == "pause":
+            self.control.pause()
+        elif command == "resume":
+            self.control.resume()
+        elif command == "trigger":
+            self.control.trigger()
+        elif command == "stop":
+            self.control.stop()
+        elif command == "add_aim":
+            aim = parse_aim(request["aim"])
+            if aim.name in self.aims.names_in_order():
+                raise ValueError("name " + aim.name + " already used")
+            self.control.call_between_sets(lambda: self.add_aim(aim))
+        elif command == "remove_aim":
+            name = request["name"]
+            if name not in self.aims.names_in_order():
+                raise ValueError("no aim " + repr(name))
+            self.control.call_between_sets(lambda: self.remove_aim(name))
+        else:
+            raise ValueError("unknown command " + repr(command))
+        return {"ok": True}
+
+    def serve(self, path):
+        """
+        Answers commands on the Unix socket at path from daemon threads, only the user running the daemon may
+        connect.
+        """
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        if not isinstance(request, dict):
+                            raise ValueError("request has to be an object")
+                        response = daemon.execute(request)
+                    except KeyError as e:
+                        response = {"ok": False, "error": "missing " + str(e)}
+                    except ValueError as e:
+                        response = {"ok": False, "error": str(e)}
+                    log.info("Control command", request=line.decode("UTF-8", "replace").strip(), ok=response["ok"])
+                    self.wfile.write(json.dumps(response).encode("UTF-8") + b"\n")
+
+        if os.path.exists(path):
+            os.remove(path)  # left behind by a daemon that was killed
+        self.server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self.server.daemon_threads = True
+        os.chmod(path, 0o600)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            os.remove(self.config["control_socket"])
+        if self.uploader is not None:
+            from uploader import REMOTE_LOG_FOLDER
+            self.uploader.enqueue(log.get_current_file_name(), REMOTE_LOG_FOLDER)
+            self.uploader.stop(timeout=60)
+        if self.compressor is not None:
+            self.compressor.stop()
+
+
+def send_command(path, request, timeout=COMMAND_TIMEOUT):
+    """
+    :param request: dict with the command and its arguments
+    :return: answer of the daemon listening on the Unix socket at path
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode("UTF-8") + b"\n")
+        with connection.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    if not 2 <= len(sys.argv) <= 4:
+        exit("usage: python daemon.py CONFIG [COMMAND [ARGUMENTS_JSON]]")
+    config = load_config(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        request = json.loads(sys.argv[3]) if len(sys.argv) > 3 else {}
+        request["command"] = sys.argv[2]
+        response = send_command(config["control_socket"], request)
+        print(json.dumps(response, indent=2))
+        sys.exit(0 if response["ok"] else 1)
+
+    from setup_file import SetupFileError
+    try:
+        daemon = Daemon(config)
+    except SetupFileError as e:
+        exit("Invalid setup file:\n" + str(e))
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.control.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
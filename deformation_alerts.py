@@ -0,0 +1,258 @@
+"""
+Movement detection while measuring. Every record is compared with the running statistics of its aim as soon as it
+is stored, so an aim that moved is reported within the set it moved in instead of after the files were analyzed.
+
+Per aim and face the monitor keeps in O(1) memory
+    a baseline mean and variance (Welford) of slope_dist, hz, v and the local coordinates x, y, z
+    an EWMA of the deviation from the baseline, following slow movements while smoothing the noise
+A threshold alert is raised when a single measurement deviates from the baseline by more than its threshold and by
+more than SIGMA_FACTOR standard deviations of the baseline, a trend alert when the EWMA of the 3D deviation exceeds
+TREND_THRESHOLD. Alerts are raised and cleared once, not with every measurement. While an aim is alerting its baseline
+is not updated, so a movement is not learned as the new normal.
+
+Local coordinates as of coordinates.py with the instrument as origin, in m. Angles in gon.
+
+Alerts are logged and handed to an AlertSink, which writes them from its own thread as JSON lines, either appended to
+a file or sent to a TCP listener:
+
+    sink = AlertSink("measurements/alerts.jsonl")  # or AlertSink("tcp://127.0.0.1:9200")
+    sink.start()
+    monitor = DeformationMonitor(sink, state_file="measurements/deformation_state.json")
+    monitor.update(record)
+"""
+
+import json
+import os
+import queue
+import socket
+import threading
+
+import numpy as np
+
+from geocom import GON2RAD
+from coordinates import polar_to_local
+from instrumentation import metrics as default_metrics
+from logger import log
+from measurement_store import NULL_HZ, NULL_V, NULL_SLOPE_DIST
+from rotating_file import atomic_write
+from set_reduction import wrap
+
+
+QUANTITIES = ("slope_dist", "hz", "v", "x", "y", "z")
+THRESHOLDS = {  # deviation from the baseline, m or gon
+    "slope_dist": 0.003,
+    "hz": 0.003,
+    "v": 0.003,
+    "displacement": 0.005,  # 3D, of x, y, z
+}
+TREND_THRESHOLD = 0.002  # m, EWMA of the 3D deviation from the baseline
+SIGMA_FACTOR = 4  # deviations within this many standard deviations of the baseline are noise
+EWMA_WEIGHT = 0.3  # of the newest measurement, about 3 measurements to follow a step
+MIN_BASELINE_COUNT = 5  # measurements of an aim before it is checked
+ALERT_QUEUE_SIZE = 1000  # alerts waiting for the sink, further alerts are dropped
+
+THRESHOLD = "threshold"
+TREND = "trend"
+
+
+class AimStatistics:
+    """
+    Running statistics of one aim in one face. Values are kept relative to the first measurement, hz wrapped, so
+    the sums stay small and hz is safe across 0/400.
+    """
+    __slots__ = ("reference", "count", "mean", "m2", "ewma", "alerts")
+
+    def __init__(self, values):
+        self.reference = values
+        self.count = 0
+        self.mean = np.zeros(len(QUANTITIES))
+        self.m2 = np.zeros(len(QUANTITIES))
+        self.ewma = np.zeros(3)  # deviation of x, y, z from the baseline
+        self.alerts = set()  # THRESHOLD and TREND while raised
+
+    def offsets(self, values):
+        offsets = values - self.reference
+        offsets[1] = wrap(offsets[1])
+        return offsets
+
+    def add(self, offsets):
+        self.count += 1
+        delta = offsets - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(offsets - self.mean)
+
+    def std(self):
+        return np.sqrt(self.m2/(self.count - 1)) if self.count > 1 else np.zeros(len(QUANTITIES))
+
+    def to_json(self):
+        return {"reference": self.reference.tolist(), "count": self.count, "mean": self.mean.tolist(),
+                "m2": self.m2.tolist(), "ewma": self.ewma.tolist(), "alerts": sorted(self.alerts)}
+
+    @classmethod
+    def from_json(cls, state):
+        statistics = cls(np.array(state["reference"]))
+        statistics.count = state["count"]
+        statistics.mean = np.array(state["mean"])
+        statistics.m2 = np.array(state["m2"])
+        statistics.ewma = np.array(state["ewma"])
+        statistics.alerts = set(state["alerts"])
+        return statistics
+
+
+class DeformationMonitor:
+    def __init__(self, sink=None, state_file=None, thresholds=THRESHOLDS, trend_threshold=TREND_THRESHOLD):
+        """
+        :param sink: AlertSink the alerts are passed to, alerts are only logged if None
+        :param state_file: JSON file the statistics are saved to by save() and loaded from, kept in memory only if None
+        """
+        self.sink = sink
+        self.state_file = state_file
+        self.thresholds = thresholds
+        self.trend_threshold = trend_threshold
+        self.statistics = {}  # (aim name, face) -> AimStatistics
+
+        if state_file is not None and os.path.isfile(state_file):
+            try:
+                with open(state_file, 'r') as f:
+                    self.statistics = {(state["aim"], state["face"]): AimStatistics.from_json(state)
+                                       for state in json.load(f)}
+            except (ValueError, KeyError):
+                log.error("Deformation state " + state_file + " unreadable, learning the baselines again")
+
+    def update(self, record):
+        """
+        Checks one measurement against the baseline of its aim and learns it.
+        :return: list of the alerts raised or cleared by this measurement
+        """
+        if record.null_mask & (NULL_HZ | NULL_V | NULL_SLOPE_DIST):
+            return []  # position unknown
+        hz, v = record.hz/GON2RAD, record.v/GON2RAD
+        face = 2 if v > 200 else 1
+        values = np.array((record.slope_dist, hz, v) + tuple(polar_to_local(hz, v, record.slope_dist)))
+
+        key = (record.aim_name, face)
+        statistics = self.statistics.get(key)
+        if statistics is None:
+            statistics = self.statistics[key] = AimStatistics(values)
+        offsets = statistics.offsets(values)
+
+        if statistics.count < MIN_BASELINE_COUNT:
+            statistics.add(offsets)
+            return []
+
+        deviation = offsets - statistics.mean
+        std = statistics.std()
+        displacement = float(np.linalg.norm(deviation[3:]))
+        displacement_std = float(np.linalg.norm(std[3:]))
+        statistics.ewma += EWMA_WEIGHT*(deviation[3:] - statistics.ewma)
+        trend = float(np.linalg.norm(statistics.ewma))
+
+        exceeded = {}
+        for i, quantity in enumerate(QUANTITIES[:3]):
+            if abs(deviation[i]) > max(self.thresholds[quantity], SIGMA_FACTOR*std[i]):
+                exceeded[quantity] = round(float(deviation[i]), 6)
+        if displacement > max(self.thresholds["displacement"], SIGMA_FACTOR*displacement_std):
+            exceeded["displacement"] = round(displacement, 6)
+
+        alerts = []
+        for kind, active in ((THRESHOLD, bool(exceeded)), (TREND, trend > self.trend_threshold)):
+            if active == (kind in statistics.alerts):
+                continue
+            if active:
+                statistics.alerts.add(kind)
+            else:
+                statistics.alerts.discard(kind)
+            alerts.append({
+                "time": record.timestamp,
+                "aim": record.aim_name,
+                "face": face,
+                "kind": kind,
+                "state": "raised" if active else "cleared",
+                "exceeded": exceeded if kind == THRESHOLD else {"trend": round(trend, 6)},
+                "deviation": dict(zip(QUANTITIES, np.round(deviation, 6).tolist())),
+                "baseline_count": statistics.count,
+            })
+
+        if not statistics.alerts:
+            statistics.add(offsets)
+
+        for alert in alerts:
+            if alert["state"] == "raised":
+                log.warning("Deformation alert " + alert["kind"] + " for " + alert["aim"] + " face " + str(face) +
+                            ": " + str(alert["exceeded"]))
+            else:
+                log.info("Deformation alert " + alert["kind"] + " for " + alert["aim"] + " face " + str(face) +
+                         " cleared")
+            if self.sink is not None:
+                self.sink.send(alert)
+        return alerts
+
+    def save(self):
+        if self.state_file is None:
+            return
+        state = [dict(statistics.to_json(), aim=aim, face=face) for (aim, face), statistics in self.statistics.items()]
+        with atomic_write(self.state_file) as f:
+            json.dump(state, f)
+
+    def close(self):
+        self.save()
+        if self.sink is not None:
+            self.sink.stop()
+
+
+class AlertSink(threading.Thread):
+    """
+    Writes alerts as JSON lines from its own thread, send() never blocks the measurement loop. Alerts that can not
+    be delivered are logged and dropped, they are in the log file as well.
+    """
+    def __init__(self, target, connect_timeout=5, metrics=default_metrics):
+        """
+        :param target: path of a file the alerts are appended to, or tcp://host:port of a listener
+        :param metrics: Metrics the alerts are counted in
+        """
+        super().__init__(daemon=True)
+        self.target = target
+        self.metrics = metrics
+        self.connect_timeout = connect_timeout
+        self.alerts = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self.connection = None
+
+    def send(self, alert):
+        try:
+            self.alerts.put_nowait(alert)
+        except queue.Full:
+            self.metrics.count("alerts_dropped")
+            log.error("Alert queue full, dropping alert for " + alert["aim"])
+
+    def stop(self, timeout=10):
+        self.alerts.put(None)
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            alert = self.alerts.get()
+            if alert is None:
+                break
+            try:
+                self.write((json.dumps(alert) + "\n").encode("UTF-8"))
+                self.metrics.count("alerts_sent")
+            except OSError as e:
+                self.metrics.count("alerts_dropped")
+                log.error("Could not deliver alert to " + self.target + ": " + repr(e))
+                self.disconnect()
+        self.disconnect()
+
+    def write(self, line):
+        if not self.target.startswith("tcp://"):
+            with open(self.target, 'ab') as f:
+                f.write(line)
+            return
+        if self.connection is None:
+            host, port = self.target[len("tcp://"):].rsplit(':', 1)
+            self.connection = socket.create_connection((host, int(port)), timeout=self.connect_timeout)
+        self.connection.sendall(line)
+
+    def disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
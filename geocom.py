@@ -1,16 +1,25 @@
-import serial
 import time
-import math as m
 
 from geocom_dicts import *
+from instrumentation import metrics as default_metrics, rpc_number
 from logger import log
+from transport import PySerialTransport, TransportError, PARITY_NONE, STOPBITS_ONE
+from serial_trace import CaptureTransport
+from geocom_rpc import RPCS, GON2RAD
 
 
-GON2RAD = m.pi/200
+REPLY_TERMINATOR = b"\r\n"
+MAX_TRANSACTION_ID = 7  # transaction ids cycle through 1..MAX_TRANSACTION_ID
 
 
 class SerialConnection:
-    def __init__(self, port, baudrate=115200, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, timeout=1):
+    def __init__(self, port, baudrate=115200, parity=PARITY_NONE, stopbits=STOPBITS_ONE, timeout=1,
+                 use_transaction_ids=True, transport=None, capture_path=None, metrics=default_metrics):
+        """
+        :param transport: Transport to talk over, defaults to a pyserial port opened on port
+        :param capture_path: file all traffic is recorded to for replaying it later, see serial_trace.py
+        :param metrics: Metrics of the instrument on this port, see instrumentation.py
+        """
 
         self.port = port
         self.baudrate = baudrate
@@ -18,28 +27,58 @@ class SerialConnection:
         self.stopbits = stopbits
         self.timeout = timeout
 
-        self.ser = None
+        self.metrics = metrics
+        self.use_transaction_ids = use_transaction_ids
+        self.transaction_id = 0
+        self.expected_transaction_id = None
+        self.rx_buffer = bytearray()  # received bytes not yet consumed as a reply, kept between calls, replies
+        # to earlier commands are told apart by their transaction id
+
+        # running totals, GeoCom takes the difference around each rpc
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        self.generation = 0  # counts openings of the port, the instrument may have lost its settings in between
+
+        if transport is None:
+            transport = PySerialTransport(port, baudrate=baudrate, parity=parity, stopbits=stopbits, timeout=timeout)
+        if capture_path is not None:
+            transport = CaptureTransport(transport, capture_path)
+        self.ser = transport
         self.establish_serial_connection()
 
     def establish_serial_connection(self):
         # blocking until serial connection is established
         while True:
-            if self.ser is not None:
-                if self.ser.is_open:
-                    self.ser.close()
+            if self.ser.is_open:
+                self.ser.close()
 
             log.info("Trying to open serial connection on port " + self.port)
 
             try:
-                self.ser = serial.Serial(self.port, baudrate=self.baudrate, parity=self.parity, stopbits=self.stopbits,
-                                         timeout=self.timeout)
+                self.ser.open()
+                self.generation += 1
                 log.info("Successfully opened serial connection on port " + self.port)
                 break
-            except (serial.serialutil.SerialException, ):
+            except (TransportError, ):
                 time.sleep(2)
 
+    def clock(self):
+        return self.ser.clock()
+
+    def sleep(self, seconds):
+        self.ser.sleep(seconds)
+
+    def wall(self):
+        return self.ser.wall()
+
     def reset_serial_connection(self):
+        with self.metrics.phase("serial_reset", self.clock):
+            return self.reset_serial_connection_blocking()
+
+    def reset_serial_connection_blocking(self):
         log.error("Resetting serial connection")
+        self.rx_buffer.clear()
         try:
             self.ser.readall()
         except:
@@ -52,109 +91,201 @@ class SerialConnection:
         return False
 
     def send(self, string):
+        if self.use_transaction_ids:
+            string = self.tag_transaction_id(string)
         try:
-            self.ser.write(string.encode("UTF-8"))
+            if self.expected_transaction_id is None:
+                # nothing tells an earlier reply still buffered from the reply to this command
+                self.rx_buffer.clear()
+                self.ser.reset_input_buffer()
+            data = string.encode("UTF-8")
+            self.ser.write(data)
+            self.bytes_sent += len(data)
             return True
-        except serial.serialutil.SerialException:
+        except TransportError:
             log.error("USB unplugged!")
             self.establish_serial_connection()
             return False
 
-    def receive(self, rsp_amount, timeout=10):
-        result_string = []
-
-        start_time = time.time()
-        while start_time + timeout > time.time():
+    def tag_transaction_id(self, string):
+        # %R1Q,<rpc>:<params> -> %R1Q,<rpc>,<trid>:<params>, the instrument echoes trid in the reply header
+        header, separator, params = string.partition(':')
+        if not separator or header.count(',') != 1:
+            self.expected_transaction_id = None
+            return string
+        self.transaction_id = self.transaction_id % MAX_TRANSACTION_ID + 1
+        self.expected_transaction_id = str(self.transaction_id)
+        return header + ',' + self.expected_transaction_id + separator + params
+
+    def read_line(self, deadline):
+        # returns one reply without its terminator or None if the deadline passed before it was complete
+        while True:
+            end = self.rx_buffer.find(REPLY_TERMINATOR)
+            if end >= 0:
+                line = bytes(self.rx_buffer[:end])
+                del self.rx_buffer[:end + len(REPLY_TERMINATOR)]
+                return line
+            if self.ser.clock() >= deadline:
+                return None
+            chunk = self.ser.read(self.ser.in_waiting or 1)  # blocks at most the port timeout
+            if chunk:
+                self.rx_buffer += chunk
+                self.bytes_received += len(chunk)
+
+    def receive(self, decode, timeout=10):
+        """
+        :param decode: decoder of the expected reply, see geocom_rpc.py
+        """
+        deadline = self.ser.clock() + timeout
+        while True:
             try:
-                char = self.ser.read(1).decode("UTF-8")
-            except (UnicodeDecodeError, ):
-                char = False
-            except (serial.serialutil.SerialException, ):
+                line = self.read_line(deadline)
+            except (TransportError, ):
                 log.error("USB unplugged!")
                 self.establish_serial_connection()
                 return False
 
-            if char:
-                result_string.append(char)
+            if line is None:
+                self.timeouts += 1
+                log.error("Geocom Timeout, no response")
+                return False
 
-                if char == '\n':
-                    break
-        else:
-            log.error("Geocom Timeout, no response")
-            return False
+            try:
+                line = line.decode("UTF-8")
+            except (UnicodeDecodeError, ):
+                log.error("Geocom response garbled")
+                return False
 
-        try:
-            return_list = ''.join(result_string)[:-2].split(':')[1].split(',')
+            header, separator, body = line.partition(':')
+            if not header.startswith("%R1P"):
+                continue  # line noise, keep waiting for the reply
 
-            if len(return_list) == rsp_amount:
-                return return_list
-            else:
-                log.error("Geocom response length missmatch " + str(len(return_list)) + "!=" + str(rsp_amount))
-                return False
-        except:  # TODO errors .. IndexError
+            header_fields = header.split(',')
+            if self.expected_transaction_id is not None and len(header_fields) == 3 \
+                    and header_fields[2] != self.expected_transaction_id:
+                log.warning("Discarding stale Geocom response " + line)
+                continue
+            break
+
+        if not separator:
             log.error("Geocom response index error")
             return False
 
+        return decode(body)
+
 
 class GeoCom:
-    def __init__(self, sercon):
+    def __init__(self, sercon, adaptive_timeouts=None):
+        """
+        :param adaptive_timeouts: AdaptiveTimeouts replacing the fixed timeout of first attempts, None for fixed
+        """
         self.sercon = sercon
+        self.adaptive_timeouts = adaptive_timeouts
 
-    def save_send_and_receive(self, string, rsp_amount, retry_amount=3, timeout=10):
+    def save_send_and_receive(self, string, decode, retry_amount=3, timeout=10):
+        start = time.perf_counter()
+        bytes_sent, bytes_received, timeouts = self.sercon.bytes_sent, self.sercon.bytes_received, self.sercon.timeouts
+        rpc = rpc_number(string)
+        attempts = 0
+
+        recv = False
         while retry_amount:
+            attempts += 1
+            attempt_timeout = timeout
+            if self.adaptive_timeouts is not None and attempts == 1:
+                attempt_timeout = self.adaptive_timeouts.timeout(string, timeout)  # retries fall back to the fixed one
+
+            attempt_start = time.perf_counter()
+            attempt_timeouts = self.sercon.timeouts
             if self.sercon.send(string):
-                recv = self.sercon.receive(rsp_amount, timeout=timeout)
+                recv = self.sercon.receive(decode, timeout=attempt_timeout)
                 if recv:
-                    return recv
+                    if self.adaptive_timeouts is not None:
+                        self.adaptive_timeouts.observe(string, time.perf_counter() - attempt_start)
+                    break
+                elif attempt_timeout < timeout and self.sercon.timeouts > attempt_timeouts:
+                    # only the learned timeout ran out, the reply may still come and is discarded by its trid
+                    log.error("Retrying command with the fixed timeout")
                 else:
                     if not self.sercon.reset_serial_connection():
-                        return False
+                        break
                     log.error("Retrying command")
             retry_amount -= 1
+        else:
+            log.error("Geocom did not receive response")
 
-        log.error("Geocom did not receive response")
-        return False
+        self.sercon.metrics.rpc(rpc, time.perf_counter() - start,
+                                bytes_sent=self.sercon.bytes_sent - bytes_sent,
+                                bytes_received=self.sercon.bytes_received - bytes_received, retries=attempts - 1,
+                                timeouts=self.sercon.timeouts - timeouts, rc=recv.rc if recv else None)
+        return recv
+
+    def pipeline(self, *calls):
+        """
+        Issues independent requests, given as (method name, *args) tuples, and returns their responses in order.
+        Here one round trip follows the other, PipelinedGeoCom queues them back to back.
+        """
+        return [getattr(self, call[0])(*call[1:]) for call in calls]
+
+    def invalidate_cache(self):
+        pass  # nothing cached here, see geocom_cache.CachedGeoCom
+
+    def call(self, name, *args):
+        rpc = RPCS[name]
+        return self.save_send_and_receive(rpc.encode(*args), rpc.decode, timeout=rpc.timeout)
 
     def BAP_SetPrismType(self, prismtype):
-        return self.save_send_and_receive("%R1Q,17008:" + str(prismtype) + "\r\n", 1, timeout=1)
+        return self.call("BAP_SetPrismType", prismtype)
 
     def BAP_SetTargetType(self, targettype):
-        return self.save_send_and_receive("%R1Q,17021:" + str(targettype) + "\r\n", 1, timeout=1)
+        return self.call("BAP_SetTargetType", targettype)
 
     def TMC_SetInclineSwitch(self, on_off_type):
-        return self.save_send_and_receive("%R1Q,2006:" + str(on_off_type) + "\r\n", 1, timeout=1)
+        return self.call("TMC_SetInclineSwitch", on_off_type)
 
     def TMC_SetAtmPpm(self, dppma):
-        # %R1Q,2148:
-        return self.save_send_and_receive("%R1Q,2148:" + str(dppma) + "\r\n", 1, timeout=1)
+        return self.call("TMC_SetAtmPpm", dppma)
 
     def AUS_SetUserAtrState(self, on_off_type):
-        return self.save_send_and_receive("%R1Q,18005:" + str(on_off_type) + "\r\n", 1, timeout=1)
+        return self.call("AUS_SetUserAtrState", on_off_type)
 
     def AUT_MakePositioning(self, hz, v, posmode, atrmode, bDummy=BOOLE[False]):
-        return self.save_send_and_receive("%R1Q,9027:" + str(hz*GON2RAD) + ',' + str(v*GON2RAD) + ',' + str(posmode) + ',' + str(atrmode) + ',' + str(bDummy) + "\r\n", 1, timeout=15)
+        # hz and v in gon
+        return self.call("AUT_MakePositioning", hz, v, posmode, atrmode, bDummy)
 
     def AUT_FineAdjust(self, dSrchHz, dSrchV, bDummy=BOOLE[False]):
-        return self.save_send_and_receive("%R1Q,9037:" + str(dSrchHz*GON2RAD) + ',' + str(dSrchV*GON2RAD) + ',' + str(bDummy) + "\r\n", 1, timeout=15)
+        # search range in gon
+        return self.call("AUT_FineAdjust", dSrchHz, dSrchV, bDummy)
 
     def TMC_DoMeasure(self, command, mode):
-        return self.save_send_and_receive("%R1Q,2008:" + str(command) + ',' + str(mode) + "\r\n", 1, timeout=15)
+        return self.call("TMC_DoMeasure", command, mode)
 
     def TMC_GetFullMeas(self, waittime, mode):
         # waittime in ms
-        return self.save_send_and_receive("%R1Q,2167:" + str(waittime) + ',' + str(mode) + "\r\n", 9, timeout=15)
+        return self.call("TMC_GetFullMeas", waittime, mode)
 
     def TMC_GetAngle1(self, mode):
-        return self.save_send_and_receive("%R1Q,2003:" + str(mode) + "\r\n", 10, timeout=15)
+        return self.call("TMC_GetAngle1", mode)
 
     def TMC_GetAngle5(self, mode):
-        return self.save_send_and_receive("%R1Q,2107:" + str(mode) + "\r\n", 5, timeout=15)
+        return self.call("TMC_GetAngle5", mode)
 
     def BAP_SetMeasPrg(self, emeasprg):
-        return self.save_send_and_receive("%R1Q,17019:" + str(emeasprg) + "\r\n", 1, timeout=15)
+        return self.call("BAP_SetMeasPrg", emeasprg)
 
     def TMC_SetEdmMode(self, mode):
-        return self.save_send_and_receive("%R1Q,2020:" + str(mode) + "\r\n", 1, timeout=15)
+        return self.call("TMC_SetEdmMode", mode)
 
     def CSV_GetIntTemp(self):
-        return self.save_send_and_receive("%R1Q,5011:\r\n", 2, timeout=4)
+        return self.call("CSV_GetIntTemp")
+
+    def CSV_CheckPower(self):
+        # capacity in %, active_power and power_suggest of CSV_POWER_PATH
+        return self.call("CSV_CheckPower")
+
+    def TMC_GetSignal(self):
+        # intensity in %, only while TMC_DoMeasure(TMC_SIGNAL) runs
+        return self.call("TMC_GetSignal")
+
+    def MOT_ReadLockStatus(self):
+        return self.call("MOT_ReadLockStatus")
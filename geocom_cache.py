@@ -0,0 +1,105 @@
+"""
+Remembers the values the instrument confirmed for its setter RPCs and does not send them again while unchanged.
+Consecutive aims with the same target and prism type skip their setup round trips.
+
+The cache is dropped whenever the instrument may have lost its settings: after the serial port was opened again,
+after a request timed out (the instrument may have been without power), after a request failed, on every
+initialize and at the start of every set. An instrument power cycled between sets while the USB adapter kept the port
+open would otherwise keep settings it no longer has. A setter answered with a return code other than GRC_OK is not
+remembered.
+
+    geocom = CachedGeoCom(GeoCom(sercon))
+
+Hits and misses are counted in the metrics as geocom_cache_hits and geocom_cache_misses.
+"""
+
+import functools
+
+from geocom_dicts import *
+from geocom_rpc import RPCS
+
+
+CACHED_SETTERS = (
+    "AUS_SetUserAtrState",
+    "BAP_SetTargetType",
+    "BAP_SetPrismType",
+    "BAP_SetMeasPrg",
+    "TMC_SetInclineSwitch",
+    "TMC_SetAtmPpm",
+    "TMC_SetEdmMode",
+)
+
+
+class CachedGeoCom:
+    """
+    Wraps a GeoCom or PipelinedGeoCom, everything but the setters and pipeline is passed through.
+    """
+    def __init__(self, geocom):
+        self.geocom = geocom
+        self.values = {}  # setter name -> args last confirmed by the instrument
+        self.generation = geocom.sercon.generation
+        self.timeouts = geocom.sercon.timeouts
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        if name in CACHED_SETTERS:
+            return functools.partial(self.set, name)
+        return getattr(self.geocom, name)
+
+    def invalidate_cache(self):
+        self.values.clear()
+
+    def check_link(self):
+        # a reopened port or a timeout since the last check may mean the instrument restarted
+        sercon = self.geocom.sercon
+        if sercon.generation != self.generation or sercon.timeouts != self.timeouts:
+            self.values.clear()
+            self.generation = sercon.generation
+            self.timeouts = sercon.timeouts
+
+    def lookup(self, name, args):
+        if self.values.get(name) == args:
+            self.hits += 1
+            self.geocom.sercon.metrics.count("geocom_cache_hits")
+            return RPCS[name].reply(GRC["GRC_OK"])
+        self.misses += 1
+        self.geocom.sercon.metrics.count("geocom_cache_misses")
+        return None
+
+    def remember(self, name, args, rsp):
+        if not rsp:
+            self.values.clear()
+        elif rsp.ok:
+            self.values[name] = args
+        else:
+            self.values.pop(name, None)
+
+    def set(self, name, *args):
+        self.check_link()
+        rsp = self.lookup(name, args)
+        if rsp is not None:
+            return rsp
+        rsp = getattr(self.geocom, name)(*args)
+        self.check_link()
+        self.remember(name, args, rsp)
+        return rsp
+
+    def pipeline(self, *calls):
+        self.check_link()
+        rsps = [None]*len(calls)
+        sent = []  # indices of the calls that go to the instrument, in their original order
+        for i, call in enumerate(calls):
+            if call[0] in CACHED_SETTERS:
+                rsps[i] = self.lookup(call[0], tuple(call[1:]))
+            if rsps[i] is None:
+                sent.append(i)
+
+        if sent:
+            sent_rsps = self.geocom.pipeline(*[calls[i] for i in sent])
+            self.check_link()
+            for i, rsp in zip(sent, sent_rsps):
+                rsps[i] = rsp
+                if calls[i][0] in CACHED_SETTERS:
+                    self.remember(calls[i][0], tuple(calls[i][1:]), rsp)
+        return rsps
@@ -92,4 +92,54 @@ EDM_MODE = {
     "EDM_AVERAGE_LR": 12,
     "EDM_PRECISE_IR": 13,
     "EDM_PRECISE_TAPE": 14,
-}
\ No newline at end of file
+}
+
+CSV_POWER_PATH = {
+    "CSV_CURRENT_POWER": 0,
+    "CSV_EXTERNAL_POWER": 1,  # power source is external
+    "CSV_INTERNAL_POWER": 2,  # power source is the internal battery
+}
+
+MOT_LOCK_STATUS = {
+    "MOT_LOCKED_OUT": 0,  # ATR not locked onto a target
+    "MOT_LOCKED_IN": 1,  # ATR locked onto a target and following it
+    "MOT_PREDICTION": 2,  # target lost, following its predicted path
+}
+
+GRC = {
+    "GRC_OK": 0,
+    "GRC_UNDEFINED": 1,
+    "GRC_IVPARAM": 2,
+    "GRC_IVRESULT": 3,
+    "GRC_FATAL": 4,
+    "GRC_NOT_IMPL": 5,
+    "GRC_TIME_OUT": 6,
+    "GRC_SET_INCOMPL": 7,
+    "GRC_ABORT": 8,
+    "GRC_NOMEMORY": 9,
+    "GRC_NOTINIT": 10,
+    "GRC_SHUT_DOWN": 12,
+    "GRC_SYSBUSY": 13,
+    "GRC_HWFAILURE": 14,
+    "GRC_TMC_NO_FULL_CORRECTION": 1283,  # measurement without full correction
+    "GRC_TMC_ACCURACY_GUARANTEE": 1284,  # accuracy can not be guaranteed
+    "GRC_TMC_ANGLE_OK": 1285,  # only angle measurement valid
+    "GRC_TMC_ANGLE_NOT_FULL_CORR": 1288,  # only angle measurement valid but without full correction
+    "GRC_TMC_ANGLE_NO_ACC_GUARANTY": 1289,  # only angle measurement valid but accuracy not guaranteed
+    "GRC_TMC_ANGLE_ERROR": 1290,  # no angle measurement possible
+    "GRC_TMC_DIST_PPM": 1291,  # wrong setting of ppm or mm on EDM
+    "GRC_TMC_DIST_ERROR": 1292,  # distance measurement not done (no aim, etc.)
+    "GRC_TMC_BUSY": 1293,  # system is busy (no measurement done)
+    "GRC_TMC_SIGNAL_ERROR": 1294,  # no signal on EDM (only in signal mode)
+    "GRC_AUT_TIMEOUT": 8704,  # position not reached
+    "GRC_AUT_MOTOR_ERROR": 8707,  # instrument has no motorization
+    "GRC_AUT_INCL_ERROR": 8708,  # position not exactly reached
+    "GRC_AUT_DEV_ERROR": 8709,  # deviation measurement error
+    "GRC_AUT_NO_TARGET": 8710,  # no target detected
+    "GRC_AUT_MULTIPLE_TARGETS": 8711,  # multiple targets detected
+    "GRC_AUT_BAD_ENVIRONMENT": 8712,  # bad environment conditions
+    "GRC_AUT_DETECTOR_ERROR": 8713,  # error in target acquisition
+    "GRC_AUT_NOT_ENABLED": 8714,  # target acquisition not enabled
+    "GRC_AUT_ACCURACY": 8716,  # position not exactly reached
+    "GRC_AUT_ANGLE_ERROR": 8719,  # angle measurement error
+}
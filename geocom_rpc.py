@@ -0,0 +1,149 @@
+"""
+The GeoCOM RPCs of the TM50 this project uses, described once in RPCS. Every description gets an encoder, checking the
+arguments and formatting the request, and a decoder, splitting the reply and converting it to typed values. Encoders
+keep the requests they formatted, sending the same request again, like positioning to an aim in the next set, only
+looks it up:
+
+    rpc = RPCS["TMC_GetAngle1"]
+    rpc.encode(TMC_INCLINE_PRG["TMC_AUTO_INC"])  # "%R1Q,2003:1\r\n"
+    reply = rpc.decode("0,1.2,1.5,0.0001,0,0.00001,-0.00002,0.0001,0,0")
+    reply.rc, reply.hz, reply.cross_incline  # 0, 1.2, 1e-05, also reply[0], reply[1], ...
+
+Replies are named tuples with the return code first, so positional access keeps working. Angles of replies are in
+rad as sent by the instrument, ANGLE parameters are given in gon and sent in rad. Parameters taking a value of one
+of the dicts of geocom_dicts.py are checked against it before anything is sent.
+
+A reply carrying only a return code (the instrument rejected the request) has None in all other fields. A reply with
+another number of fields or fields that do not parse decodes to False, like no reply at all.
+"""
+
+import collections
+import math as m
+import operator
+
+from geocom_dicts import *
+from logger import log
+
+
+GON2RAD = m.pi/200
+ENCODE_CACHE_SIZE = 4096  # requests kept per RPC, positioning repeats the directions of the aims every set
+CALL = getattr(operator, "call", lambda function, argument: function(argument))  # operator.call is new in 3.11
+
+# parameter and field types
+INT = int
+DOUBLE = float
+ANGLE = "angle"  # parameter in gon, sent in rad
+
+# values: dict of geocom_dicts.py the value has to be from, default: value if the argument is left out
+Param = collections.namedtuple("Param", "name type values default", defaults=(None, None))
+
+
+class Rpc:
+    def __init__(self, name, number, params=(), fields=(), timeout=10):
+        """
+        :param params: Param of the request in order
+        :param fields: (name, INT or DOUBLE) of the reply in order, without the return code
+        :param timeout: seconds to wait for the reply
+        """
+        self.name = name
+        self.number = number
+        self.params = params
+        self.fields = fields
+        self.timeout = timeout
+
+        base = collections.namedtuple(name + "Reply", ("rc", ) + tuple(field for field, _ in fields))
+        self.reply = type(name + "Reply", (base, ), {"__slots__": (),
+                                                     "ok": property(lambda reply: reply.rc == GRC["GRC_OK"])})
+        self.encode = self.make_encoder()
+        self.decode = self.make_decoder()
+
+    def make_encoder(self):
+        prefix = "%R1Q," + str(self.number) + ":"
+        params = self.params
+        name = self.name
+        # str() of each value, from the dict of the parameter for enumerated ones, which also checks the value
+        formats = [(lambda value: str(value*GON2RAD)) if param.type == ANGLE else
+                   {value: str(value) for value in param.values.values()}.__getitem__ if param.values is not None else
+                   str for param in params]
+        cache = {}
+
+        defaults = tuple(param.default for param in params)
+
+        def format_request(args):
+            if len(args) != len(params):
+                if len(args) > len(params) or None in defaults[len(args):]:
+                    raise TypeError(name + " takes the arguments " + ", ".join(param.name for param in params) +
+                                    ", got " + str(len(args)))
+                args += defaults[len(args):]
+            try:
+                return prefix + ",".join([format(value) for format, value in zip(formats, args)]) + "\r\n"
+            except KeyError:
+                for param, format, value in zip(params, formats, args):
+                    if param.values is not None and value not in param.values.values():
+                        raise ValueError(name + ": " + param.name + " " + repr(value) + " is not valid") from None
+                raise
+
+        def encode(*args):
+            key = args + tuple(map(type, args))  # 1, 1.0 and True are equal keys but formatted differently
+            request = cache.get(key)
+            if request is None:
+                request = format_request(args)
+                if len(cache) >= ENCODE_CACHE_SIZE:
+                    cache.clear()
+                cache[key] = request
+            return request
+        return encode
+
+    def make_decoder(self):
+        # str() of floats and ints as in the request is what the instrument parses, the reply is converted back here
+        conversions = [int] + [kind for _, kind in self.fields]
+        field_count = len(conversions)
+        reply = self.reply
+        new = tuple.__new__  # skips the argument handling of the named tuple constructor
+        none = (None, )*len(self.fields)
+        name = self.name
+
+        def decode(body):
+            fields = body.split(',')
+            try:
+                if len(fields) == field_count:
+                    return new(reply, map(CALL, conversions, fields))  # every field straight to its type
+                if len(fields) == 1:
+                    return new(reply, (int(fields[0]), ) + none)
+            except ValueError:
+                log.error("Geocom response garbled " + repr(body))
+                return False
+            log.error("Geocom response length missmatch " + str(len(fields)) + "!=" + str(field_count) + " of " + name)
+            return False
+        return decode
+
+
+RPCS = {rpc.name: rpc for rpc in (
+    Rpc("TMC_GetAngle1", 2003, (Param("mode", INT, TMC_INCLINE_PRG), ),
+        (("hz", DOUBLE), ("v", DOUBLE), ("angle_accuracy", DOUBLE), ("angle_time", INT), ("cross_incline", DOUBLE),
+         ("length_incline", DOUBLE), ("incline_accuracy", DOUBLE), ("incline_time", INT), ("face", INT)),
+        timeout=15),
+    Rpc("TMC_SetInclineSwitch", 2006, (Param("switch", INT, ON_OFF_TYPE), ), timeout=1),
+    Rpc("TMC_DoMeasure", 2008, (Param("command", INT, TMC_MEASURE_PRG), Param("mode", INT, TMC_INCLINE_PRG)),
+        timeout=15),
+    Rpc("TMC_SetEdmMode", 2020, (Param("mode", INT, EDM_MODE), ), timeout=15),
+    Rpc("TMC_GetSignal", 2022, (), (("intensity", DOUBLE), ("signal_time", INT)), timeout=4),
+    Rpc("TMC_GetAngle5", 2107, (Param("mode", INT, TMC_INCLINE_PRG), ), (("hz", DOUBLE), ("v", DOUBLE)), timeout=15),
+    Rpc("TMC_SetAtmPpm", 2148, (Param("ppm", DOUBLE), ), timeout=1),
+    Rpc("TMC_GetFullMeas", 2167, (Param("wait_time", INT), Param("mode", INT, TMC_INCLINE_PRG)),
+        (("hz", DOUBLE), ("v", DOUBLE), ("angle_accuracy", DOUBLE), ("cross_incline", DOUBLE),
+         ("length_incline", DOUBLE), ("incline_accuracy", DOUBLE), ("slope_dist", DOUBLE), ("dist_time", DOUBLE)),
+        timeout=15),
+    Rpc("CSV_GetIntTemp", 5011, (), (("temperature", DOUBLE), ), timeout=4),
+    Rpc("CSV_CheckPower", 5039, (), (("capacity", INT), ("active_power", INT), ("power_suggest", INT)), timeout=4),
+    Rpc("MOT_ReadLockStatus", 6021, (), (("lock_status", INT), ), timeout=4),
+    Rpc("AUT_MakePositioning", 9027, (Param("hz", ANGLE), Param("v", ANGLE), Param("pos_mode", INT, AUT_POSMODE),
+                                      Param("atr_mode", INT, AUT_ATRMODE),
+                                      Param("dummy", INT, BOOLE, BOOLE[False])), timeout=15),
+    Rpc("AUT_FineAdjust", 9037, (Param("search_hz", ANGLE), Param("search_v", ANGLE),
+                                 Param("dummy", INT, BOOLE, BOOLE[False])), timeout=15),
+    Rpc("BAP_SetPrismType", 17008, (Param("prism", INT, PrismType), ), timeout=1),
+    Rpc("BAP_SetMeasPrg", 17019, (Param("program", INT, BAP_USER_MEASPRG), ), timeout=15),
+    Rpc("BAP_SetTargetType", 17021, (Param("target", INT, BAP_TARGET_TYPE), ), timeout=1),
+    Rpc("AUS_SetUserAtrState", 18005, (Param("state", INT, ON_OFF_TYPE), ), timeout=1),
+)}
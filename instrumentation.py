@@ -0,0 +1,216 @@
+"""
+Low overhead timing and counters of GeoCOM RPCs and measurement phases. Durations go into fixed log spaced
+histograms held in memory. dump_set() appends a JSON summary of the finished set to metrics/YYYYMMDD.jsonl and
+serve() exposes the totals since start as JSON on a local HTTP port.
+
+metrics is the instance of a single instrument. With several, every SerialConnection gets a Metrics of its own,
+which the GeoCom, scheduler and handler on it record to, so the sets of one instrument are not cut at the set
+boundaries of another:
+
+    sercon = SerialConnection(port, metrics=Metrics("metrics/TS1/"))
+"""
+
+import bisect
+import contextlib
+import datetime as dt
+import http.server
+import json
+import os
+import threading
+import time
+
+
+METRICS_FOLDER = "metrics/"
+# upper bucket bounds in seconds, 1 ms * sqrt(2)^k up to about 46 s, everything above lands in the last bucket
+BUCKET_BOUNDS = [0.001*2**(k/2) for k in range(32)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0]*(len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile
+        if not self.count:
+            return None
+        rank = p/100*self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": list(self.counts),
+        }
+
+
+class RpcStats:
+    def __init__(self):
+        self.duration = Histogram()
+        self.retries = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.return_codes = {}
+
+    def summary(self):
+        return {
+            "duration": self.duration.summary(),
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "return_codes": self.return_codes,
+        }
+
+
+class MetricsWindow:
+    def __init__(self):
+        self.started = time.time()
+        self.rpcs = {}  # rpc number -> RpcStats
+        self.phases = {}  # phase name -> Histogram
+        self.counters = {}  # name -> count
+
+    def summary(self):
+        return {
+            "start": self.started,
+            "end": time.time(),
+            "bucket_bounds": BUCKET_BOUNDS,
+            "rpcs": {str(rpc): stats.summary() for rpc, stats in sorted(self.rpcs.items())},
+            "phases": {name: histogram.summary() for name, histogram in sorted(self.phases.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+class Metrics:
+    def __init__(self, folder=METRICS_FOLDER):
+        """
+        :param folder: the set summaries are appended to files in it
+        """
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.set = MetricsWindow()  # since the last dump_set
+        self.total = MetricsWindow()  # since start
+        self.server = None
+
+    def rpc(self, rpc, seconds, bytes_sent=0, bytes_received=0, retries=0, timeouts=0, rc=None):
+        """
+        :param rc: return code of the reply, None if no valid reply arrived
+        """
+        with self.lock:
+            for window in (self.set, self.total):
+                stats = window.rpcs.get(rpc)
+                if stats is None:
+                    stats = window.rpcs[rpc] = RpcStats()
+                stats.duration.add(seconds)
+                stats.retries += retries
+                stats.timeouts += timeouts
+                stats.bytes_sent += bytes_sent
+                stats.bytes_received += bytes_received
+                if rc is None:
+                    stats.failures += 1
+                else:
+                    stats.return_codes[rc] = stats.return_codes.get(rc, 0) + 1
+
+    def record_phase(self, name, seconds):
+        with self.lock:
+            for window in (self.set, self.total):
+                histogram = window.phases.get(name)
+                if histogram is None:
+                    histogram = window.phases[name] = Histogram()
+                histogram.add(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            for window in (self.set, self.total):
+                window.counters[name] = window.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def phase(self, name, clock=time.perf_counter):
+        """
+        :param clock: clock the phase is timed on, that of the serial connection so simulated waits count
+        """
+        start = clock()
+        try:
+            yield
+        finally:
+            self.record_phase(name, clock() - start)
+
+    def sleep(self, name, seconds, sleep=time.sleep, clock=time.perf_counter):
+        # a fixed pause, recorded as phase so its share of the set time shows up
+        with self.phase(name, clock):
+            sleep(seconds)
+
+    def dump_set(self):
+        with self.lock:
+            window, self.set = self.set, MetricsWindow()
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        with open(os.path.join(self.folder, dt.datetime.now().strftime("%Y%m%d") + ".jsonl"), 'a') as f:
+            f.write(json.dumps(window.summary()) + "\n")
+
+    def summary(self):
+        with self.lock:
+            return self.total.summary()
+
+    def reset(self):
+        # starts both windows over, e.g. between benchmark runs
+        with self.lock:
+            self.set, self.total = MetricsWindow(), MetricsWindow()
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves summary() as JSON on http://host:port/ from a daemon thread.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.summary()).encode("UTF-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def rpc_number(string):
+    # "%R1Q,2003:1\r\n" -> 2003
+    try:
+        return int(string[5:string.index(':')].split(',')[0])
+    except ValueError:
+        return 0
+
+
+metrics = Metrics()
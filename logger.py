@@ -1,39 +1,202 @@
+import atexit
 import os
+import queue
+import sys
+import threading
+import time
 import datetime as dt
 
+from rotating_file import DailyFile, days
+
 
 LOG_FOLDER = "logs/"
+LEVELS = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "WARNING": 30,
+    "ERROR": 40,
+}
+QUEUE_SIZE = 10000  # records waiting for the writer thread
+QUEUE_FULL_POLICY = "drop"  # "drop" discards new records below ERROR while the queue is full, "block" waits
+FLUSH_INTERVAL = 1  # s, the file is flushed at least this often while records arrive
+PUT_TIMEOUT = 5  # s errors and records of the "block" policy wait for space before they are dropped as well
+
+STOP = None  # queued by close() to end the writer thread
 
 
 class Logger:
-    def __init__(self):
-        if not os.path.isdir(LOG_FOLDER):
-            os.mkdir(LOG_FOLDER)
-        self.current_file_name = LOG_FOLDER + dt.datetime.now().strftime("%Y%m%d") + ".txt"
+    """
+    Callers only queue their records, a writer thread formats them, prints them and appends them to one file per
+    day kept open between records, see rotating_file.py. Records are written in batches and the file changes with the
+    day of the record, set_new_file_name is not needed anymore. Errors wait up to PUT_TIMEOUT for space in the queue,
+    so a writer that cannot keep up never blocks the measurements for good. A record that cannot be written is
+    reported on stderr and the writer goes on, records of after close() are written right away by the caller.
+    Structured fields are appended as key=value:
+
+        log.info("Measured", aim="P1", rc=0)
+
+    A thread can route its records to a stream of its own, logs/<stream>/YYYYMMDD.txt, with set_thread_stream.
+    """
+    def __init__(self, folder=LOG_FOLDER, level="INFO", queue_size=QUEUE_SIZE, queue_full_policy=QUEUE_FULL_POLICY,
+                 flush_interval=FLUSH_INTERVAL, echo=True):
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+        self.folder = folder
+        self.level = LEVELS[level]
+        self.queue_full_policy = queue_full_policy
+        self.flush_interval = flush_interval
+        self.echo = echo  # print records to stdout as well
+
+        self.records = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        self.write_lock = threading.Lock()  # for the records written by callers after close()
+
+        self.thread_stream = threading.local()
+        self.files = {}  # stream -> DailyFile, None is the main stream
+        self.stamp_second = None
+        self.stamp = None
+
+        self.writer = threading.Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
 
-    def get_current_file_name(self):
-        return self.current_file_name
+    def stream_folder(self, stream):
+        return self.folder if stream is None else self.folder + stream + "/"
+
+    def get_current_file_name(self, stream=None):
+        return self.get_file_name(days.today(), stream)
+
+    def get_file_name(self, day, stream=None):
+        # file of day of the given stream, of the stream of the calling thread if None
+        if stream is None:
+            stream = self.get_thread_stream()
+        return self.stream_folder(stream) + day + ".txt"
+
+    def set_thread_stream(self, stream):
+        """
+        Records of the calling thread go to logs/<stream>/ from now on, None for the main log.
+        """
+        if stream is not None and not os.path.isdir(self.stream_folder(stream)):
+            os.makedirs(self.stream_folder(stream))
+        self.thread_stream.name = stream
+
+    def get_thread_stream(self):
+        return getattr(self.thread_stream, "name", None)
 
     def set_new_file_name(self):
-        self.current_file_name = LOG_FOLDER + dt.datetime.now().strftime("%Y%m%d") + ".txt"
-
-    def info(self, string):
-        string = str(dt.datetime.now().strftime('%Y%m%d_%H%M%S')) + " INFO: " + str(string) + "\n"
-        print(string, end='')
-        with open(self.current_file_name, 'a+') as f:
-            f.write(string)
-
-    def warning(self, string):
-        string = str(dt.datetime.now().strftime('%Y%m%d_%H%M%S')) + " WARNING: " + str(string) + "\n"
-        print(string, end='')
-        with open(self.current_file_name, 'a+') as f:
-            f.write(string)
-
-    def error(self, string):
-        string = str(dt.datetime.now().strftime('%Y%m%d_%H%M%S')) + " ERROR: " + str(string) + "\n"
-        print(string, end='')
-        with open(self.current_file_name, 'a+') as f:
-            f.write(string)
+        pass  # kept for compatibility, the writer changes file with the day of each record
+
+    def set_level(self, level):
+        self.level = LEVELS[level]
+
+    def log(self, level, string, **fields):
+        if LEVELS[level] < self.level:
+            return
+        record = (time.time(), level, string, fields, self.get_thread_stream())
+        if self.closed:
+            with self.write_lock:
+                self.write_record(record)
+                self.flush_files()
+            return
+        try:
+            if self.queue_full_policy == "block" or LEVELS[level] >= LEVELS["ERROR"]:
+                self.records.put(record, timeout=PUT_TIMEOUT)
+            else:
+                self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, string, **fields):
+        self.log("DEBUG", string, **fields)
+
+    def info(self, string, **fields):
+        self.log("INFO", string, **fields)
+
+    def warning(self, string, **fields):
+        self.log("WARNING", string, **fields)
+
+    def error(self, string, **fields):
+        self.log("ERROR", string, **fields)
+
+    def format_stamp(self, timestamp):
+        # strftime only once per second
+        second = int(timestamp)
+        if second != self.stamp_second:
+            self.stamp_second = second
+            self.stamp = dt.datetime.fromtimestamp(second).strftime('%Y%m%d_%H%M%S')
+        return self.stamp
+
+    def write_line(self, timestamp, level, string, fields, stream):
+        stamp = self.format_stamp(timestamp)
+        line = stamp + " " + level + ": " + str(string)
+        if fields:
+            line += " " + " ".join(key + "=" + str(value) for key, value in fields.items())
+        line += "\n"
+
+        if self.echo:
+            print(line if stream is None else "[" + stream + "] " + line, end='')
+        f = self.files.get(stream)
+        if f is None:
+            f = self.files[stream] = DailyFile(self.stream_folder(stream), mode='a+')
+        f.write(line, timestamp)
+
+    def write_records(self):
+        while True:
+            try:
+                batch = [self.records.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < 1000:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            try:
+                for record in batch:
+                    if record is STOP:
+                        stop = True
+                    else:
+                        self.write_record(record)
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    self.write_record((time.time(), "WARNING", "Log queue full, dropped " + str(dropped) + " records",
+                                       {}, None))
+                self.flush_files()
+            finally:
+                for _ in batch:
+                    self.records.task_done()
+            if stop:
+                return
+
+    def write_record(self, record):
+        # a full disk or a failed rotation costs this record, not the writer thread
+        try:
+            self.write_line(*record)
+        except Exception as e:
+            print("Logger failed writing record " + repr(record[2]) + ": " + repr(e), file=sys.stderr)
+
+    def flush_files(self):
+        for f in self.files.values():
+            try:
+                f.flush()
+            except Exception as e:
+                print("Logger failed flushing: " + repr(e), file=sys.stderr)
+
+    def flush(self):
+        # blocks until every record queued so far is written
+        self.records.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.records.put(STOP)
+            self.writer.join()
+        with self.write_lock:
+            self.closed = True
+            for f in self.files.values():
+                f.close()
 
 
 log = Logger()
@@ -6,27 +6,63 @@ year: 2021
 import datetime as dt
 
 from geocom import SerialConnection, GeoCom, GON2RAD
+from async_geocom import PipelinedGeoCom
+from geocom_cache import CachedGeoCom
 from geocom_dicts import *
-from auto_measure_handler import HandlerAutoMeasurement, Aim
-from logger import log
+from auto_measure_handler import HandlerAutoMeasurement, MEASUREMENT_FOLDER
+from aim_table import Aim
+from setup_file import read_setup_file, write_setup_file, SetupFileError
+from instrumentation import metrics
+from adaptive import AdaptiveTimeouts
+from rotating_file import Compressor
+from logger import log, LOG_FOLDER
 
 # CONFIGURATIONS
-DEFAULT_MEASUREMENT_FILE = None  # or e.g. "setup_05122021_133612.txt"
+DEFAULT_MEASUREMENT_FILE = None  # or e.g. "setup_20211205_133612.csv", see setup_file.py for the format
 USB_PORT = "/dev/ttyUSB0"
+OPTIMIZE_AIM_ORDER = False  # reorder aims to minimise motor travel per set
+PIPELINED_GEOCOM = False  # queue independent GeoCOM requests back to back, matched by transaction id
+CACHE_SETTINGS = False  # do not send setter RPCs again whose value the instrument already confirmed
+ADAPTIVE_SCHEDULING = False  # learn timeouts from response times and poll the compensator instead of fixed waits
+OVERRUN_POLICY = "skip"  # "skip", "catch_up" or "shift" if a set is still running at the next epoch, see scheduler.py
+PRIORITY_INTERVAL = None  # e.g. 300 to measure priority aims every 5 min between the full sets
+ALERT_SINK = None  # e.g. "alerts.jsonl" or "tcp://127.0.0.1:9200" for deformation alerts, see deformation_alerts.py
+CAPTURE_TRACE = False  # record all serial traffic to traces/ for replaying it, see serial_trace.py
+METRICS_PORT = None  # e.g. 9108 to serve rpc and phase timings as JSON on http://127.0.0.1:9108/
+COMPRESS_CLOSED_DAYS = False  # gzip the text files of past days once uploaded, see rotating_file.py
 
 
 class Manager:
     def __init__(self):
         self.__port = USB_PORT  # first port on raspb
 
-        self.sercon = SerialConnection(self.__port)
-        self.geocom = GeoCom(self.sercon)
-
-        self.handler_auto_measure = HandlerAutoMeasurement(self.geocom)
-
-        self.handler_auto_measure.initialize()
-
-        self.__setup_file_path = "setup_" + dt.datetime.now().strftime("%Y%m%d_%H%M%S") + ".txt"
+        if METRICS_PORT is not None:
+            metrics.serve(METRICS_PORT)
+
+        capture_path = None
+        if CAPTURE_TRACE:
+            capture_path = "traces/" + dt.datetime.now().strftime("%Y%m%d_%H%M%S") + ".trace"
+        self.sercon = SerialConnection(self.__port, capture_path=capture_path)
+        if PIPELINED_GEOCOM:
+            self.geocom = PipelinedGeoCom(self.sercon)
+        else:
+            self.geocom = GeoCom(self.sercon)
+        if ADAPTIVE_SCHEDULING:
+            self.geocom.adaptive_timeouts = AdaptiveTimeouts()
+        if CACHE_SETTINGS:
+            self.geocom = CachedGeoCom(self.geocom)
+
+        self.handler_auto_measure = HandlerAutoMeasurement(self.geocom, adaptive=ADAPTIVE_SCHEDULING,
+                                                           alert_sink=ALERT_SINK)
+        if COMPRESS_CLOSED_DAYS:
+            Compressor([LOG_FOLDER], measurement_folders=[MEASUREMENT_FOLDER],
+                       uploaded=self.handler_auto_measure.uploader.is_uploaded).start()
+
+        if not self.handler_auto_measure.initialize():
+            self.handler_auto_measure.close()
+            exit("Initializing failed, stopping program")
+
+        self.__setup_file_path = "setup_" + dt.datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv"
 
         self.set_amount = None
         self.measure_interval = None
@@ -34,19 +70,18 @@ class Manager:
     def run(self):
         self.get_targets_and_configuration()
         self.add_second_circle()
+        if OPTIMIZE_AIM_ORDER:
+            self.handler_auto_measure.optimize_aim_order()
         self.auto_measure()
 
     def read_setup_file(self, filename):
-        with open(filename, 'r') as f:
-            for line in f.readlines():
-                if not line.startswith('#'):
-                    splitted_line = line.split()
-                    if splitted_line:
-                        self.handler_auto_measure.aims.append(
-                            Aim(splitted_line[0], float(splitted_line[1]), float(splitted_line[2]),
-                                int(splitted_line[3]), int(splitted_line[4])))
+        try:
+            self.handler_auto_measure.aims += read_setup_file(filename)
+        except SetupFileError as e:
+            exit("Invalid setup file:\n" + str(e))
 
     def get_targets_and_configuration(self):
+        entered_aims = []
         while True:
             if DEFAULT_MEASUREMENT_FILE is not None:
                 path_to_setup_file = DEFAULT_MEASUREMENT_FILE
@@ -69,7 +104,7 @@ class Manager:
                 rsp = self.geocom.TMC_GetAngle1(TMC_INCLINE_PRG["TMC_AUTO_INC"])
                 if not rsp:
                     exit("Cannot read angles, closing program, check cables and everything")
-                hz, v = float(rsp[1])/GON2RAD, float(rsp[2])/GON2RAD
+                hz, v = rsp.hz/GON2RAD, rsp.v/GON2RAD
 
                 log.info("Set hz " + str(round(hz, 4)) + "g, set v " + str(round(v, 4)) + "g")
 
@@ -98,10 +133,12 @@ class Manager:
                 else:
                     new_prism_type = -1  # not defined
 
-                self.handler_auto_measure.aims.append(Aim(new_target_name, float(hz), float(v), int(new_target_type), int(new_prism_type)))
+                entered_aims.append(Aim(new_target_name, float(hz), float(v), int(new_target_type), int(new_prism_type)))
 
-            with open(self.__setup_file_path, 'a+') as f:
-                f.write(new_target_name + ' ' + str(hz) + ' ' + str(v)  + ' ' + str(new_target_type)  + ' ' + str(new_prism_type) + "\n")
+        if entered_aims:
+            self.handler_auto_measure.aims += entered_aims
+            write_setup_file(self.__setup_file_path, entered_aims)
+            log.info("Aims saved to " + self.__setup_file_path)
 
         set_amount = input("Enter amount of sets to measure or press enter for infinite amount of sets\n")
         if set_amount:
@@ -115,14 +152,20 @@ class Manager:
         self.handler_auto_measure.add_second_circle()
 
     def auto_measure(self):
-        self.handler_auto_measure.run(interval=self.measure_interval, set_amount=self.set_amount)
-
-
-program = Manager()
-
-try:
-    program.run()
-except KeyboardInterrupt:
-    program.handler_auto_measure.go_home()
-    program.handler_auto_measure.upload_measurement_files_and_log()
-    print("Closing program, goodbye from Marco and Manuel ;-)")
+        try:
+            if not self.handler_auto_measure.run(interval=self.measure_interval, set_amount=self.set_amount,
+                                                 overrun_policy=OVERRUN_POLICY, priority_interval=PRIORITY_INTERVAL):
+                log.info("Stopping program, the set goes on after the next start")
+        finally:
+            self.handler_auto_measure.close()  # uploads the files of the last set before the uploader stops
+
+
+if __name__ == "__main__":
+    program = Manager()
+
+    try:
+        program.run()
+    except KeyboardInterrupt:
+        program.handler_auto_measure.go_home()
+        program.handler_auto_measure.close()
+        print("Closing program, goodbye from Marco and Manuel ;-)")
@@ -0,0 +1,230 @@
+"""
+Columnar access to the measurement archive. Every daily file is parsed once into a structured NumPy array
+(measurements/.index/YYYYMMDD.npy, memory mapped on read) and an index of aim names and time ranges per day
+(measurements/.index/index.json). update() only parses rows appended since the last run.
+
+The index is written after the row files and counts the rows of every day. Rows saved after the last index write,
+by an update that did not get to write it, are beyond that count and are left out until they are parsed again.
+
+    history = MeasurementHistory()
+    history.update()
+    series = history.query("P1", start=dt.datetime(2021, 4, 1))
+    series["slope_dist"]
+
+Angles and inclines are returned in gon, slope distance in m, temperature in °C and time in seconds since epoch,
+values the instrument did not deliver are NaN.
+"""
+
+import datetime as dt
+import json
+import os
+
+import numpy as np
+
+from geocom import GON2RAD
+from measurement_store import FILE_MAGIC, read_frames, MeasurementRecord, NULL_HZ, NULL_HZ_RAW, NULL_V, \
+    NULL_V_RAW, NULL_SLOPE_DIST, NULL_CROSS_INCLINE, NULL_LENGTH_INCLINE, NULL_INTERNAL_TEMPERATURE
+from rotating_file import atomic_write
+
+
+INDEX_FOLDER_NAME = ".index"
+INDEX_FILE_NAME = "index.json"
+
+VALUE_COLUMNS = ("hz", "hz_raw", "v", "v_raw", "slope_dist", "cross_incline", "length_incline",
+                 "internal_temperature")
+ROW_DTYPE = np.dtype([("time", "f8"), ("aim", "i4")] + [(column, "f8") for column in VALUE_COLUMNS])
+
+# null bit and factor from stored unit (rad) to returned unit (gon) of the binary record fields
+BINARY_COLUMNS = (
+    ("hz", NULL_HZ, 1/GON2RAD),
+    ("hz_raw", NULL_HZ_RAW, 1/GON2RAD),
+    ("v", NULL_V, 1/GON2RAD),
+    ("v_raw", NULL_V_RAW, 1/GON2RAD),
+    ("slope_dist", NULL_SLOPE_DIST, 1.0),
+    ("cross_incline", NULL_CROSS_INCLINE, 1/GON2RAD),
+    ("length_incline", NULL_LENGTH_INCLINE, 1/GON2RAD),
+    ("internal_temperature", NULL_INTERNAL_TEMPERATURE, 1.0),
+)
+
+
+def to_timestamp(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return value.timestamp()
+
+
+class MeasurementHistory:
+    def __init__(self, folder="measurements/"):
+        self.folder = folder
+        self.index_folder = os.path.join(folder, INDEX_FOLDER_NAME)
+        self.index_path = os.path.join(self.index_folder, INDEX_FILE_NAME)
+
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}  # day -> {"source", "size", "rows", "t_min", "t_max", "aims"}
+
+    def day_sources(self):
+        # binary day files carry the raw values, text files are only read for days without one
+        sources = {}
+        for name in sorted(os.listdir(self.folder)):
+            day, extension = os.path.splitext(name)
+            if len(day) != 8 or not day.isdigit():
+                continue
+            if extension == ".bin" or (extension == ".txt" and day not in sources):
+                sources[day] = name
+        return sources
+
+    def rows_path(self, day):
+        return os.path.join(self.index_folder, day + ".npy")
+
+    def update(self):
+        """
+        Indexes new daily files and rows appended to known ones.
+        :return: amount of rows added
+        """
+        if not os.path.isdir(self.index_folder):
+            os.mkdir(self.index_folder)
+
+        added = 0
+        for day, source in self.day_sources().items():
+            entry = self.index.get(day)
+            size = os.path.getsize(os.path.join(self.folder, source))
+            if entry is not None and entry["source"] == source and entry["size"] == size:
+                continue
+            if entry is None or entry["source"] != source or entry["size"] > size:
+                entry = {"source": source, "size": 0, "rows": 0, "t_min": None, "t_max": None, "aims": []}
+
+            added += self.index_day(day, entry)
+            self.index[day] = entry
+
+        with atomic_write(self.index_path) as f:
+            json.dump(self.index, f)
+        return added
+
+    def index_day(self, day, entry):
+        path = os.path.join(self.folder, entry["source"])
+        aims = {name: code for code, name in enumerate(entry["aims"])}
+        if entry["source"].endswith(".bin"):
+            new_rows, consumed = self.parse_binary(path, entry["size"], aims)
+        else:
+            new_rows, consumed = self.parse_text(path, entry["size"], aims)
+
+        if entry["rows"]:
+            rows = np.concatenate((np.load(self.rows_path(day))[:entry["rows"]], new_rows))
+        else:
+            rows = new_rows
+        with atomic_write(self.rows_path(day), 'wb') as f:
+            np.save(f, rows)
+
+        entry["size"] = consumed
+        entry["rows"] = len(rows)
+        entry["aims"] = sorted(aims, key=aims.get)
+        if len(rows):
+            entry["t_min"], entry["t_max"] = float(rows["time"].min()), float(rows["time"].max())
+        return len(new_rows)
+
+    @staticmethod
+    def parse_binary(path, offset, aims):
+        records = []
+        consumed = offset
+        with open(path, 'rb') as f:
+            if offset == 0:
+                if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                    return np.zeros(0, dtype=ROW_DTYPE), 0
+                consumed = len(FILE_MAGIC)
+            else:
+                f.seek(offset)
+            for consumed, payload in read_frames(f):
+                records.append(MeasurementRecord.unpack(payload))
+
+        rows = np.zeros(len(records), dtype=ROW_DTYPE)
+        rows["time"] = [record.timestamp for record in records]
+        rows["aim"] = [aims.setdefault(record.aim_name, len(aims)) for record in records]
+        null_masks = np.array([record.null_mask for record in records], dtype=np.int64)
+        for column, null_bit, factor in BINARY_COLUMNS:
+            values = np.array([getattr(record, column) for record in records], dtype=np.float64)*factor
+            values[(null_masks & null_bit) != 0] = np.nan
+            rows[column] = values
+        return rows, consumed
+
+    @staticmethod
+    def parse_text(path, offset, aims):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1  # a line still being written is picked up by the next update
+        lines = [line.split() for line in data[:complete].decode("UTF-8").splitlines()]
+        lines = [fields for fields in lines if len(fields) == 2 + len(VALUE_COLUMNS)]
+
+        timestamps = {}
+        rows = np.zeros(len(lines), dtype=ROW_DTYPE)
+        for i, fields in enumerate(lines):
+            if fields[0] not in timestamps:
+                timestamps[fields[0]] = dt.datetime.strptime(fields[0], "%Y%m%d_%H%M%S").timestamp()
+            rows["time"][i] = timestamps[fields[0]]
+            rows["aim"][i] = aims.setdefault(fields[1], len(aims))
+        if lines:
+            # float() understands both "NaN" and the "Nan" of older files
+            values = np.array([fields[2:] for fields in lines], dtype=np.float64)
+            for i, column in enumerate(VALUE_COLUMNS):
+                rows[column] = values[:, i]
+        return rows, offset + complete
+
+    def aims(self):
+        return sorted({name for entry in self.index.values() for name in entry["aims"]})
+
+    def load(self, start=None, end=None):
+        """
+        All rows in [start, end] sorted by time, for batch processing of whole sets.
+        :return: (structured array of ROW_DTYPE, list of aim names indexed by the aim column)
+        """
+        start, end = to_timestamp(start), to_timestamp(end)
+        names = self.aims()
+        codes = {name: code for code, name in enumerate(names)}
+        parts = []
+        for day in sorted(self.index):
+            entry = self.index[day]
+            if not entry["rows"]:
+                continue
+            if (start is not None and entry["t_max"] < start) or (end is not None and entry["t_min"] > end):
+                continue
+
+            rows = np.array(np.load(self.rows_path(day), mmap_mode='r')[:entry["rows"]])
+            if start is not None:
+                rows = rows[rows["time"] >= start]
+            if end is not None:
+                rows = rows[rows["time"] <= end]
+            rows["aim"] = np.array([codes[name] for name in entry["aims"]], dtype=np.int32)[rows["aim"]]
+            parts.append(rows)
+
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=ROW_DTYPE)
+        return rows[np.argsort(rows["time"], kind="stable")], names
+
+    def query(self, aim, start=None, end=None, columns=("time", ) + VALUE_COLUMNS):
+        """
+        :param start: datetime or seconds since epoch, None for the beginning of the archive
+        :param end: datetime or seconds since epoch, None for the end of the archive
+        :return: dict column -> np.ndarray of all rows of aim in [start, end] sorted by time
+        """
+        start, end = to_timestamp(start), to_timestamp(end)
+        parts = []
+        for day in sorted(self.index):
+            entry = self.index[day]
+            if not entry["rows"] or aim not in entry["aims"]:
+                continue
+            if (start is not None and entry["t_max"] < start) or (end is not None and entry["t_min"] > end):
+                continue
+
+            rows = np.load(self.rows_path(day), mmap_mode='r')[:entry["rows"]]
+            selected = rows["aim"] == entry["aims"].index(aim)
+            if start is not None:
+                selected &= rows["time"] >= start
+            if end is not None:
+                selected &= rows["time"] <= end
+            parts.append(rows[selected])
+
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=ROW_DTYPE)
+        rows = rows[np.argsort(rows["time"], kind="stable")]
+        return {column: np.ascontiguousarray(rows[column]) for column in columns}
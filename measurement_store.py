@@ -0,0 +1,288 @@
+"""
+Typed measurement records in one binary file per day (YYYYMMDD.bin) next to the text export (YYYYMMDD.txt).
+
+Records are appended to a write-ahead journal as they are measured and moved into the day files at set
+boundaries with flush and fsync. After a crash the journal is replayed on the next start, so no measured aim is
+lost. Every record is framed as length, crc32, payload so torn writes are detected and cut off.
+"""
+
+import datetime as dt
+import os
+import struct
+import zlib
+
+from geocom import GON2RAD
+from rotating_file import days
+from logger import log
+
+
+FILE_MAGIC = b"TM50MS01"
+JOURNAL_FILE_NAME = "journal.bin"
+FRAME = struct.Struct("<II")  # payload length, crc32 of payload
+# seq, timestamp, null mask, hz, hz_raw, v, v_raw, slope_dist, cross_incline, length_incline, internal_temperature,
+# rc_full_measure, rc_angle, rc_temperature, length of the utf-8 aim name following the fixed part
+RECORD = struct.Struct("<QdH8d3iH")
+
+# bits of MeasurementRecord.null_mask, angles and inclines in rad, slope_dist in m, temperature in °C
+NULL_HZ = 1 << 0
+NULL_HZ_RAW = 1 << 1
+NULL_V = 1 << 2
+NULL_V_RAW = 1 << 3
+NULL_SLOPE_DIST = 1 << 4
+NULL_CROSS_INCLINE = 1 << 5
+NULL_LENGTH_INCLINE = 1 << 6
+NULL_INTERNAL_TEMPERATURE = 1 << 7
+NULL_ANGLES = NULL_HZ | NULL_HZ_RAW | NULL_V | NULL_V_RAW
+
+README = ("One measurement file for each day is created, YYYYMMDD.bin holds the typed records (see "
+          "measurement_store.py) and YYYYMMDD.txt the text export. The text format is given by\n"
+          "str_datetime str_aim_name str_hz_angle[g] str_hz_angle_raw[g] str_v_angle[g] str_v_angle_raw[g]"
+          " str_slope_dist[m] str_cross_incline[g] str_length_incline[g] str_internal_temperature[°C]\n"
+          "with NaN for values the instrument did not deliver.\n")
+
+
+class MeasurementRecord:
+    def __init__(self, timestamp, aim_name, hz, hz_raw, v, v_raw, slope_dist, cross_incline, length_incline,
+                 internal_temperature, rc_full_measure=0, rc_angle=0, rc_temperature=0, null_mask=None, seq=0):
+        """
+        Raw instrument values are kept even where the return code marks them null.
+        :param timestamp: seconds since epoch
+        :param null_mask: derived from the return codes if None
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.aim_name = aim_name
+        self.hz = hz
+        self.hz_raw = hz_raw
+        self.v = v
+        self.v_raw = v_raw
+        self.slope_dist = slope_dist
+        self.cross_incline = cross_incline
+        self.length_incline = length_incline
+        self.internal_temperature = internal_temperature
+        self.rc_full_measure = rc_full_measure
+        self.rc_angle = rc_angle
+        self.rc_temperature = rc_temperature
+
+        if null_mask is None:
+            null_mask = 0
+            if rc_full_measure != 0:
+                null_mask |= NULL_SLOPE_DIST
+            if rc_angle != 0:
+                null_mask |= NULL_ANGLES
+            if rc_temperature != 0:
+                null_mask |= NULL_INTERNAL_TEMPERATURE
+        self.null_mask = null_mask
+
+    def day(self):
+        return days.day_of(self.timestamp)
+
+    def pack(self):
+        name = self.aim_name.encode("UTF-8")
+        return RECORD.pack(self.seq, self.timestamp, self.null_mask, self.hz, self.hz_raw, self.v, self.v_raw,
+                           self.slope_dist, self.cross_incline, self.length_incline, self.internal_temperature,
+                           self.rc_full_measure, self.rc_angle, self.rc_temperature, len(name)) + name
+
+    @classmethod
+    def unpack(cls, payload):
+        (seq, timestamp, null_mask, hz, hz_raw, v, v_raw, slope_dist, cross_incline, length_incline,
+         internal_temperature, rc_full_measure, rc_angle, rc_temperature, name_length) = RECORD.unpack_from(payload)
+        aim_name = payload[RECORD.size:RECORD.size + name_length].decode("UTF-8")
+        return cls(timestamp, aim_name, hz, hz_raw, v, v_raw, slope_dist, cross_incline, length_incline,
+                   internal_temperature, rc_full_measure, rc_angle, rc_temperature, null_mask=null_mask, seq=seq)
+
+    def to_text_line(self, rt=5):
+        def field(value, null_bit, scale=1.0):
+            return "NaN" if self.null_mask & null_bit else str(round(value/scale, rt))
+
+        return ' '.join((dt.datetime.fromtimestamp(self.timestamp).strftime('%Y%m%d_%H%M%S'), self.aim_name,
+                         field(self.hz, NULL_HZ, GON2RAD), field(self.hz_raw, NULL_HZ_RAW, GON2RAD),
+                         field(self.v, NULL_V, GON2RAD), field(self.v_raw, NULL_V_RAW, GON2RAD),
+                         field(self.slope_dist, NULL_SLOPE_DIST),
+                         field(self.cross_incline, NULL_CROSS_INCLINE, GON2RAD),
+                         field(self.length_incline, NULL_LENGTH_INCLINE, GON2RAD),
+                         field(self.internal_temperature, NULL_INTERNAL_TEMPERATURE))) + "\n"
+
+
+def frame(payload):
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frames(f):
+    """
+    Yields (offset after the frame, payload) of every intact frame, stops at the first torn or corrupt one.
+    """
+    offset = f.tell()
+    while True:
+        header = f.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return
+        length, crc = FRAME.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset += FRAME.size + length
+        yield offset, payload
+
+
+def read_records(path):
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            log.error("Not a measurement file " + path)
+            return
+        for _, payload in read_frames(f):
+            yield MeasurementRecord.unpack(payload)
+
+
+def export_text(bin_path, txt_path):
+    with open(txt_path, 'w') as f:
+        for record in read_records(bin_path):
+            f.write(record.to_text_line())
+
+
+class MeasurementStore:
+    def __init__(self, folder, text_export=True):
+        """
+        :param text_export: also append every committed record to the YYYYMMDD.txt export
+        """
+        self.folder = folder
+        self.text_export = text_export
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+            with open(os.path.join(folder, "README.txt"), 'w') as f:
+                f.write(README)
+
+        self.day = None
+        self.bin_file = None
+        self.txt_file = None
+        self.seq = self.last_seq_in_archive()
+
+        self.journal_path = os.path.join(folder, JOURNAL_FILE_NAME)
+        self.recover()
+        self.journal = open(self.journal_path, 'ab')
+        self.uncommitted = []
+
+    def bin_path(self, day):
+        return os.path.join(self.folder, day + ".bin")
+
+    def text_path(self, day):
+        return os.path.join(self.folder, day + ".txt")
+
+    def open_day(self, day):
+        # one handle per day, kept open until the day changes
+        if day == self.day:
+            return
+        self.close_day()
+
+        path = self.bin_path(day)
+        valid_size = self.valid_size(path)
+        if not valid_size and os.path.isfile(path):
+            log.error("Moving unreadable measurement file " + path + " aside")
+            os.replace(path, path + ".corrupt")
+        self.bin_file = open(path, 'r+b' if valid_size else 'w+b')
+        if not valid_size:
+            self.bin_file.write(FILE_MAGIC)
+        else:
+            self.bin_file.truncate(valid_size)  # cut off a torn record of a crash
+            self.bin_file.seek(valid_size)
+        if self.text_export:
+            self.txt_file = open(self.text_path(day), 'a')
+        self.day = day
+
+    def close_day(self):
+        for f in (self.bin_file, self.txt_file):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+        self.day, self.bin_file, self.txt_file = None, None, None
+
+    @staticmethod
+    def valid_size(path):
+        # size up to the end of the last intact record, 0 if there is no valid file
+        if not os.path.isfile(path):
+            return 0
+        with open(path, 'rb') as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                return 0
+            valid_size = len(FILE_MAGIC)
+            for valid_size, _ in read_frames(f):
+                pass
+        return valid_size
+
+    def last_seq_in_archive(self):
+        days = sorted(name for name in os.listdir(self.folder) if name.endswith(".bin") and name[:8].isdigit())
+        if not days:
+            return 0
+        return self.last_seq(os.path.join(self.folder, days[-1]))
+
+    @staticmethod
+    def last_seq(path):
+        seq = 0
+        if os.path.isfile(path):
+            for record in read_records(path):
+                seq = record.seq
+        return seq
+
+    def append(self, record):
+        """
+        Journals the record, it reaches the day files with the next commit_set().
+        """
+        self.seq += 1
+        record.seq = self.seq
+        self.journal.write(frame(record.pack()))
+        self.journal.flush()  # survives a crash of the process, fsync follows at the set boundary
+        self.uncommitted.append(record)
+
+    def commit_set(self):
+        if not self.uncommitted:
+            return
+        self.write_to_day_files(self.uncommitted)
+        self.uncommitted = []
+        self.journal.truncate(0)
+        self.journal.seek(0)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def write_to_day_files(self, records):
+        # binary first, it is the source of truth, the text export can be regenerated with export_text
+        for record in records:
+            self.open_day(record.day())
+            self.bin_file.write(frame(record.pack()))
+            if self.txt_file is not None:
+                self.txt_file.write(record.to_text_line())
+        for f in (self.bin_file, self.txt_file):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def recover(self):
+        if not os.path.isfile(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            records = [MeasurementRecord.unpack(payload) for _, payload in read_frames(f)]
+
+        # records of the journal that already reached their day file before the crash are skipped
+        last_seqs = {}
+        missing = []
+        for record in records:
+            day = record.day()
+            if day not in last_seqs:
+                last_seqs[day] = self.last_seq(self.bin_path(day))
+            if record.seq > last_seqs[day]:
+                missing.append(record)
+            self.seq = max(self.seq, record.seq)
+
+        if missing:
+            log.warning("Recovering " + str(len(missing)) + " measurements from journal")
+            self.write_to_day_files(missing)
+        self.close_day()
+
+        with open(self.journal_path, 'wb') as f:
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.commit_set()
+        self.close_day()
+        self.journal.close()
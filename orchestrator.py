@@ -0,0 +1,257 @@
+"""
+Runs several TM50s of one monitoring site from one process. The instruments are listed in a site configuration:
+
+    {
+        "instruments": [
+            {"name": "north", "port": "/dev/ttyUSB0", "setup_file": "setup_north.txt", "interval": 900},
+            {"name": "south", "port": "/dev/ttyUSB1", "setup_file": "setup_south.txt", "interval": 900,
+             "set_amount": null, "overrun_policy": "skip", "priority_interval": 300,
+             "second_circle": true, "optimize_aim_order": false, "adaptive": false, "pipelined": false,
+             "cache_settings": true, "alert_sink": "measurements/south/alerts.jsonl"}
+        ],
+        "health_file": "site_health.json",
+        "health_interval": 60,
+        "restart_delay": 60,
+        "compress_closed_days": false
+    }
+
+Every instrument gets one thread with its own SerialConnection, GeoCom and HandlerAutoMeasurement, so retries and
+initializing of one instrument do not hold up the others. Measurements go to measurements/<name>/, the log to
+logs/<name>/ and the metrics of every set to metrics/<name>/. The supervisor owns the one UploadWorker all
+instruments share, restarts measurement threads that died and writes the state of all instruments to the health
+file. With compress_closed_days the text files of past days are gzipped once uploaded, see rotating_file.py.
+
+    python orchestrator.py site.json
+"""
+
+import json
+import sys
+import threading
+import time
+
+from geocom import SerialConnection, GeoCom
+from async_geocom import PipelinedGeoCom
+from geocom_cache import CachedGeoCom
+from auto_measure_handler import HandlerAutoMeasurement, MEASUREMENT_FOLDER
+from setup_file import read_setup_file
+from adaptive import AdaptiveTimeouts
+from instrumentation import Metrics, METRICS_FOLDER
+from uploader import UploadWorker, REMOTE_LOG_FOLDER
+from rotating_file import Compressor, atomic_write
+from logger import log, LOG_FOLDER
+
+
+HEALTH_FILE = "site_health.json"
+HEALTH_INTERVAL = 60  # s between two health reports
+RESTART_DELAY = 60  # s before a died measurement thread is started again
+INSTRUMENT_DEFAULTS = {
+    "interval": None,
+    "set_amount": None,
+    "overrun_policy": "skip",
+    "priority_interval": None,
+    "second_circle": True,
+    "optimize_aim_order": False,
+    "adaptive": False,
+    "pipelined": False,
+    "cache_settings": False,
+    "alert_sink": None,
+    "capture_trace": False,
+}
+
+
+def load_site_config(path):
+    with open(path, 'r') as f:
+        config = json.load(f)
+
+    names = set()
+    instruments = []
+    for i, instrument in enumerate(config.get("instruments", [])):
+        for key in ("name", "port", "setup_file"):
+            if key not in instrument:
+                raise ValueError(path + ": instrument " + str(i) + " has no " + key)
+        if instrument["name"] in names:
+            raise ValueError(path + ": instrument name " + instrument["name"] + " used twice")
+        names.add(instrument["name"])
+        read_setup_file(instrument["setup_file"])  # raises SetupFileError before any instrument is started
+        instruments.append(dict(INSTRUMENT_DEFAULTS, **instrument))
+    if not instruments:
+        raise ValueError(path + ": no instruments configured")
+
+    config["instruments"] = instruments
+    return config
+
+
+class InstrumentRunner:
+    """
+    Measurement loop of one instrument in its own thread. The serial connection is kept over restarts, handler and
+    geocom are created anew with every start.
+    """
+    def __init__(self, config, uploader):
+        self.config = config
+        self.name = config["name"]
+        self.uploader = uploader
+
+        self.sercon = None
+        self.handler = None
+        self.thread = None
+        self.state = "created"  # created, initializing, measuring, finished, failed
+        self.last_error = None
+        self.starts = 0
+        self.stopped_at = None
+
+    def connect(self):
+        capture_path = None
+        if self.config["capture_trace"]:
+            capture_path = "traces/" + self.name + "_" + time.strftime("%Y%m%d_%H%M%S") + ".trace"
+        # metrics of its own, the set summaries go to metrics/<name>/
+        return SerialConnection(self.config["port"], capture_path=capture_path,
+                                metrics=Metrics(METRICS_FOLDER + self.name + "/"))
+
+    def start(self):
+        self.starts += 1
+        self.thread = threading.Thread(target=self.measure, name=self.name, daemon=True)
+        self.thread.start()
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def measure(self):
+        log.set_thread_stream(self.name)
+        try:
+            self.state = "initializing"
+            if self.sercon is None:
+                self.sercon = self.connect()
+            if self.config["pipelined"]:
+                geocom = PipelinedGeoCom(self.sercon)
+            else:
+                geocom = GeoCom(self.sercon)
+            if self.config["adaptive"]:
+                geocom.adaptive_timeouts = AdaptiveTimeouts()
+            if self.config["cache_settings"]:
+                geocom = CachedGeoCom(geocom)
+
+            self.handler = HandlerAutoMeasurement(geocom, adaptive=self.config["adaptive"], uploader=self.uploader,
+                                                  name=self.name, alert_sink=self.config["alert_sink"])
+            if not self.handler.initialize():
+                raise RuntimeError("initializing failed")
+            self.handler.aims = read_setup_file(self.config["setup_file"])
+            if self.config["second_circle"]:
+                self.handler.add_second_circle()
+            if self.config["optimize_aim_order"]:
+                self.handler.optimize_aim_order()
+
+            self.state = "measuring"
+            if not self.handler.run(interval=self.config["interval"], set_amount=self.config["set_amount"],
+                                    overrun_policy=self.config["overrun_policy"],
+                                    priority_interval=self.config["priority_interval"]):
+                raise RuntimeError("initializing failed")  # the set goes on after the restart
+            self.state = "finished"
+        except Exception as e:
+            self.state = "failed"
+            self.last_error = repr(e)
+            log.error("Measurement of " + self.name + " stopped: " + repr(e))
+        finally:
+            self.stopped_at = time.time()
+            if self.handler is not None:
+                # saves the deformation baselines, stops the alert sink and keeps the measurements of an unfinished set
+                self.handler.close()
+                if hasattr(self.handler.geocom, "close"):
+                    self.handler.geocom.close()  # PipelinedGeoCom
+
+    def health(self):
+        handler = self.handler
+        return {
+            "name": self.name,
+            "port": self.config["port"],
+            "state": self.state,
+            "alive": self.is_alive(),
+            "starts": self.starts,
+            "last_error": self.last_error,
+            "sets_completed": handler.sets_completed if handler else 0,
+            "last_set_start": handler.last_start_time if handler else None,
+            "last_set_end": handler.last_set_end_time if handler else None,
+            "serial": {
+                "bytes_sent": self.sercon.bytes_sent,
+                "bytes_received": self.sercon.bytes_received,
+                "timeouts": self.sercon.timeouts,
+            } if self.sercon else None,
+        }
+
+
+class SiteOrchestrator:
+    def __init__(self, config, uploader=None):
+        """
+        :param config: site configuration as returned by load_site_config
+        :param uploader: UploadWorker shared by all instruments, a new one is started if None
+        """
+        self.config = config
+        self.health_file = config.get("health_file", HEALTH_FILE)
+        self.health_interval = config.get("health_interval", HEALTH_INTERVAL)
+        self.restart_delay = config.get("restart_delay", RESTART_DELAY)
+
+        if uploader is None:
+            uploader = UploadWorker()
+            uploader.start()
+        self.uploader = uploader
+        self.compressor = None
+        if config.get("compress_closed_days", False):
+            self.compressor = Compressor([LOG_FOLDER], measurement_folders=[MEASUREMENT_FOLDER],
+                                         uploaded=uploader.is_uploaded)
+            self.compressor.start()
+        self.runners = [InstrumentRunner(instrument, uploader) for instrument in config["instruments"]]
+        self.started = None
+
+    def run(self):
+        """
+        Supervises the instruments until all finished their sets.
+        """
+        self.started = time.time()
+        for runner in self.runners:
+            log.info("Starting instrument " + runner.name + " on " + runner.config["port"])
+            runner.start()
+
+        while True:
+            for runner in self.runners:
+                if runner.state == "failed" and not runner.is_alive() \
+                        and time.time() - runner.stopped_at >= self.restart_delay:
+                    log.warning("Restarting instrument " + runner.name + " after " + str(runner.last_error))
+                    runner.state = "created"
+                    runner.start()
+            self.write_health()
+
+            if all(runner.state == "finished" for runner in self.runners):
+                log.info("All instruments finished their sets")
+                break
+            time.sleep(min(self.health_interval, self.restart_delay))
+
+    def health(self):
+        return {
+            "time": time.time(),
+            "started": self.started,
+            "upload_queue": len(self.uploader.pending),
+            "instruments": [runner.health() for runner in self.runners],
+        }
+
+    def write_health(self):
+        # readers never see half a report
+        with atomic_write(self.health_file) as f:
+            json.dump(self.health(), f, indent=2)
+
+    def close(self):
+        for runner in self.runners:
+            if runner.handler is not None:
+                runner.handler.close()
+        self.uploader.enqueue(log.get_current_file_name(), REMOTE_LOG_FOLDER)
+        self.uploader.stop(timeout=60)
+        if self.compressor is not None:
+            self.compressor.stop()
+
+
+if __name__ == "__main__":
+    orchestrator = SiteOrchestrator(load_site_config(sys.argv[1] if len(sys.argv) > 1 else "site.json"))
+    try:
+        orchestrator.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        orchestrator.close()
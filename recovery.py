@@ -0,0 +1,141 @@
+"""
+What to do after a failed step of an aim, and the progress of the running set.
+
+classify() maps a GeoCOM reply to a recovery action. A busy or timed out instrument is asked again right away, a
+target that was not found or a failed distance measurement are tried again at the end of the set, and a reply that
+never arrived or an instrument that lost its settings or hardware needs initializing.
+
+SetCheckpoint keeps which aims of the running set are measured in a small JSON file next to the measurements, with
+whether it is a full set and how many full sets were completed before it. After a restart of the process the set
+continues as the same kind of set with the aims still missing.
+"""
+
+import json
+import os
+import time
+
+from geocom_dicts import *
+from measurement_store import read_records
+from logger import log
+from rotating_file import atomic_write
+
+
+RETRY_NOW = "retry_now"
+RETRY_LATER = "retry_later"
+REINITIALIZE = "reinitialize"
+
+ACCEPTED_CODES = {GRC["GRC_OK"], GRC["GRC_TMC_NO_FULL_CORRECTION"], GRC["GRC_TMC_ACCURACY_GUARANTEE"]}
+RETRY_NOW_CODES = {GRC["GRC_TIME_OUT"], GRC["GRC_ABORT"], GRC["GRC_SYSBUSY"], GRC["GRC_TMC_BUSY"],
+                   GRC["GRC_AUT_TIMEOUT"]}
+REINITIALIZE_CODES = {GRC["GRC_FATAL"], GRC["GRC_NOTINIT"], GRC["GRC_SHUT_DOWN"], GRC["GRC_HWFAILURE"],
+                      GRC["GRC_AUT_MOTOR_ERROR"], GRC["GRC_AUT_NOT_ENABLED"], GRC["GRC_TMC_DIST_PPM"]}
+
+CHECKPOINT_FILE_NAME = "set_checkpoint.json"
+
+
+def classify(rsp):
+    """
+    :param rsp: reply of a GeoCom method, False if no valid reply arrived
+    :return: None if the step succeeded, else RETRY_NOW, RETRY_LATER or REINITIALIZE
+    """
+    if not rsp:
+        return REINITIALIZE
+    rc = rsp.rc
+    if rc in ACCEPTED_CODES:
+        return None
+    if rc in RETRY_NOW_CODES:
+        return RETRY_NOW
+    if rc in REINITIALIZE_CODES:
+        return REINITIALIZE
+    return RETRY_LATER
+
+
+def aim_keys(aims):
+    # identifies the aims of a set, a changed setup does not resume an old set
+    return [list(key) for key in zip(aims.names_in_order(), aims.hz.tolist(), aims.v.tolist())]
+
+
+class SetCheckpoint:
+    def __init__(self, folder, max_age):
+        """
+        :param max_age: seconds after the start of a set it is not resumed anymore
+        """
+        self.path = os.path.join(folder, CHECKPOINT_FILE_NAME)
+        self.max_age = max_age
+        self.state = None
+
+    def start(self, aims, full_set, sets_completed=0):
+        self.state = {
+            "started": time.time(),
+            "full_set": full_set,
+            "sets_completed": sets_completed,  # selects the aims due by their every
+            "aims": aim_keys(aims),
+            "done": {},  # aim index -> [day, seq] of its record
+        }
+        self.save()
+
+    def load(self):
+        """
+        :return: the state in the checkpoint file, None if there is none or it cannot be resumed anymore
+        """
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except ValueError:
+            log.warning("Set checkpoint unreadable, starting a new set")
+            return None
+        if time.time() - state["started"] > self.max_age:
+            log.info("Checkpointed set too old, starting a new set")
+            return None
+        return state
+
+    def interrupted(self):
+        """
+        Removes a checkpoint that cannot be resumed.
+        :return: (full_set, sets_completed) of the set interrupted by a restart, None if there is none to resume
+        """
+        state = self.load()
+        if state is None:
+            self.clear()
+            return None
+        return state["full_set"], state.get("sets_completed", 0)
+
+    def resume(self, aims, full_set):
+        """
+        :return: the records of the aims measured before the restart, None if there is no set to resume
+        """
+        state = self.load()
+        if state is None:
+            return None
+        if state["full_set"] != full_set or state["aims"] != aim_keys(aims):
+            log.info("Aims changed since the checkpoint, starting a new set")
+            return None
+
+        wanted = {}  # day -> seqs
+        for day, seq in state["done"].values():
+            wanted.setdefault(day, set()).add(seq)
+        records = []
+        for day, seqs in wanted.items():
+            path = os.path.join(os.path.dirname(self.path), day + ".bin")
+            if os.path.isfile(path):
+                records += [record for record in read_records(path) if record.seq in seqs]
+        self.state = state
+        return records
+
+    def done(self):
+        return {int(index) for index in self.state["done"]}
+
+    def mark_done(self, index, record):
+        self.state["done"][str(index)] = [record.day(), record.seq]
+        self.save()
+
+    def save(self):
+        with atomic_write(self.path) as f:
+            json.dump(self.state, f)
+
+    def clear(self):
+        self.state = None
+        if os.path.isfile(self.path):
+            os.remove(self.path)
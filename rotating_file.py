@@ -0,0 +1,204 @@
+"""
+One file per local day, YYYYMMDD<suffix>, for the logs and the measurement files.
+
+days caches the name and the bounds of the current day. today() computes them again only once the monotonic clock
+passed the end of the day, day_of(timestamp) only compares the timestamp with the bounds, so neither formats a date
+for every line written. A record of a set running over midnight goes to the file of its own day.
+
+DailyFile keeps the handle of its day open and changes to the next file with the first line of a new day:
+
+    f = DailyFile("logs/")
+    f.write(line, timestamp)  # logs/20211205.txt
+    f.path()  # file of today
+
+Compressor gzips the text files of past days in the background, YYYYMMDD.txt becomes YYYYMMDD.txt.gz. A file is
+only compressed once the upload worker sent it at its current size, the upload after midnight that sends the last
+lines of a day included. Measurement text files are only compressed next to the binary file of their day, days of
+older versions with the text file only are read from it by MeasurementHistory:
+
+    compressor = Compressor(["logs/"], measurement_folders=["measurements/"], uploaded=uploader.is_uploaded)
+    compressor.start()
+
+atomic_write opens a file next to path that is renamed over path once written, a crash never leaves half a file:
+
+    with atomic_write("upload_queue.json") as f:
+        json.dump(queue, f)
+"""
+
+import contextlib
+import datetime as dt
+import gzip
+import math as m
+import os
+import shutil
+import threading
+import time
+
+
+COMPRESS_INTERVAL = 10*60  # s between two passes of the Compressor
+
+
+def day_bounds(timestamp):
+    """
+    :return: (YYYYMMDD, start, end) of the local day of timestamp, start and end in seconds since epoch
+    """
+    date = dt.date.fromtimestamp(timestamp)
+    start = dt.datetime.combine(date, dt.time()).timestamp()
+    end = dt.datetime.combine(date + dt.timedelta(days=1), dt.time()).timestamp()  # 23 or 25 h at DST changes
+    return date.strftime("%Y%m%d"), start, end
+
+
+class DayBoundary:
+    def __init__(self, clock=time.monotonic, wall=time.time):
+        self.clock = clock
+        self.wall = wall
+        self.cached = ("", 0.0, 0.0)  # day, start, end, replaced as a whole so threads read it without lock
+        self.deadline = -m.inf  # monotonic time the cached day ends
+
+    def refresh(self):
+        now = self.wall()
+        self.cached = day_bounds(now)
+        self.deadline = self.clock() + self.cached[2] - now
+
+    def today(self):
+        if self.clock() >= self.deadline:
+            self.refresh()
+        return self.cached[0]
+
+    def day_of(self, timestamp):
+        day, start, end = self.cached
+        if start <= timestamp < end:
+            return day
+        if not start <= self.wall() < end:
+            self.refresh()  # the day is over or the system time was set, e.g. by NTP after booting without RTC
+            day, start, end = self.cached
+            if start <= timestamp < end:
+                return day
+        return day_bounds(timestamp)[0]  # timestamp of another day, e.g. of a record recovered from the journal
+
+
+days = DayBoundary()
+
+
+class DailyFile:
+    def __init__(self, folder, suffix=".txt", mode='a'):
+        """
+        :param folder: ending with a slash
+        """
+        self.folder = folder
+        self.suffix = suffix
+        self.mode = mode
+        self.day = None
+        self.file = None
+
+    def path(self, day=None):
+        # file of day, of today if None
+        return self.folder + (days.today() if day is None else day) + self.suffix
+
+    def write(self, data, timestamp=None):
+        """
+        Appends data to the file of the day of timestamp, of today if None.
+        """
+        day = days.today() if timestamp is None else days.day_of(timestamp)
+        if day != self.day:
+            self.close()
+            self.file = open(self.path(day), self.mode)
+            self.day = day
+        self.file.write(data)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.day, self.file = None, None
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    """
+    Opens path.tmp and renames it over path when the block ends, the file at path is always complete. If the block
+    raises, path is left as it was and path.tmp removed.
+    :param kwargs: passed to open, e.g. newline
+    """
+    try:
+        with open(path + ".tmp", mode, **kwargs) as f:
+            yield f
+    except BaseException:
+        if os.path.isfile(path + ".tmp"):
+            os.remove(path + ".tmp")
+        raise
+    os.replace(path + ".tmp", path)
+
+
+def compress_file(path):
+    """
+    Replaces path by path.gz. If path.gz exists, e.g. because lines of the day were recovered later on, path is
+    appended to it as another gzip member, gzip reads both as one.
+    """
+    with open(path, 'rb') as source, atomic_write(path + ".gz", 'wb') as target:
+        if os.path.isfile(path + ".gz"):
+            with open(path + ".gz", 'rb') as compressed:
+                shutil.copyfileobj(compressed, target)
+        with gzip.GzipFile(fileobj=target, mode='wb') as member:
+            shutil.copyfileobj(source, member)
+    os.remove(path)
+
+
+class Compressor(threading.Thread):
+    def __init__(self, folders, measurement_folders=(), uploaded=lambda path: True, interval=COMPRESS_INTERVAL,
+                 suffix=".txt", binary_suffix=".bin"):
+        """
+        :param folders: searched with their subfolders for files of past days
+        :param measurement_folders: like folders, a day is only compressed if its binary_suffix file is there
+        :param uploaded: callable telling whether a path reached the server as it is, e.g. UploadWorker.is_uploaded
+        """
+        super().__init__(daemon=True)
+        self.folders = folders
+        self.measurement_folders = measurement_folders
+        self.uploaded = uploaded
+        self.binary_suffix = binary_suffix
+        self.interval = interval
+        self.suffix = suffix
+        self.wake_up = threading.Event()
+        self.running = True
+
+    def closed_day_files(self):
+        today = days.today()
+        folders = [(folder, False) for folder in self.folders]
+        folders += [(folder, True) for folder in self.measurement_folders]
+        for folder, needs_binary in folders:
+            for dirpath, _, names in os.walk(folder):
+                for name in sorted(names):
+                    day = name[:-len(self.suffix)]
+                    if not name.endswith(self.suffix) or len(day) != 8 or not day.isdigit() or day >= today:
+                        continue
+                    if needs_binary and day + self.binary_suffix not in names:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    if self.uploaded(path):
+                        yield path
+
+    def compress_closed_days(self):
+        from logger import log  # logger.py imports this module
+
+        for path in self.closed_day_files():
+            try:
+                compress_file(path)
+            except OSError as e:
+                log.error("Compressing " + path + " failed: " + str(e))
+            else:
+                log.info("Compressed " + path)
+
+    def run(self):
+        while self.running:
+            self.compress_closed_days()
+            self.wake_up.wait(self.interval)
+            self.wake_up.clear()
+
+    def stop(self):
+        self.running = False
+        self.wake_up.set()
+        self.join(timeout=5)
@@ -0,0 +1,127 @@
+"""
+Start times of the measurement sets. Sets are placed on a fixed grid of epochs aligned to the wall clock, with
+interval 900 at every quarter hour. Waiting uses the monotonic clock, so the length of a set does not shift later
+epochs. If the system time moves against the monotonic clock, e.g. when NTP sets it after booting without RTC, the
+grid is aligned to the new time before the next set.
+
+A set still running at its next epoch is an overrun, handled by the overrun policy:
+    skip      missed epochs are dropped, the next set starts at the next epoch still ahead
+    catch_up  missed epochs are measured right away one after another until the grid is reached again
+    shift     the next set starts right away and the grid is moved to its start
+
+With priority_interval, priority aims get epochs of their own in between the full sets. priority_interval 300 and
+interval 900 measure every aim at :00 and only the priority aims at :05 and :10.
+"""
+
+import collections
+import datetime as dt
+import math as m
+import time
+
+from instrumentation import metrics as default_metrics
+from logger import log
+
+
+OVERRUN_POLICIES = ("skip", "catch_up", "shift")
+WALL_CLOCK_TOLERANCE = 1  # s the system time may move against the monotonic clock before the grid is aligned again
+
+Slot = collections.namedtuple("Slot", "index planned planned_wall full")  # planned on the monotonic clock
+
+
+class SetScheduler:
+    def __init__(self, interval, overrun_policy="skip", priority_interval=None, align=True, clock=time.monotonic,
+                 sleep=time.sleep, wall=time.time, metrics=default_metrics):
+        """
+        :param interval: seconds between two full sets
+        :param priority_interval: seconds between two sets of priority aims only, must divide interval
+        :param align: first set at the next multiple of interval on the wall clock instead of right away
+        :param clock: monotonic clock, sleep and system time, those of the serial connection when replaying a trace
+        :param metrics: Metrics the waits are recorded to, that of the serial connection
+        """
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy " + str(overrun_policy) + ", use one of " + str(OVERRUN_POLICIES))
+        if priority_interval is not None and (priority_interval <= 0 or interval % priority_interval):
+            raise ValueError("Priority interval " + str(priority_interval) + " does not divide interval " +
+                             str(interval))
+
+        self.interval = interval
+        self.overrun_policy = overrun_policy
+        self.step = priority_interval or interval
+        self.slots_per_set = int(round(interval/self.step))
+        self.align = align
+        self.clock = clock
+        self.sleep = sleep
+        self.wall = wall
+        self.metrics = metrics
+
+        wall_now, monotonic_now = wall(), clock()
+        first_wall = m.ceil(wall_now/interval)*interval if align else wall_now
+        self.anchor = monotonic_now + first_wall - wall_now  # monotonic time of slot 0
+        self.anchor_wall = first_wall
+        self.index = 0  # next slot to run
+
+    def planned(self, index):
+        return self.anchor + index*self.step
+
+    def realign(self):
+        """
+        Moves the grid to the system time if it was set since the grid was placed. Aligned slots keep their place in
+        the set, the next slot is the first multiple of the step still ahead on the new time.
+        """
+        wall_now, monotonic_now = self.wall(), self.clock()
+        drift = wall_now - (self.anchor_wall + monotonic_now - self.anchor)
+        if abs(drift) <= WALL_CLOCK_TOLERANCE:
+            return
+        log.warning("System time moved by " + str(round(drift, 1)) + "s, aligning schedule again")
+        if not self.align:
+            self.anchor_wall += drift
+            return
+        first = m.ceil(wall_now/self.step)  # next multiple of step, in steps since epoch
+        self.index += (first - self.index) % self.slots_per_set
+        self.anchor_wall = (first - self.index)*self.step
+        self.anchor = monotonic_now + self.anchor_wall - wall_now
+
+    def next_slot(self):
+        """
+        Slot of the next set after applying the overrun policy, does not wait for it.
+        """
+        self.realign()
+        now = self.clock()
+        planned = self.planned(self.index)
+        if planned < now:
+            missed = int((now - planned)//self.step) + 1  # slots whose start lies in the past, this one included
+            if self.overrun_policy == "skip":
+                log.warning("Set overran, skipping " + str(missed) + " epochs")
+                self.index += missed
+            elif self.overrun_policy == "shift":
+                log.warning("Set overran by " + str(round(now - planned, 1)) + "s, shifting schedule")
+                self.anchor += now - planned
+                self.anchor_wall += now - planned
+            else:
+                log.warning("Set overran, catching up on " + str(missed) + " epochs")
+
+        index = self.index
+        self.index += 1
+        return Slot(index, self.planned(index), self.anchor_wall + index*self.step, index % self.slots_per_set == 0)
+
+    def wait(self):
+        """
+        Sleeps until the next slot and logs its planned and actual start.
+        :return: Slot, None if sleep returned before the slot was due (woken up by a control command of daemon.py),
+            the slot is then still the next one
+        """
+        slot = self.next_slot()
+        delay = slot.planned - self.clock()
+        if delay > 0:
+            log.info("Next set at " + dt.datetime.fromtimestamp(slot.planned_wall).strftime("%H:%M:%S") +
+                     ", sleeping for " + str(int(delay)) + "s")
+            self.metrics.sleep("set_sleep", delay, self.sleep, self.clock)
+            if self.clock() < slot.planned:
+                self.index = slot.index
+                return None
+
+        late = self.clock() - slot.planned
+        self.metrics.record_phase("start_delay", max(late, 0.0))
+        log.info("Set started", planned=dt.datetime.fromtimestamp(slot.planned_wall).strftime("%H:%M:%S.%f")[:-3],
+                 late_ms=round(late*1000, 1), full=slot.full)
+        return slot
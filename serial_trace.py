@@ -0,0 +1,338 @@
+"""
+Recording the serial traffic of a run and replaying it, to reproduce a failed set at the desk.
+
+CaptureTransport wraps the transport of a SerialConnection and appends every event to a binary trace file:
+
+    sercon = SerialConnection("/dev/ttyUSB0", capture_path="traces/20211205_133612.trace")
+
+A trace is FILE_MAGIC, the wall clock time of the capture start as double and then one event after the other, each
+EVENT (kind, seconds since the capture start on the monotonic clock, length of the data) followed by the data. Bytes
+thrown away by reset_input_buffer are recorded as DISCARDED, so the replay drops them at the same place.
+
+ReplayTransport feeds a trace back into a SerialConnection. Every request written has to be the next one sent in the
+trace, a reply is delivered once all requests sent before it in the trace were written. At full speed the connection
+runs on the time of the trace: reads of a request that timed out return at once, sleeps and the waits of the
+handler only advance the clock. Realtime replay keeps the delays between request and reply of the trace.
+
+    sercon = SerialConnection("replay", transport=ReplayTransport("traces/20211205_133612.trace"))
+
+The replayed run has to send what the captured one sent: same aims, same settings and, for adaptive timeouts, the
+same learned state. PipelinedGeoCom times out on the wall clock, its traces are replayed with realtime=True.
+
+    python serial_trace.py dump TRACE
+    python serial_trace.py replay TRACE SETUP_FILE [--second-circle] [--optimize] [--interval SECONDS]
+"""
+
+import argparse
+import collections
+import os
+import struct
+import threading
+import time
+
+from transport import Transport
+
+
+FILE_MAGIC = b"TM50TR01"
+START = struct.Struct("<d")  # wall clock time of the capture start
+EVENT = struct.Struct("<BdI")  # kind, seconds since the capture start, length of the data
+
+OPENED = 0
+CLOSED = 1
+SENT = 2
+RECEIVED = 3
+DISCARDED = 4
+EVENT_NAMES = {OPENED: "opened", CLOSED: "closed", SENT: "sent", RECEIVED: "received", DISCARDED: "discarded"}
+
+Event = collections.namedtuple("Event", "kind time data")
+
+
+class ReplayMismatch(Exception):
+    pass
+
+
+class ReplayEnd(Exception):
+    pass
+
+
+def read_trace(path):
+    """
+    :return: (wall clock time of the capture start, list of Event), a torn last event is left out
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(path + " is not a trace file")
+        started, = START.unpack(f.read(START.size))
+        events = []
+        while True:
+            header = f.read(EVENT.size)
+            if len(header) < EVENT.size:
+                break
+            kind, offset, length = EVENT.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            events.append(Event(kind, offset, data))
+    return started, events
+
+
+class CaptureTransport(Transport):
+    """
+    Passes everything through to transport and records it. Every event is flushed, a trace is complete up to the
+    last event even if the process dies.
+    """
+    def __init__(self, transport, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.transport = transport
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.file = open(path, 'wb')
+        self.file.write(FILE_MAGIC + START.pack(time.time()))
+        self.file.flush()
+
+    def record(self, kind, data=b""):
+        with self.lock:
+            self.file.write(EVENT.pack(kind, time.monotonic() - self.started, len(data)) + data)
+            self.file.flush()
+
+    @property
+    def timeout(self):
+        return self.transport.timeout
+
+    @property
+    def is_open(self):
+        return self.transport.is_open
+
+    @property
+    def in_waiting(self):
+        return self.transport.in_waiting
+
+    def clock(self):
+        return self.transport.clock()
+
+    def sleep(self, seconds):
+        self.transport.sleep(seconds)
+
+    def wall(self):
+        return self.transport.wall()
+
+    def open(self):
+        self.transport.open()
+        self.record(OPENED)
+
+    def close(self):
+        self.record(CLOSED)
+        self.transport.close()
+
+    def read(self, size=1):
+        data = self.transport.read(size)
+        if data:
+            self.record(RECEIVED, data)
+        return data
+
+    def write(self, data):
+        self.record(SENT, data)
+        return self.transport.write(data)
+
+    def reset_input_buffer(self):
+        waiting = self.transport.in_waiting
+        if waiting:
+            self.record(DISCARDED, self.transport.read(waiting))
+        self.transport.reset_input_buffer()
+
+    def readall(self):
+        data = self.transport.readall()
+        if data:
+            self.record(RECEIVED, data)
+        return data
+
+    def close_trace(self):
+        with self.lock:
+            self.file.close()
+
+
+class ReplayTransport(Transport):
+    def __init__(self, path, realtime=False, timeout=1):
+        self.path = path
+        self.realtime = realtime
+        self.timeout = timeout
+        self.started, events = read_trace(path)
+
+        # requests in order, replies and discarded bytes with the amount of requests sent before them in the trace
+        self.requests = [event for event in events if event.kind == SENT]
+        self.replies = []
+        sent = 0
+        for event in events:
+            if event.kind == SENT:
+                sent += 1
+            elif event.kind in (RECEIVED, DISCARDED):
+                self.replies.append((sent, event))
+
+        self.opened = False
+        self.sent = 0  # requests written so far
+        self.reply = 0  # index of the next reply in replies
+        self.consumed = 0  # bytes of that reply already read
+        self.now = 0.0  # time of the trace at full speed
+        self.offset = 0.0  # monotonic time minus time of the trace in realtime
+        self.condition = threading.Condition()
+
+    def clock(self):
+        if self.realtime:
+            return time.monotonic()
+        with self.condition:
+            return self.now
+
+    def sleep(self, seconds):
+        if self.realtime:
+            time.sleep(seconds)
+            return
+        with self.condition:
+            self.now += seconds
+
+    def wall(self):
+        if self.realtime:
+            return time.time()
+        with self.condition:
+            return self.started + self.now  # system time of the capture
+
+    @property
+    def is_open(self):
+        return self.opened
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+    def next_reply(self, kind=RECEIVED):
+        """
+        The next reply if all requests sent before it in the trace are written and it is of kind, else None.
+        :return: (event, seconds until it is due, 0 at full speed)
+        """
+        if self.reply >= len(self.replies):
+            return None, 0.0
+        sent_before, event = self.replies[self.reply]
+        if sent_before > self.sent or event.kind != kind:
+            return None, 0.0
+        if not self.realtime:
+            return event, 0.0
+        return event, max(self.offset + event.time - time.monotonic(), 0.0)
+
+    def take(self, event, size):
+        data = event.data[self.consumed:self.consumed + size]
+        self.consumed += len(data)
+        if self.consumed >= len(event.data):
+            self.reply += 1
+            self.consumed = 0
+        self.now = max(self.now, event.time)
+        return data
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            event, due = self.next_reply()
+            return len(event.data) - self.consumed if event is not None and due == 0 else 0
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while True:
+                event, due = self.next_reply()
+                if event is not None and due == 0:
+                    return self.take(event, size)
+                if not self.realtime:
+                    self.now += self.timeout  # the captured run waited for nothing here
+                    return b""
+                now = time.monotonic()
+                if now >= deadline:
+                    return b""
+                self.condition.wait(min(deadline - now, due) if event is not None else deadline - now)
+
+    def write(self, data):
+        with self.condition:
+            if self.sent >= len(self.requests):
+                raise ReplayEnd("all " + str(len(self.requests)) + " requests of " + self.path + " replayed")
+            expected = self.requests[self.sent]
+            if data != expected.data:
+                raise ReplayMismatch("request " + str(self.sent) + " at " + str(round(expected.time, 3)) +
+                                     "s of the trace: expected " + repr(expected.data) + ", got " + repr(data))
+            self.sent += 1
+            self.now = max(self.now, expected.time)
+            self.offset = time.monotonic() - expected.time
+            self.condition.notify_all()
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self.condition:
+            event, _ = self.next_reply(DISCARDED)
+            if event is not None:
+                self.take(event, len(event.data))
+
+
+def dump(path):
+    started, events = read_trace(path)
+    print("Capture started " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)) + ", " +
+          str(len(events)) + " events")
+    for event in events:
+        print("%12.6f %-9s %r" % (event.time, EVENT_NAMES.get(event.kind, event.kind), event.data))
+
+
+def replay(path, aims, realtime=False, interval=None, name="replay"):
+    """
+    Runs the measurement loop on a trace until its requests are used up. Measurements go to measurements/<name>/,
+    nothing is uploaded.
+    :param aims: AimTable in the order measured during the capture
+    :return: (sets completed, CPU seconds of the process, wall clock seconds)
+    """
+    from geocom import SerialConnection, GeoCom
+    from auto_measure_handler import HandlerAutoMeasurement, MEASUREMENT_FOLDER
+    from uploader import UploadWorker, QUEUE_FILE
+
+    uploader = UploadWorker(queue_file=os.path.join(MEASUREMENT_FOLDER, name, QUEUE_FILE))  # never started
+    sercon = SerialConnection(name, transport=ReplayTransport(path, realtime=realtime))
+    handler = HandlerAutoMeasurement(GeoCom(sercon), uploader=uploader, name=name)
+    handler.aims = aims
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    try:
+        if handler.initialize():
+            handler.run(interval=interval)
+    except ReplayEnd:
+        pass
+    finally:
+        handler.store.close()
+    return handler.sets_completed, time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or replay a serial trace")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    dump_parser = subparsers.add_parser("dump")
+    dump_parser.add_argument("trace")
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument("setup_file")
+    replay_parser.add_argument("--second-circle", action="store_true")
+    replay_parser.add_argument("--optimize", action="store_true", help="aim order was optimized during the capture")
+    replay_parser.add_argument("--interval", type=float)
+    replay_parser.add_argument("--realtime", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        dump(args.trace)
+    else:
+        from setup_file import read_setup_file
+        from aim_planner import plan_route, HOME
+
+        aims = read_setup_file(args.setup_file)
+        if args.second_circle:
+            aims = aims.with_second_circle()
+        if args.optimize:
+            aims = aims[plan_route(aims.hz, aims.v, start=HOME, groups=aims.column("group"))[0]]
+        sets, cpu, wall = replay(args.trace, aims, realtime=args.realtime, interval=args.interval)
+        print("Replayed " + str(sets) + " sets in " + str(round(wall, 3)) + "s, " + str(round(cpu, 3)) +
+              "s CPU")
@@ -0,0 +1,200 @@
+"""
+Two face reduction of measured sets. Face I and face II observations of the same aim within a set are paired and
+reduced in one batch over all aims (and sets) with NumPy:
+
+    collimation error c = (hz_I - (hz_II - 200))/2
+    index error i = (v_I + v_II - 400)/2
+    hz = hz_I - c, v = v_I - i, slope_dist = mean of both faces
+
+Angles in gon, distances in m. Pairs exceeding the tolerances or deviating from the median c and i of their set
+are flagged.
+"""
+
+import datetime as dt
+import os
+import warnings
+
+import numpy as np
+
+from geocom import GON2RAD
+from logger import log
+from measurement_store import NULL_HZ, NULL_V, NULL_SLOPE_DIST
+
+
+REDUCED_FILE_SUFFIX = "_reduced.txt"
+
+TOLERANCES = {
+    "collimation": 0.010,  # gon, |c|
+    "index_error": 0.010,  # gon, |i|
+    "slope_dist": 0.002,  # m, difference between the faces
+    "collimation_spread": 0.0015,  # gon, deviation of c from the median of its set
+    "index_error_spread": 0.0015,  # gon, deviation of i from the median of its set
+}
+
+FLAG_COLLIMATION = 1 << 0
+FLAG_INDEX_ERROR = 1 << 1
+FLAG_SLOPE_DIST = 1 << 2
+FLAG_COLLIMATION_OUTLIER = 1 << 3
+FLAG_INDEX_ERROR_OUTLIER = 1 << 4
+FLAG_INCOMPLETE = 1 << 5  # a face or value is missing
+
+
+def wrap(angle):
+    # gon to (-200, 200]
+    return 200 - (200 - angle) % 400
+
+
+def split_sets(time, v, gap=None):
+    """
+    Set id of every row of an archive sorted by time. A set starts where face II is followed by face I again or,
+    if gap is given, after a pause longer than gap seconds.
+    """
+    # rows without a v angle take the face of the row before them
+    known = np.where(np.isfinite(v), np.arange(len(v)), 0)
+    face_two = (v > 200)[np.maximum.accumulate(known)] if len(v) else np.zeros(0, dtype=bool)
+    new_set = np.zeros(len(v), dtype=bool)
+    new_set[1:] = face_two[:-1] & ~face_two[1:]
+    if gap is not None:
+        new_set[1:] |= np.diff(time) > gap
+    return np.cumsum(new_set)
+
+
+def face_means(keys, values, face_mask, group_count):
+    # NaN aware mean per group over the rows of one face
+    valid = face_mask & np.isfinite(values)
+    sums = np.bincount(keys[valid], weights=values[valid], minlength=group_count)
+    counts = np.bincount(keys[valid], minlength=group_count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums/counts
+
+
+def group_medians(groups, values):
+    """
+    NaN ignoring median per group, groups sorted ascending and numbered 0..n-1. The groups are laid out as rows of
+    a NaN padded table so all medians are taken in one call.
+    """
+    if not len(groups):
+        return np.zeros(0)
+    counts = np.bincount(groups)
+    starts = np.cumsum(counts) - counts
+    table = np.full((len(counts), counts.max()), np.nan)
+    table[groups, np.arange(len(groups)) - starts[groups]] = values
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # sets without any complete pair
+        return np.nanmedian(table, axis=1)
+
+
+def reduce_faces(set_ids, aims, time, hz, v, slope_dist, tolerances=TOLERANCES):
+    """
+    :param set_ids: set id of every observation, e.g. from split_sets
+    :param aims: integer aim code of every observation
+    :return: dict of arrays with one entry per (set, aim): set_id, aim, time, hz, v, slope_dist, collimation,
+        index_error, slope_dist_diff, flags
+    """
+    set_ids, aims = np.asarray(set_ids, dtype=np.int64), np.asarray(aims, dtype=np.int64)
+    time, hz, v, slope_dist = (np.asarray(values, dtype=np.float64) for values in (time, hz, v, slope_dist))
+
+    aim_count = aims.max() + 1 if len(aims) else 0
+    pair_keys, keys = np.unique(set_ids*aim_count + aims, return_inverse=True)
+    group_count = len(pair_keys)
+
+    face_two = v > 200
+    face_one = ~face_two
+    hz_face_one = np.where(face_two, hz - 200, hz) % 400  # face II direction reduced to face I
+
+    # directions are averaged as offsets from one direction of their pair, safe across 0/400
+    reference = np.zeros(group_count)
+    finite = np.isfinite(hz_face_one)
+    reference[keys[finite]] = hz_face_one[finite]
+    offsets = wrap(hz_face_one - reference[keys])
+    hz1 = reference + face_means(keys, offsets, face_one, group_count)
+    hz2 = reference + face_means(keys, offsets, face_two, group_count)
+    v1 = face_means(keys, v, face_one, group_count)
+    v2 = face_means(keys, v, face_two, group_count)
+    d1 = face_means(keys, slope_dist, face_one, group_count)
+    d2 = face_means(keys, slope_dist, face_two, group_count)
+
+    collimation = (hz1 - hz2)/2
+    index_error = (v1 + v2 - 400)/2
+    reduced = {
+        "set_id": pair_keys // aim_count if aim_count else pair_keys,
+        "aim": pair_keys % aim_count if aim_count else pair_keys,
+        "time": np.bincount(keys, weights=time, minlength=group_count)/np.bincount(keys, minlength=group_count),
+        "hz": (hz1 - collimation) % 400,
+        "v": v1 - index_error,
+        "slope_dist": (d1 + d2)/2,
+        "collimation": collimation,
+        "index_error": index_error,
+        "slope_dist_diff": d1 - d2,
+    }
+
+    flags = np.zeros(group_count, dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        flags[np.abs(collimation) > tolerances["collimation"]] |= FLAG_COLLIMATION
+        flags[np.abs(index_error) > tolerances["index_error"]] |= FLAG_INDEX_ERROR
+        flags[np.abs(d1 - d2) > tolerances["slope_dist"]] |= FLAG_SLOPE_DIST
+
+        set_positions = np.unique(reduced["set_id"], return_inverse=True)[1]
+        collimation_median = group_medians(set_positions, collimation)[set_positions]
+        index_error_median = group_medians(set_positions, index_error)[set_positions]
+        flags[np.abs(collimation - collimation_median) > tolerances["collimation_spread"]] |= FLAG_COLLIMATION_OUTLIER
+        flags[np.abs(index_error - index_error_median) > tolerances["index_error_spread"]] |= FLAG_INDEX_ERROR_OUTLIER
+    flags[~np.isfinite(collimation) | ~np.isfinite(index_error) | ~np.isfinite(d1 - d2)] |= FLAG_INCOMPLETE
+    reduced["flags"] = flags
+    return reduced
+
+
+def reduce_set_records(records, tolerances=TOLERANCES):
+    """
+    Reduces the MeasurementRecords of one set.
+    :return: (reduced dict as of reduce_faces, list of aim names indexed by its aim column)
+    """
+    names = sorted({record.aim_name for record in records})
+    codes = {name: code for code, name in enumerate(names)}
+
+    def column(attribute, null_bit, factor):
+        values = np.array([getattr(record, attribute) for record in records], dtype=np.float64)*factor
+        values[np.array([record.null_mask & null_bit != 0 for record in records], dtype=bool)] = np.nan
+        return values
+
+    reduced = reduce_faces(np.zeros(len(records)), [codes[record.aim_name] for record in records],
+                           [record.timestamp for record in records], column("hz", NULL_HZ, 1/GON2RAD),
+                           column("v", NULL_V, 1/GON2RAD), column("slope_dist", NULL_SLOPE_DIST, 1.0),
+                           tolerances=tolerances)
+    return reduced, names
+
+
+def reduce_archive(history, start=None, end=None, gap=None, tolerances=TOLERANCES):
+    """
+    Reduces every set of a MeasurementHistory in one batch.
+    :param gap: seconds without measurement after which a new set starts, see split_sets
+    :return: (reduced dict as of reduce_faces, list of aim names indexed by its aim column)
+    """
+    rows, names = history.load(start=start, end=end)
+    set_ids = split_sets(rows["time"], rows["v"], gap=gap)
+    return reduce_faces(set_ids, rows["aim"], rows["time"], rows["hz"], rows["v"], rows["slope_dist"],
+                        tolerances=tolerances), names
+
+
+def write_reduced_set(folder, reduced, names, rt=5):
+    """
+    Appends the reduced pairs to YYYYMMDD_reduced.txt next to the raw file of the day, one line per aim:
+    str_datetime str_aim_name hz[g] v[g] slope_dist[m] collimation[mgon] index_error[mgon] slope_dist_diff[mm] flags
+    """
+    lines = {}
+    for i in range(len(reduced["aim"])):
+        time = dt.datetime.fromtimestamp(reduced["time"][i])
+        lines.setdefault(time.strftime("%Y%m%d"), []).append(' '.join((
+            time.strftime('%Y%m%d_%H%M%S'), names[reduced["aim"][i]],
+            str(round(reduced["hz"][i], rt)), str(round(reduced["v"][i], rt)),
+            str(round(reduced["slope_dist"][i], rt)), str(round(reduced["collimation"][i]*1000, 2)),
+            str(round(reduced["index_error"][i]*1000, 2)), str(round(reduced["slope_dist_diff"][i]*1000, 2)),
+            str(reduced["flags"][i]))) + "\n")
+
+    for day, day_lines in lines.items():
+        with open(os.path.join(folder, day + REDUCED_FILE_SUFFIX), 'a') as f:
+            f.writelines(day_lines)
+
+    flagged = int(np.count_nonzero(reduced["flags"]))
+    if flagged:
+        log.warning(str(flagged) + " of " + str(len(reduced["flags"])) + " reduced aims are flagged")
@@ -0,0 +1,173 @@
+"""
+Reading and writing setup files. A setup file is a CSV file with a header line, lines starting with # are comments:
+
+    name,hz,v,target,prism,group,every,atr,retries,face_one_only,priority
+    P1,12.3456,98.7654,0,3,north wall,1,1,,0,1
+    R7,250.1,101.2,1,-1,,4,0,,1,0
+
+Only name, hz, v and target are required, the other columns may be left out or left empty:
+    hz, v           direction in gon, hz in [0, 400), v in (0, 400)
+    target          0 reflector, 1 reflectorless, see BAP_TARGET_TYPE
+    prism           PrismType of reflector aims, -1 or empty if not defined
+    group           name of the group, aims of a group are measured one after the other
+    every           measured in every n-th full set only, default 1
+    atr             0 to position without automatic target recognition, default 1
+    retries         repetitions at the end of the set if the aim failed, empty or -1 for the default
+    face_one_only   1 to leave the aim out in face II, default 0
+    priority        1 to measure the aim in the priority sets as well, default 0
+
+All lines are checked before an aim is used, every error is reported with its line number. Files of the older format
+without header, one "name hz v target prism" per line separated by whitespace, are still read.
+"""
+
+import csv
+
+import numpy as np
+
+from geocom_dicts import *
+from aim_table import AimTable, AIM_DTYPE
+from rotating_file import atomic_write
+
+
+REQUIRED_COLUMNS = ("name", "hz", "v", "target")
+COLUMNS = ("name", "hz", "v", "target", "prism", "group", "every", "atr", "retries", "face_one_only", "priority")
+LEGACY_COLUMNS = ("name", "hz", "v", "target", "prism", "priority")
+
+
+class SetupFileError(ValueError):
+    def __init__(self, path, errors):
+        """
+        :param errors: list of (line number, message)
+        """
+        self.path = path
+        self.errors = errors
+        super().__init__("\n".join(path + ":" + str(line) + ": " + message for line, message in errors))
+
+
+def parse_flag(value):
+    if value not in ("0", "1"):
+        raise ValueError("expected 0 or 1, got " + repr(value))
+    return value == "1"
+
+
+def parse_row(fields):
+    """
+    :param fields: column -> text of one aim, missing columns are not in fields or empty
+    :return: (name, group, tuple of the AIM_DTYPE fields with group 0), raises ValueError with the first problem
+    """
+    def get(column, parse, default):
+        text = fields.get(column, "").strip()
+        if not text:
+            return default
+        try:
+            return parse(text)
+        except ValueError:
+            raise ValueError(column + " " + repr(text) + " is not valid")
+
+    name = fields.get("name", "").strip()
+    if not name:
+        raise ValueError("name is missing")
+    if any(c.isspace() for c in name) or ',' in name:
+        raise ValueError("name " + repr(name) + " contains whitespace or a comma")
+    for column in REQUIRED_COLUMNS[1:]:
+        if not fields.get(column, "").strip():
+            raise ValueError(column + " is missing")
+
+    hz = get("hz", float, None)
+    v = get("v", float, None)
+    target = get("target", int, None)
+    prism = get("prism", int, -1)
+    every = get("every", int, 1)
+    atr = get("atr", parse_flag, True)
+    retries = get("retries", int, -1)
+    face_one_only = get("face_one_only", parse_flag, False)
+    priority = get("priority", parse_flag, False)
+
+    if not 0 <= hz < 400:
+        raise ValueError("hz " + str(hz) + " not in [0, 400)")
+    if not 0 < v < 400:
+        raise ValueError("v " + str(v) + " not in (0, 400)")
+    if target not in BAP_TARGET_TYPE.values():
+        raise ValueError("target " + str(target) + " not in " + str(sorted(BAP_TARGET_TYPE.values())))
+    if target == BAP_TARGET_TYPE["BAP_REFL_USE"] and prism not in PrismType.values():
+        raise ValueError("reflector aim needs a prism from " + str(sorted(PrismType.values())))
+    if not 1 <= every <= 1000:
+        raise ValueError("every " + str(every) + " not in [1, 1000]")
+    if not -1 <= retries <= 100:
+        raise ValueError("retries " + str(retries) + " not -1 or 0..100")
+
+    group = fields.get("group", "").strip()
+    return name, group, (hz, v, target, prism, 0, every, atr, retries, face_one_only, priority)
+
+
+def read_lines(path):
+    # (line number, text) of all lines that are neither empty nor comments
+    with open(path, 'r', newline='') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip() and not line.lstrip().startswith('#'):
+                yield number, line
+
+
+def read_setup_file(path):
+    """
+    :return: AimTable of all aims in path, raises SetupFileError listing every invalid line
+    """
+    lines = list(read_lines(path))
+    if not lines:
+        return AimTable()
+
+    errors = []
+    header = [column.strip() for column in lines[0][1].split(',')]
+    if header[0] == "name":
+        unknown = [column for column in header if column not in COLUMNS]
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if unknown:
+            errors.append((lines[0][0], "unknown columns " + ", ".join(unknown)))
+        if missing:
+            errors.append((lines[0][0], "missing columns " + ", ".join(missing)))
+        if errors:
+            raise SetupFileError(path, errors)
+        numbers = [number for number, _ in lines[1:]]
+        rows = csv.reader([line for _, line in lines[1:]])
+        rows = ((number, fields, header) for number, fields in zip(numbers, rows))
+    else:
+        # older format: name hz v target prism, optionally followed by 1 for priority aims
+        rows = ((number, line.split(), LEGACY_COLUMNS) for number, line in lines)
+
+    names, groups, values, seen = [], [""], [], {}
+    for number, fields, columns in rows:
+        try:
+            if len(fields) > len(columns):
+                raise ValueError("more fields than columns")
+            name, group, row = parse_row(dict(zip(columns, fields)))
+            if name in seen:
+                raise ValueError("name " + name + " already used in line " + str(seen[name]))
+        except ValueError as e:
+            errors.append((number, str(e)))
+            continue
+        seen[name] = number
+        if group not in groups:
+            groups.append(group)
+        names.append(name)
+        values.append(row[:4] + (groups.index(group), ) + row[5:])  # group index into groups
+    if errors:
+        raise SetupFileError(path, errors)
+
+    return AimTable(names, np.array(values, dtype=AIM_DTYPE), groups)
+
+
+def write_setup_file(path, aims):
+    """
+    :param aims: AimTable or list of Aim
+    """
+    if not isinstance(aims, AimTable):
+        aims = AimTable.from_aims(aims)
+    groups = [aims.groups[group] for group in aims.column("group")]
+    retries = ["" if retry < 0 else retry for retry in aims.column("retries").tolist()]
+    flags = [aims.column(column).astype(int).tolist() for column in ("atr", "face_one_only", "priority")]
+    with atomic_write(path, newline='') as f:  # a restart never reads half a setup file
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(aims.names_in_order(), map(repr, aims.hz.tolist()), map(repr, aims.v.tolist()),
+                             aims.column("target").tolist(), aims.column("prism").tolist(), groups,
+                             aims.column("every").tolist(), flags[0], retries, flags[1], flags[2]))
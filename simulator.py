@@ -0,0 +1,413 @@
+"""
+In-process stand-in for a TM50 answering the GeoCOM RPCs used in geocom.py, so the measurement loop can run and be
+profiled without an instrument. Either plug a SimulatedTransport into SerialConnection or serve the simulator on a
+pseudo terminal and point the unchanged SerialConnection at it:
+
+    python simulator.py
+
+VirtualTimeTransport runs the simulator on a simulated clock, a set takes as long as the code of the handler needs,
+see benchmarks/bench_sets.py.
+"""
+
+import heapq
+import math as m
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from geocom import GON2RAD
+from geocom_dicts import *
+from transport import Transport
+
+
+# fault reported for an RPC when a random error is injected
+FAULT_CODES = {
+    9027: GRC["GRC_AUT_NO_TARGET"],
+    9037: GRC["GRC_AUT_NO_TARGET"],
+    2008: GRC["GRC_TMC_BUSY"],
+    2167: GRC["GRC_TMC_DIST_ERROR"],
+    2003: GRC["GRC_TMC_ANGLE_ERROR"],
+    2107: GRC["GRC_TMC_ANGLE_ERROR"],
+    2022: GRC["GRC_TMC_SIGNAL_ERROR"],
+}
+
+
+class SimulatedTarget:
+    def __init__(self, hz, v, slope_dist):
+        # face I direction in gon and slope distance in m
+        self.hz = hz
+        self.v = v
+        self.slope_dist = slope_dist
+
+
+class SimulatedTM50:
+    def __init__(self, targets=None, latency=0.02, link_latency=0.01, time_scale=1.0, slew_speed=1.5, positioning_overhead=1.0,
+                 fine_adjust_time=0.5, distance_time=2.5, compensator_settle_time=1.0, error_codes=None,
+                 error_rate=0.0, drop_rate=0.0, garble_rate=0.0, atr_field=0.5, default_slope_dist=50.0,
+                 battery_drain=2.0, seed=None):
+        """
+        :param targets: list of SimulatedTarget, None for a prism in every direction
+        :param latency: seconds of processing added to every reply
+        :param link_latency: one way transit time in seconds of the in-process link, overlaps with processing
+        :param time_scale: factor applied to all simulated durations, e.g. 0.001 to run sets at CI speed
+        :param slew_speed: motor speed in rad/s, both axes move at the same time
+        :param positioning_overhead: seconds of acceleration and settling per AUT_PRECISE positioning
+        :param compensator_settle_time: time constant in seconds of the incline decaying after a movement
+        :param error_codes: dict rpc -> return code always answered for that rpc
+        :param error_rate: probability of answering with the fault code of FAULT_CODES
+        :param drop_rate: probability of not answering at all
+        :param garble_rate: probability of a corrupted byte in the reply
+        :param atr_field: gon around the aimed direction in which ATR finds a target
+        :param battery_drain: % of the battery capacity used per simulated hour
+        """
+        self.targets = targets
+        self.latency = latency
+        self.link_latency = link_latency
+        self.time_scale = time_scale
+        self.slew_speed = slew_speed
+        self.positioning_overhead = positioning_overhead
+        self.fine_adjust_time = fine_adjust_time
+        self.distance_time = distance_time
+        self.compensator_settle_time = compensator_settle_time
+        self.error_codes = error_codes or {}
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.garble_rate = garble_rate
+        self.atr_field = atr_field
+        self.default_slope_dist = default_slope_dist
+        self.battery_drain = battery_drain
+        self.random = random.Random(seed)
+
+        self.hz = 0.0  # rad
+        self.v = m.pi/2  # rad
+        self.target = None
+        self.distance_valid = False
+        self.signal_mode = False  # TMC_DoMeasure(TMC_SIGNAL) running
+        self.last_move_end = 0.0  # simulated seconds
+        self.clock = 0.0  # simulated seconds, advanced by every handled request
+
+        self.settings = {}  # rpc -> last parameters of setter rpcs
+        self.stats = {"requests": 0, "errors": 0, "dropped": 0, "garbled": 0}
+
+        self.handlers = {
+            9027: self.make_positioning,
+            9037: self.fine_adjust,
+            2008: self.do_measure,
+            2167: self.get_full_meas,
+            2003: self.get_angle1,
+            2107: self.get_angle5,
+            5011: self.get_int_temp,
+            5039: self.check_power,
+            2022: self.get_signal,
+            6021: self.read_lock_status,
+        }
+
+    def handle(self, request, now=None):
+        """
+        :param request: one request line without terminator, e.g. "%R1Q,2003,1:1"
+        :param now: wall seconds since the transport started, lets simulated time pass while nothing is requested
+        :return: (delay in seconds, reply bytes or None if the reply is dropped)
+        """
+        self.stats["requests"] += 1
+        if now is not None:
+            self.clock = max(self.clock, now/self.time_scale)
+        header, _, params = request.partition(':')
+        header_fields = header.split(',')
+        try:
+            rpc = int(header_fields[1])
+        except (IndexError, ValueError):
+            return self.latency*self.time_scale, None
+        trid = header_fields[2] if len(header_fields) > 2 else "0"
+        params = params.split(',') if params else []
+
+        handler = self.handlers.get(rpc, self.store_setting)
+        try:
+            duration, rc, values = handler(rpc, params)
+        except (IndexError, ValueError):
+            duration, rc, values = 0.0, GRC["GRC_IVPARAM"], []
+        self.clock += duration + self.latency
+
+        if rpc in self.error_codes:
+            rc = self.error_codes[rpc]
+        elif self.error_rate and self.random.random() < self.error_rate:
+            rc = FAULT_CODES.get(rpc, GRC["GRC_SYSBUSY"])
+        if rc != GRC["GRC_OK"]:
+            self.stats["errors"] += 1
+
+        delay = (duration + self.latency)*self.time_scale
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return delay, None
+
+        reply = bytearray(("%R1P,0," + trid + ":" + ','.join([str(rc)] + [repr(value) for value in values])).encode())
+        if self.garble_rate and self.random.random() < self.garble_rate:
+            self.stats["garbled"] += 1
+            reply[self.random.randrange(len(reply))] = self.random.randrange(0x21, 0x100)
+        return delay, bytes(reply) + b"\r\n"
+
+    def store_setting(self, rpc, params):
+        self.settings[rpc] = params
+        if rpc == 17021:
+            self.target = None
+        return 0.0, GRC["GRC_OK"], []
+
+    def find_target(self, hz, v):
+        if self.targets is None:
+            return SimulatedTarget(hz/GON2RAD, v/GON2RAD, self.default_slope_dist)
+        hz, v = hz/GON2RAD % 400, v/GON2RAD
+        if v > 200:  # face II
+            hz, v = (hz - 200) % 400, 400 - v
+        for target in self.targets:
+            d_hz = abs((target.hz - hz + 200) % 400 - 200)
+            if d_hz <= self.atr_field and abs(target.v - v) <= self.atr_field:
+                return target
+        return None
+
+    def make_positioning(self, rpc, params):
+        hz, v, posmode, atrmode = float(params[0]), float(params[1]), int(params[2]), int(params[3])
+        d_hz = abs((hz - self.hz + m.pi) % (2*m.pi) - m.pi)
+        duration = max(d_hz, abs(v - self.v))/self.slew_speed
+        if posmode == AUT_POSMODE["AUT_PRECISE"]:
+            duration += self.positioning_overhead
+
+        self.hz, self.v = hz % (2*m.pi), v
+        self.distance_valid = False
+        self.last_move_end = self.clock + duration
+
+        if atrmode == AUT_ATRMODE["AUT_TARGET"]:
+            self.target = self.find_target(hz, v)
+            if self.target is None:
+                return duration, GRC["GRC_AUT_NO_TARGET"], []
+        return duration, GRC["GRC_OK"], []
+
+    def fine_adjust(self, rpc, params):
+        target = self.find_target(self.hz, self.v)
+        if target is None:
+            return self.fine_adjust_time, GRC["GRC_AUT_NO_TARGET"], []
+        self.target = target
+        return self.fine_adjust_time, GRC["GRC_OK"], []
+
+    def do_measure(self, rpc, params):
+        if int(params[0]) == TMC_MEASURE_PRG["TMC_DEF_DIST"]:
+            self.distance_valid = self.find_target(self.hz, self.v) is not None
+        self.signal_mode = int(params[0]) == TMC_MEASURE_PRG["TMC_SIGNAL"]
+        return 0.05, GRC["GRC_OK"], []
+
+    def inclines(self):
+        # decays after every movement so polling the compensator has something to wait for
+        decay = m.exp(-max(self.clock - self.last_move_end, 0.0)/self.compensator_settle_time)
+        noise = 5e-7
+        return (1e-5 + 5e-4*decay + self.random.gauss(0, noise),
+                -2e-5 + 5e-4*decay + self.random.gauss(0, noise))
+
+    def angles(self):
+        noise = 0.15e-3*GON2RAD  # 0.15 mgon
+        return (self.hz + self.random.gauss(0, noise)) % (2*m.pi), self.v + self.random.gauss(0, noise)
+
+    def get_full_meas(self, rpc, params):
+        hz, v = self.angles()
+        cross_incline, length_incline = self.inclines()
+        if not self.distance_valid:
+            return 0.0, GRC["GRC_TMC_DIST_ERROR"], [hz, v, 1e-5, cross_incline, length_incline, 1e-5, 0.0, 0.0]
+        target = self.find_target(self.hz, self.v)
+        slope_dist = target.slope_dist + self.random.gauss(0, 0.0003)
+        return self.distance_time, GRC["GRC_OK"], [hz, v, 1e-5, cross_incline, length_incline, 1e-5, slope_dist,
+                                                   self.distance_time]
+
+    def get_angle1(self, rpc, params):
+        hz, v = self.angles()
+        cross_incline, length_incline = self.inclines()
+        face = 0 if self.v <= m.pi else 1
+        return 0.0, GRC["GRC_OK"], [hz, v, 1e-5, 0, cross_incline, length_incline, 1e-5, 0, face]
+
+    def get_angle5(self, rpc, params):
+        hz, v = self.angles()
+        return 0.0, GRC["GRC_OK"], [hz, v]
+
+    def get_int_temp(self, rpc, params):
+        return 0.0, GRC["GRC_OK"], [round(21.0 + self.random.gauss(0, 0.05), 2)]
+
+    def check_power(self, rpc, params):
+        capacity = max(100 - int(self.clock/3600*self.battery_drain), 0)
+        battery = CSV_POWER_PATH["CSV_INTERNAL_POWER"]
+        return 0.0, GRC["GRC_OK"], [capacity, battery, battery]
+
+    def get_signal(self, rpc, params):
+        if not self.signal_mode or self.find_target(self.hz, self.v) is None:
+            return 0.1, GRC["GRC_TMC_SIGNAL_ERROR"], []
+        return 0.1, GRC["GRC_OK"], [round(80.0 + self.random.gauss(0, 2), 1), 100]
+
+    def read_lock_status(self, rpc, params):
+        return 0.0, GRC["GRC_OK"], [MOT_LOCK_STATUS["MOT_LOCKED_OUT"]]  # LOCK mode is not simulated
+
+
+class SimulatedTransport(Transport):
+    """
+    Feeds a SimulatedTM50 in-process. Requests are answered in order, a request queued while the instrument is
+    still busy waits for the previous one like on the real device.
+    """
+    def __init__(self, instrument=None, timeout=1):
+        self.instrument = instrument if instrument is not None else SimulatedTM50()
+        self.timeout = timeout
+
+        self.opened = False
+        self.tx_buffer = bytearray()
+        self.rx_buffer = bytearray()
+        self.pending = []  # heap of (ready time, sequence, reply bytes)
+        self.sequence = 0
+        self.busy_until = 0.0
+        self.started = self.clock()
+        self.condition = threading.Condition()
+
+    @property
+    def is_open(self):
+        return self.opened
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            self.collect_ready(self.clock())
+            return len(self.rx_buffer)
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+    def collect_ready(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            self.rx_buffer += heapq.heappop(self.pending)[2]
+
+    def write(self, data):
+        with self.condition:
+            self.tx_buffer += data
+            now = self.clock()
+            while True:
+                end = self.tx_buffer.find(b"\r\n")
+                if end < 0:
+                    break
+                request = bytes(self.tx_buffer[:end]).decode("UTF-8", errors="replace")
+                del self.tx_buffer[:end + 2]
+
+                link_latency = self.instrument.link_latency*self.instrument.time_scale
+                start = max(self.busy_until, now + link_latency)
+                delay, reply = self.instrument.handle(request, now=start - self.started)
+                self.busy_until = start + delay
+                if reply is not None:
+                    self.sequence += 1
+                    heapq.heappush(self.pending, (self.busy_until + link_latency, self.sequence, reply))
+            self.condition.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.collect_ready(now)
+                if self.rx_buffer:
+                    data = bytes(self.rx_buffer[:size])
+                    del self.rx_buffer[:size]
+                    return data
+                if now >= deadline:
+                    return b""
+                wake_up = deadline if not self.pending else min(deadline, self.pending[0][0])
+                self.condition.wait(wake_up - now)
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.collect_ready(self.clock())
+            self.rx_buffer.clear()
+
+
+class VirtualTimeTransport(SimulatedTransport):
+    """
+    SimulatedTransport on a simulated clock. Waiting for a reply, sleeps and timeouts advance the clock at once
+    instead of passing, so sets run as fast as the code around the instrument allows and a seed gives the same run
+    every time. For one thread only, the reader thread of PipelinedGeoCom waits on the wall clock.
+    """
+    def __init__(self, instrument=None, timeout=1):
+        self.now = 0.0
+        self.wall_offset = time.time()  # system time at now 0
+        super().__init__(instrument, timeout)
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def wall(self):
+        return self.wall_offset + self.now
+
+    def read(self, size=1):
+        with self.condition:
+            self.collect_ready(self.now)
+            if not self.rx_buffer and self.pending and self.pending[0][0] <= self.now + self.timeout:
+                self.now = self.pending[0][0]
+                self.collect_ready(self.now)
+            if not self.rx_buffer:
+                self.now += self.timeout
+                return b""
+            data = bytes(self.rx_buffer[:size])
+            del self.rx_buffer[:size]
+            return data
+
+
+class PtyInstrumentServer:
+    """
+    Serves a SimulatedTM50 on a pseudo terminal, port is the device path to open with SerialConnection.
+    """
+    def __init__(self, instrument=None):
+        self.instrument = instrument if instrument is not None else SimulatedTM50()
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # no newline translation or echo
+        self.port = os.ttyname(self.slave)
+        self.running = False
+        self.thread = None
+        self.started = time.monotonic()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def serve(self):
+        buffer = bytearray()
+        while self.running:
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue
+            buffer += os.read(self.master, 4096)
+            while True:
+                end = buffer.find(b"\r\n")
+                if end < 0:
+                    break
+                request = bytes(buffer[:end]).decode("UTF-8", errors="replace")
+                del buffer[:end + 2]
+
+                delay, reply = self.instrument.handle(request, now=time.monotonic() - self.started)
+                time.sleep(delay)
+                if reply is not None:
+                    os.write(self.master, reply)
+
+
+if __name__ == "__main__":
+    server = PtyInstrumentServer()
+    print("Simulated TM50 listening on " + server.start() + ", set USB_PORT in main.py to this path")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,149 @@
+"""
+Instrument health sampled between sets instead of with every aim: internal temperature, battery capacity and power
+source, EDM signal intensity and ATR lock status. The handler samples once before the first set and then after
+every full set once TELEMETRY_INTERVAL has passed, before going home, so the signal is always that of the last aim
+of the set and comparable from set to set. All requests of a sample are issued as one pipeline.
+
+Samples are kept in a fixed size ring buffer, the records of an aim take the internal temperature of the latest
+sample instead of asking the instrument again. Every sample is logged with its values as fields, so the series is
+in the uploaded logs as well:
+
+    telemetry = Telemetry()
+    telemetry.sample(geocom)
+    temperature, rc = telemetry.temperature()
+    telemetry.buffer.series()["battery"]
+
+A warning is logged once when the battery runs low, the signal gets weak or the temperature leaves the operating
+range, and once again when the value is back.
+"""
+
+import time
+
+import numpy as np
+
+from geocom_dicts import *
+from instrumentation import metrics as default_metrics
+from logger import log
+
+
+TELEMETRY_INTERVAL = 5*60  # s between samples
+BUFFER_SIZE = 4096  # samples kept, two weeks at TELEMETRY_INTERVAL
+LOW_BATTERY = 20  # %
+LOW_SIGNAL = 30  # % of EDM signal intensity on the last aim of the set
+TEMPERATURE_RANGE = (-20.0, 50.0)  # °C, operating range of the TM50
+
+SAMPLE_DTYPE = np.dtype([
+    ("time", np.float64),  # seconds since epoch
+    ("temperature", np.float64),  # °C, NaN if not read
+    ("battery", np.float64),  # % of capacity, NaN if not read
+    ("power_source", np.int8),  # CSV_POWER_PATH, -1 if not read
+    ("signal", np.float64),  # % of EDM signal intensity, NaN if not read
+    ("lock_status", np.int8),  # MOT_LOCK_STATUS, -1 if not read
+    ("rc_temperature", np.int32),  # return code of CSV_GetIntTemp
+])
+
+
+class TelemetryBuffer:
+    """
+    Ring buffer of the last size samples, the oldest sample is overwritten once it is full.
+    """
+    def __init__(self, size=BUFFER_SIZE):
+        self.samples = np.zeros(size, dtype=SAMPLE_DTYPE)
+        self.next = 0  # index the next sample is written to
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, sample):
+        # sample: tuple in the order of SAMPLE_DTYPE
+        self.samples[self.next] = sample
+        self.next = (self.next + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+
+    def latest(self):
+        return self.samples[self.next - 1] if self.count else None
+
+    def series(self):
+        # copy of the samples in chronological order
+        if self.count < len(self.samples):
+            return self.samples[:self.count].copy()
+        return np.concatenate((self.samples[self.next:], self.samples[:self.next]))
+
+    def at(self, timestamp):
+        # latest sample taken at or before timestamp, None if there is none
+        series = self.series()
+        i = np.searchsorted(series["time"], timestamp, side="right") - 1
+        return series[i] if i >= 0 else None
+
+
+class Telemetry:
+    def __init__(self, interval=TELEMETRY_INTERVAL, buffer_size=BUFFER_SIZE, metrics=default_metrics):
+        self.interval = interval
+        self.metrics = metrics
+        self.buffer = TelemetryBuffer(buffer_size)
+        self.last_sample_clock = None  # clock of the SerialConnection at the last sample
+        self.warnings = set()  # names of the warnings currently raised
+
+    def due(self, clock):
+        return self.last_sample_clock is None or clock - self.last_sample_clock >= self.interval
+
+    def sample(self, geocom):
+        """
+        Reads all health values in one pipeline and appends them to the buffer. Values the instrument did not
+        deliver are stored as NaN or -1.
+        :return: False if the instrument did not answer at all
+        """
+        self.last_sample_clock = geocom.sercon.clock()
+        (temperature_rsp, power_rsp, lock_rsp, _, signal_rsp, _) = geocom.pipeline(
+            ("CSV_GetIntTemp", ),
+            ("CSV_CheckPower", ),
+            ("MOT_ReadLockStatus", ),
+            ("TMC_DoMeasure", TMC_MEASURE_PRG["TMC_SIGNAL"], TMC_INCLINE_PRG["TMC_AUTO_INC"]),
+            ("TMC_GetSignal", ),
+            ("TMC_DoMeasure", TMC_MEASURE_PRG["TMC_CLEAR"], TMC_INCLINE_PRG["TMC_AUTO_INC"]))
+        if not any((temperature_rsp, power_rsp, lock_rsp, signal_rsp)):
+            log.error("Telemetry sample failed, no response")
+            return False
+
+        def value(rsp, field, missing):
+            return getattr(rsp, field) if rsp and rsp.ok else missing
+
+        sample = (time.time(), value(temperature_rsp, "temperature", np.nan), value(power_rsp, "capacity", np.nan),
+                  value(power_rsp, "active_power", -1), value(signal_rsp, "intensity", np.nan),
+                  value(lock_rsp, "lock_status", -1),
+                  temperature_rsp.rc if temperature_rsp else GRC["GRC_UNDEFINED"])
+        self.buffer.append(sample)
+        self.metrics.count("telemetry_samples")
+        log.info("Telemetry", **{name: sample[i] for i, name in enumerate(SAMPLE_DTYPE.names[1:-1], 1)})
+        self.check(self.buffer.latest())
+        return True
+
+    def temperature(self):
+        """
+        :return: (internal temperature in °C, return code) of the latest sample, (NaN, GRC_UNDEFINED) before the
+            first sample
+        """
+        latest = self.buffer.latest()
+        if latest is None:
+            return float("nan"), GRC["GRC_UNDEFINED"]
+        return float(latest["temperature"]), int(latest["rc_temperature"])
+
+    def check(self, sample):
+        # comparisons with NaN are False, values not read raise nothing
+        on_battery = sample["power_source"] != CSV_POWER_PATH["CSV_EXTERNAL_POWER"]
+        temperature = sample["temperature"]
+        conditions = {
+            "low battery": on_battery and sample["battery"] < LOW_BATTERY,
+            "weak EDM signal": sample["signal"] < LOW_SIGNAL,
+            "temperature out of range": temperature < TEMPERATURE_RANGE[0] or temperature > TEMPERATURE_RANGE[1],
+        }
+        for name, active in conditions.items():
+            if active and name not in self.warnings:
+                self.warnings.add(name)
+                self.metrics.count("telemetry_warnings")
+                log.warning("Instrument health: " + name, battery=sample["battery"], signal=sample["signal"],
+                            temperature=sample["temperature"])
+            elif not active and name in self.warnings:
+                self.warnings.discard(name)
+                log.info("Instrument health: " + name + " cleared")
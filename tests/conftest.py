@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionstart(session):
+    # the logger creates logs/ in the working directory when first imported, keep it out of the repository and
+    # write to it by its absolute path while the tests change the working directory
+    os.chdir(tempfile.mkdtemp(prefix="tm50_tests_"))
+    from logger import log
+    log.folder = os.path.abspath(log.folder) + "/"
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # measurement folders, queue and checkpoint files are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,77 @@
+import math as m
+
+import pytest
+
+from geocom import SerialConnection, GeoCom, MAX_TRANSACTION_ID
+from geocom_dicts import GRC, TMC_INCLINE_PRG
+from geocom_rpc import RPCS
+from instrumentation import Metrics
+from simulator import SimulatedTM50, VirtualTimeTransport
+
+GET_ANGLE5 = RPCS["TMC_GetAngle5"]
+AUTO_INC = TMC_INCLINE_PRG["TMC_AUTO_INC"]
+
+
+def connect(use_transaction_ids=True, **instrument):
+    transport = VirtualTimeTransport(SimulatedTM50(**instrument))
+    return SerialConnection("test", transport=transport, use_transaction_ids=use_transaction_ids,
+                            metrics=Metrics("metrics/")), transport
+
+
+def test_transaction_ids_cycle():
+    sercon, _ = connect()
+    ids = [sercon.tag_transaction_id(GET_ANGLE5.encode(AUTO_INC)).split(':')[0].split(',')[2]
+           for _ in range(MAX_TRANSACTION_ID + 2)]
+    assert ids == [str(i) for i in range(1, MAX_TRANSACTION_ID + 1)] + ["1", "2"]
+
+
+def test_request_without_parameters_is_tagged():
+    sercon, _ = connect()
+    assert sercon.tag_transaction_id("%R1Q,5011:\r\n") == "%R1Q,5011,1:\r\n"
+
+
+def test_reply_with_other_transaction_id_is_discarded():
+    sercon, transport = connect()
+    assert sercon.send(GET_ANGLE5.encode(AUTO_INC))
+    transport.rx_buffer += b"%R1P,0,5:0,1.0,2.0\r\nnoise\r\n"  # reply to an earlier request and line noise
+    reply = sercon.receive(GET_ANGLE5.decode, timeout=5)
+    assert reply.ok
+    assert reply.v == pytest.approx(m.pi/2, abs=1e-4)  # the instrument is still in its start position
+
+
+def test_late_reply_of_timed_out_request_is_discarded():
+    sercon, transport = connect(latency=3.0)
+    sercon.send(GET_ANGLE5.encode(AUTO_INC))
+    assert sercon.receive(GET_ANGLE5.decode, timeout=1) is False
+    assert sercon.timeouts == 1
+
+    transport.instrument.error_codes[2107] = GRC["GRC_TMC_BUSY"]  # tells the second reply from the first
+    sercon.send(GET_ANGLE5.encode(AUTO_INC))
+    reply = sercon.receive(GET_ANGLE5.decode, timeout=10)
+    assert reply.rc == GRC["GRC_TMC_BUSY"]
+    assert sercon.rx_buffer == b""
+
+
+def test_without_transaction_ids_buffered_replies_are_dropped_before_sending():
+    sercon, transport = connect(use_transaction_ids=False)
+    transport.rx_buffer += b"%R1P,0,0:0,1.0,2.0\r\n"
+    sercon.send(GET_ANGLE5.encode(AUTO_INC))
+    assert sercon.receive(GET_ANGLE5.decode, timeout=5).v == pytest.approx(m.pi/2, abs=1e-4)
+
+
+def test_geocom_call_records_metrics():
+    sercon, _ = connect()
+    geocom = GeoCom(sercon)
+    reply = geocom.TMC_GetAngle5(AUTO_INC)
+    assert reply.ok and reply.v == pytest.approx(m.pi/2, abs=1e-4)
+    assert geocom.CSV_GetIntTemp().ok
+    rpcs = sercon.metrics.summary()["rpcs"]
+    assert sum(rpc["duration"]["count"] for rpc in rpcs.values()) == 2
+
+
+def test_geocom_retries_after_dropped_reply():
+    sercon, transport = connect(drop_rate=1.0)
+    geocom = GeoCom(sercon)
+    assert geocom.TMC_GetAngle5(AUTO_INC) is False
+    assert sercon.timeouts == 3
+    assert transport.instrument.stats["requests"] == 3
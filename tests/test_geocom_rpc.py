@@ -0,0 +1,61 @@
+import math as m
+
+import pytest
+
+from geocom_dicts import GRC, TMC_INCLINE_PRG, AUT_POSMODE, AUT_ATRMODE, ON_OFF_TYPE
+from geocom_rpc import RPCS, GON2RAD
+
+
+def test_encode_enumerated_parameter():
+    assert RPCS["TMC_GetAngle1"].encode(TMC_INCLINE_PRG["TMC_AUTO_INC"]) == "%R1Q,2003:1\r\n"
+
+
+def test_encode_angles_in_rad_and_default():
+    request = RPCS["AUT_MakePositioning"].encode(100.0, 50.0, AUT_POSMODE["AUT_NORMAL"], AUT_ATRMODE["AUT_POSITION"])
+    assert request == "%R1Q,9027:" + str(100.0*GON2RAD) + "," + str(50.0*GON2RAD) + ",0,0,0\r\n"
+
+
+def test_encode_without_parameters():
+    assert RPCS["CSV_GetIntTemp"].encode() == "%R1Q,5011:\r\n"
+
+
+def test_encode_keeps_types_apart():
+    # 1, 1.0 and True are equal keys of the cache but formatted differently
+    rpc = RPCS["TMC_SetAtmPpm"]
+    assert rpc.encode(1.0) == "%R1Q,2148:1.0\r\n"
+    assert rpc.encode(1) == "%R1Q,2148:1\r\n"
+    assert rpc.encode(1.0) == "%R1Q,2148:1.0\r\n"
+
+
+def test_encode_rejects_invalid_values():
+    with pytest.raises(ValueError, match="switch 5 is not valid"):
+        RPCS["TMC_SetInclineSwitch"].encode(5)
+    with pytest.raises(TypeError, match="takes the arguments switch, got 2"):
+        RPCS["TMC_SetInclineSwitch"].encode(ON_OFF_TYPE["ON"], ON_OFF_TYPE["ON"])
+    with pytest.raises(TypeError):
+        RPCS["TMC_GetFullMeas"].encode()
+
+
+def test_decode_typed_fields():
+    reply = RPCS["TMC_GetAngle1"].decode("0,1.2,1.5,0.0001,42,0.00001,-0.00002,0.0001,43,0")
+    assert reply.ok
+    assert (reply.rc, reply.hz, reply.v, reply.angle_time, reply.cross_incline, reply.face) == \
+           (0, 1.2, 1.5, 42, 1e-05, 0)
+    assert type(reply.angle_time) is int and type(reply.hz) is float
+    assert reply[1] == reply.hz
+
+
+def test_decode_return_code_only():
+    reply = RPCS["TMC_GetAngle5"].decode(str(GRC["GRC_TMC_BUSY"]))
+    assert tuple(reply) == (GRC["GRC_TMC_BUSY"], None, None)
+    assert not reply.ok
+
+
+@pytest.mark.parametrize("body", ["0,1.2", "0,1.2,1.5,7", "0,1.2,x", "", "0,1.2,1.5.1"])
+def test_decode_malformed_reply(body):
+    assert RPCS["TMC_GetAngle5"].decode(body) is False
+
+
+def test_reply_constructor_for_simulated_replies():
+    reply = RPCS["TMC_GetAngle5"].reply(GRC["GRC_OK"], m.pi, m.pi/2)
+    assert reply.ok and reply.hz == m.pi
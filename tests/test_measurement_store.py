@@ -0,0 +1,131 @@
+import os
+import time
+
+from measurement_store import MeasurementStore, MeasurementRecord, read_records, FILE_MAGIC, FRAME, \
+    JOURNAL_FILE_NAME, NULL_SLOPE_DIST, NULL_ANGLES, frame
+
+
+def make_record(name="P1", timestamp=None, rc_full_measure=0):
+    return MeasurementRecord(time.time() if timestamp is None else timestamp, name, 1.0, 1.1, 1.5, 1.6, 20.5,
+                             0.0001, -0.0002, 21.5, rc_full_measure=rc_full_measure)
+
+
+def test_pack_unpack_round_trip():
+    record = make_record("Pü1", rc_full_measure=1284)
+    record.seq = 7
+    unpacked = MeasurementRecord.unpack(record.pack())
+    assert vars(unpacked) == vars(record)
+    assert unpacked.null_mask == NULL_SLOPE_DIST
+
+
+def test_null_mask_from_return_codes():
+    assert make_record().null_mask == 0
+    record = MeasurementRecord(0, "P1", 0, 0, 0, 0, 0, 0, 0, 0, rc_angle=1283)
+    assert record.null_mask == NULL_ANGLES
+    assert "NaN" in record.to_text_line()
+
+
+def test_committed_set_reaches_day_files():
+    store = MeasurementStore("measurements/")
+    records = [make_record("P" + str(i)) for i in range(3)]
+    for record in records:
+        store.append(record)
+    store.commit_set()
+    store.close()
+
+    day = records[0].day()
+    assert [record.aim_name for record in read_records("measurements/" + day + ".bin")] == ["P0", "P1", "P2"]
+    assert len(open("measurements/" + day + ".txt").readlines()) == 3
+    assert os.path.getsize("measurements/" + JOURNAL_FILE_NAME) == 0
+
+
+def test_journal_replayed_after_crash():
+    store = MeasurementStore("measurements/")
+    store.append(make_record("P1"))
+    store.commit_set()
+    store.append(make_record("P2"))
+    store.append(make_record("P3"))
+    store.journal.close()  # the process dies before the set is committed
+
+    store = MeasurementStore("measurements/")
+    records = list(read_records(store.bin_path(make_record().day())))
+    assert [record.aim_name for record in records] == ["P1", "P2", "P3"]
+    assert [record.seq for record in records] == [1, 2, 3]
+    assert store.seq == 3
+    store.close()
+
+
+def test_journal_records_already_in_day_file_are_skipped():
+    store = MeasurementStore("measurements/")
+    store.append(make_record("P1"))
+    journal = open(store.journal_path, 'rb').read()
+    store.write_to_day_files(store.uncommitted)  # crash after the day file was written, before the journal was cut
+    store.close_day()
+    store.journal.close()
+
+    with open(store.journal_path, 'wb') as f:
+        f.write(journal)
+    store = MeasurementStore("measurements/")
+    assert [record.aim_name for record in read_records(store.bin_path(make_record().day()))] == ["P1"]
+    store.close()
+
+
+def test_torn_journal_frame_is_cut_off():
+    store = MeasurementStore("measurements/")
+    store.append(make_record("P1"))
+    store.append(make_record("P2"))
+    store.journal.close()
+    with open(store.journal_path, 'r+b') as f:
+        f.truncate(os.path.getsize(store.journal_path) - 3)  # second frame only half written
+
+    store = MeasurementStore("measurements/")
+    assert [record.aim_name for record in read_records(store.bin_path(make_record().day()))] == ["P1"]
+    store.close()
+
+
+def test_corrupt_frame_in_day_file_is_truncated_on_append():
+    record = make_record("P1")
+    store = MeasurementStore("measurements/")
+    store.append(record)
+    store.close()
+    path = store.bin_path(record.day())
+    valid_size = os.path.getsize(path)
+
+    payload = make_record("P2").pack()
+    broken = bytearray(frame(payload))
+    broken[FRAME.size] ^= 0xff  # crc no longer matches
+    with open(path, 'ab') as f:
+        f.write(broken)
+    assert MeasurementStore.valid_size(path) == valid_size
+
+    store = MeasurementStore("measurements/")
+    store.append(make_record("P3"))
+    store.close()
+    assert [record.aim_name for record in read_records(path)] == ["P1", "P3"]
+
+
+def test_unreadable_day_file_is_moved_aside():
+    record = make_record("P1")
+    os.makedirs("measurements/")
+    with open("measurements/" + record.day() + ".bin", 'wb') as f:
+        f.write(b"not a measurement file")
+
+    store = MeasurementStore("measurements/")
+    store.append(record)
+    store.close()
+    path = store.bin_path(record.day())
+    assert open(path + ".corrupt", 'rb').read() == b"not a measurement file"
+    assert open(path, 'rb').read(len(FILE_MAGIC)) == FILE_MAGIC
+    assert [record.aim_name for record in read_records(path)] == ["P1"]
+
+
+def test_seq_continues_from_archive():
+    store = MeasurementStore("measurements/")
+    for name in ("P1", "P2"):
+        store.append(make_record(name))
+    store.close()
+
+    store = MeasurementStore("measurements/")
+    store.append(make_record("P3"))
+    store.close()
+    assert [record.seq for record in read_records(store.bin_path(make_record().day()))] == [1, 2, 3]
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+
+import pytest
+
+from aim_table import Aim, AimTable
+from auto_measure_handler import HandlerAutoMeasurement
+from geocom import SerialConnection, GeoCom
+from geocom_dicts import GRC
+from geocom_rpc import RPCS
+from instrumentation import Metrics
+from measurement_store import MeasurementStore, MeasurementRecord
+from recovery import SetCheckpoint, classify, RETRY_NOW, RETRY_LATER, REINITIALIZE
+from simulator import SimulatedTM50, SimulatedTarget, VirtualTimeTransport
+from uploader import UploadWorker
+
+
+def make_aims():
+    # odd aims are measured every second full set only, P0 and P1 in the priority sets as well
+    return AimTable.from_aims([Aim("P" + str(i), i*40, 90 + i, 1, 3, priority=i < 2, every=1 + i % 2)
+                               for i in range(6)]).with_second_circle()
+
+
+def make_handler():
+    aims = make_aims()
+    targets = [SimulatedTarget(aim.hz, aim.v, 20.0 + i) for i, aim in enumerate(aims[:6])]
+    sercon = SerialConnection("test", transport=VirtualTimeTransport(SimulatedTM50(targets=targets)),
+                              metrics=Metrics("metrics/"))
+    handler = HandlerAutoMeasurement(GeoCom(sercon), uploader=UploadWorker(queue_file="queue.json"), name="test")
+    handler.aims = aims
+    assert handler.initialize()
+    return handler
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(handler, count):
+    # the process dies once count aims of the set are checkpointed
+    mark_done = handler.checkpoint.mark_done
+
+    def mark_done_and_die(index, record):
+        mark_done(index, record)
+        if len(handler.checkpoint.done()) >= count:
+            raise Interrupted
+
+    handler.checkpoint.mark_done = mark_done_and_die
+
+
+@pytest.mark.parametrize("rc, action", [
+    (GRC["GRC_OK"], None),
+    (GRC["GRC_TMC_NO_FULL_CORRECTION"], None),
+    (GRC["GRC_AUT_TIMEOUT"], RETRY_NOW),
+    (GRC["GRC_AUT_NO_TARGET"], RETRY_LATER),
+    (GRC["GRC_FATAL"], REINITIALIZE),
+])
+def test_classify(rc, action):
+    assert classify(RPCS["TMC_GetAngle5"].reply(rc, 1.0, 1.5)) == action
+
+
+def test_classify_missing_reply():
+    assert classify(False) == REINITIALIZE
+
+
+def test_checkpoint_resumes_measured_records():
+    aims = make_aims()
+    store = MeasurementStore("measurements/")
+    checkpoint = SetCheckpoint("measurements/", max_age=600)
+    checkpoint.start(aims, True, sets_completed=4)
+    for index in (0, 2):
+        record = MeasurementRecord(time.time(), aims.aim(index).name, 1.0, 1.0, 1.5, 1.5, 20.0, 0, 0, 20.0)
+        store.append(record)
+        checkpoint.mark_done(index, record)
+    store.commit_set()
+
+    checkpoint = SetCheckpoint("measurements/", max_age=600)
+    assert checkpoint.interrupted() == (True, 4)
+    records = checkpoint.resume(aims, True)
+    assert sorted(record.aim_name for record in records) == ["P0", "P2"]
+    assert checkpoint.done() == {0, 2}
+    store.close()
+
+
+def test_checkpoint_of_other_aims_is_not_resumed():
+    checkpoint = SetCheckpoint(".", max_age=600)
+    checkpoint.start(make_aims(), True)
+    assert checkpoint.resume(make_aims()[:4], True) is None
+    assert checkpoint.resume(make_aims(), False) is None
+
+
+def test_old_or_unreadable_checkpoint_is_removed():
+    checkpoint = SetCheckpoint(".", max_age=600)
+    checkpoint.start(make_aims(), True)
+    checkpoint.state["started"] -= 601
+    checkpoint.save()
+    assert checkpoint.interrupted() is None
+    assert not os.path.isfile(checkpoint.path)
+
+    with open(checkpoint.path, 'w') as f:
+        f.write("{")
+    assert checkpoint.interrupted() is None
+    assert not os.path.isfile(checkpoint.path)
+
+
+def test_interrupted_full_set_resumes_with_its_sets_completed():
+    handler = make_handler()
+    handler.sets_completed = 3  # the odd aims are not due
+    interrupt_after(handler, 3)
+    with pytest.raises(Interrupted):
+        handler.run(interval=600, set_amount=1, align=False)
+    handler.store.close()
+    with open(handler.checkpoint.path) as f:
+        state = json.load(f)
+    assert (state["full_set"], state["sets_completed"], len(state["aims"])) == (True, 3, 6)
+
+    handler = make_handler()
+    measured = []
+    measure_set = handler.measure_set
+    handler.measure_set = lambda aims, full_set, *args: measured.append((len(aims), full_set)) or \
+        measure_set(aims, full_set, *args)
+    assert handler.run(interval=600, set_amount=1, align=False)
+    handler.close()
+    assert measured == [(6, True)]
+    assert handler.sets_completed == 4
+    assert not os.path.isfile(handler.checkpoint.path)
+
+
+def test_interrupted_priority_set_resumes_as_priority_set():
+    handler = make_handler()
+    checkpoint = handler.checkpoint
+    checkpoint.start(handler.aims.select(handler.aims.column("priority")), False, sets_completed=2)
+    handler.store.close()
+
+    handler = make_handler()
+    measured = []
+    measure_set = handler.measure_set
+    handler.measure_set = lambda aims, full_set, *args: measured.append((len(aims), full_set)) or \
+        measure_set(aims, full_set, *args)
+    handler.run(interval=600, set_amount=1, priority_interval=300, align=False)
+    handler.close()
+    assert measured[0] == (4, False)
+    assert handler.sets_completed == 3
@@ -0,0 +1,119 @@
+import pytest
+
+from instrumentation import Metrics
+from scheduler import SetScheduler
+from simulator import VirtualTimeTransport
+
+INTERVAL = 900
+START = 1888888*INTERVAL + 100  # 100 s after a quarter hour
+
+
+def make_scheduler(start=START, **kwargs):
+    transport = VirtualTimeTransport()
+    transport.wall_offset = start - transport.now
+    scheduler = SetScheduler(INTERVAL, clock=transport.clock, sleep=transport.sleep, wall=transport.wall,
+                             metrics=Metrics("metrics/"), **kwargs)
+    return scheduler, transport
+
+
+def test_first_set_at_next_multiple_of_interval():
+    scheduler, transport = make_scheduler()
+    slot = scheduler.wait()
+    assert (slot.index, slot.full) == (0, True)
+    assert slot.planned_wall == START - 100 + INTERVAL
+    assert transport.wall() == slot.planned_wall
+    assert scheduler.metrics.summary()["phases"]["set_sleep"]["sum"] == INTERVAL - 100
+
+
+def test_without_align_first_set_right_away():
+    scheduler, transport = make_scheduler(align=False)
+    assert scheduler.wait().planned_wall == START
+    assert transport.wall() == START
+
+
+def test_set_length_does_not_shift_epochs():
+    scheduler, transport = make_scheduler()
+    first = scheduler.wait()
+    transport.sleep(123.4)  # the set
+    second = scheduler.wait()
+    assert second.index == 1
+    assert second.planned_wall - first.planned_wall == INTERVAL
+    assert transport.clock() == second.planned
+
+
+def test_skip_drops_missed_epochs():
+    scheduler, transport = make_scheduler(overrun_policy="skip")
+    first = scheduler.wait()
+    transport.sleep(2.5*INTERVAL)
+    slot = scheduler.wait()
+    assert slot.index == 3
+    assert slot.planned == first.planned + 3*INTERVAL
+
+
+def test_catch_up_measures_missed_epochs_right_away():
+    scheduler, transport = make_scheduler(overrun_policy="catch_up")
+    scheduler.wait()
+    transport.sleep(2.5*INTERVAL)
+    late = transport.clock()
+    assert [scheduler.wait().index for _ in range(2)] == [1, 2]
+    assert transport.clock() == late
+    assert scheduler.wait().index == 3
+    assert transport.clock() > late
+
+
+def test_shift_moves_the_grid_to_the_late_start():
+    scheduler, transport = make_scheduler(overrun_policy="shift")
+    scheduler.wait()
+    transport.sleep(INTERVAL + 60)
+    shifted = scheduler.wait()
+    assert shifted.planned == transport.clock()
+    assert scheduler.wait().planned == shifted.planned + INTERVAL
+
+
+def test_priority_slots_between_full_sets():
+    scheduler, _ = make_scheduler(priority_interval=300)
+    assert [scheduler.wait().full for _ in range(7)] == [True, False, False, True, False, False, True]
+
+
+def test_realign_after_system_time_jump():
+    scheduler, transport = make_scheduler(priority_interval=300)
+    scheduler.wait()
+    scheduler.wait()  # the priority slot at :05
+    transport.wall_offset += 3600 + 420  # NTP sets the time
+    slot = scheduler.wait()
+    assert slot.planned_wall % 300 == 0
+    assert transport.wall() == slot.planned_wall
+    # a full set stays on the quarter hours of the new time
+    assert slot.full == (slot.planned_wall % INTERVAL == 0)
+    assert (scheduler.wait().planned_wall - slot.planned_wall) == 300
+
+
+def test_small_drift_is_ignored():
+    scheduler, transport = make_scheduler()
+    first = scheduler.wait()
+    transport.wall_offset += 0.5
+    assert scheduler.wait().planned == first.planned + INTERVAL
+
+
+def test_realign_without_align_keeps_the_monotonic_grid():
+    scheduler, transport = make_scheduler(align=False)
+    first = scheduler.wait()
+    transport.wall_offset += 1000
+    slot = scheduler.wait()
+    assert slot.planned == first.planned + INTERVAL
+    assert slot.planned_wall == first.planned_wall + INTERVAL + 1000
+
+
+def test_wait_returns_none_when_woken_early():
+    transport = VirtualTimeTransport()
+    scheduler = SetScheduler(INTERVAL, clock=transport.clock, sleep=lambda seconds: None, wall=transport.wall,
+                             metrics=Metrics("metrics/"))
+    assert scheduler.wait() is None
+    assert scheduler.index == 0
+
+
+@pytest.mark.parametrize("kwargs", [{"overrun_policy": "later"}, {"priority_interval": 400},
+                                    {"priority_interval": 0}])
+def test_invalid_settings(kwargs):
+    with pytest.raises(ValueError):
+        SetScheduler(INTERVAL, **kwargs)
@@ -0,0 +1,101 @@
+import pytest
+
+from aim_table import Aim
+from geocom_dicts import BAP_TARGET_TYPE, PrismType
+from setup_file import read_setup_file, write_setup_file, SetupFileError
+
+
+def write(text, path="aims.csv"):
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def errors(text):
+    with pytest.raises(SetupFileError) as info:
+        read_setup_file(write(text))
+    return info.value.errors
+
+
+def test_read_all_columns():
+    aims = read_setup_file(write("# monitoring setup\n"
+                                 "name,hz,v,target,prism,group,every,atr,retries,face_one_only,priority\n"
+                                 "P1,12.3456,98.7654,0,3,north wall,1,1,,0,1\n"
+                                 "\n"
+                                 "R7,250.1,101.2,1,-1,,4,0,2,1,0\n"))
+    assert aims.names_in_order() == ["P1", "R7"]
+    p1, r7 = aims
+    assert (p1.hz, p1.v, p1.target, p1.prism, p1.group, p1.priority) == (12.3456, 98.7654, 0, 3, "north wall", True)
+    assert (r7.every, r7.atr, r7.retries, r7.face_one_only, r7.group) == (4, False, 2, True, "")
+    assert p1.retries is None
+
+
+def test_defaults_of_left_out_columns():
+    aim, = read_setup_file(write("name,hz,v,target\nP1,1,2,1\n"))
+    assert (aim.prism, aim.every, aim.atr, aim.retries, aim.face_one_only, aim.priority) == \
+           (-1, 1, True, None, False, False)
+
+
+def test_legacy_format():
+    aims = read_setup_file(write("P1 12.3 98.7 0 3\nP2 200 100 1 -1 1\n"))
+    assert aims.names_in_order() == ["P1", "P2"]
+    assert [aim.priority for aim in aims] == [False, True]
+
+
+def test_empty_file():
+    assert len(read_setup_file(write("# nothing yet\n"))) == 0
+
+
+def test_every_invalid_line_is_reported():
+    found = errors("name,hz,v,target,prism\n"
+                   "P1,400,100,0,3\n"
+                   "P2,10,0,0,3\n"
+                   "P3,10,100,7,3\n"
+                   "P4,10,100,0,99\n"
+                   "P5,10,100,0,3\n"
+                   "P5,20,100,0,3\n"
+                   "P 6,10,100,0,3\n"
+                   "P7,ten,100,0,3\n"
+                   ",10,100,0,3\n"
+                   "P8,10,100\n")
+    assert [line for line, _ in found] == [2, 3, 4, 5, 7, 8, 9, 10, 11]
+    messages = dict(found)
+    assert "hz 400.0 not in [0, 400)" in messages[2]
+    assert "v 0.0 not in (0, 400)" in messages[3]
+    assert "target 7" in messages[4]
+    assert "prism" in messages[5]
+    assert "already used in line 6" in messages[7]
+    assert "whitespace" in messages[8]
+    assert "hz 'ten' is not valid" in messages[9]
+    assert "name is missing" in messages[10]
+    assert "target is missing" in messages[11]
+
+
+@pytest.mark.parametrize("row, message", [
+    ("P1,1,100,1,,,0", "every 0 not in [1, 1000]"),
+    ("P1,1,100,1,,,1,2", "atr '2' is not valid"),
+    ("P1,1,100,1,,,1,1,101", "retries 101"),
+    ("P1,1,100,1,,,1,1,,1,0,extra", "more fields than columns"),
+])
+def test_invalid_optional_columns(row, message):
+    (line, text), = errors("name,hz,v,target,prism,group,every,atr,retries,face_one_only,priority\n" + row + "\n")
+    assert line == 2 and message in text
+
+
+def test_invalid_header():
+    assert errors("# header\nname,hz,target,colour\nP1,1,1,red\n") == [(2, "unknown columns colour"),
+                                                                        (2, "missing columns v")]
+
+
+def test_error_message_names_file_and_line():
+    with pytest.raises(SetupFileError, match=r"aims\.csv:2: hz 400\.0 not in"):
+        read_setup_file(write("name,hz,v,target,prism\nP1,400,100,0,3\n"))
+
+
+def test_write_read_round_trip():
+    aims = [Aim("P1", 12.3456789, 98.7, BAP_TARGET_TYPE["BAP_REFL_USE"], PrismType["BAP_PRISM_360"], priority=True,
+                group="roof", every=3, retries=2),
+            Aim("R2", 399.999, 101.0, BAP_TARGET_TYPE["BAP_REFL_LESS"], -1, atr=False, face_one_only=True)]
+    write_setup_file("aims.csv", aims)
+    assert [tuple(row) for row in read_setup_file("aims.csv")] == \
+           [tuple(getattr(aim, field) for field in Aim.__slots__) for aim in aims]
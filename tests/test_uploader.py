@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+from uploader import UploadWorker, LocalSftpStandIn
+
+
+def write(path, text, mode='w'):
+    with open(path, mode) as f:
+        f.write(text)
+    return path
+
+
+def make_worker(**kwargs):
+    return UploadWorker(connect=lambda: LocalSftpStandIn("remote/"), queue_file="queue.json", **kwargs)
+
+
+def test_upload_and_append_only_new_bytes():
+    write("day.txt", "a\n")
+    worker = make_worker()
+    worker.start()
+    worker.enqueue("day.txt", "/measurements")
+    assert worker.idle.wait(5)
+    assert open("remote/measurements/day.txt").read() == "a\n"
+    assert worker.is_uploaded("day.txt")
+
+    write("day.txt", "b\n", 'a')
+    assert not worker.is_uploaded("day.txt")
+    worker.enqueue("day.txt", "/measurements")
+    worker.stop(timeout=5)
+    assert open("remote/measurements/day.txt").read() == "a\nb\n"
+    assert worker.is_uploaded("./day.txt")
+    assert json.load(open("queue.json"))["pending"] == []
+
+
+def test_rewritten_file_is_sent_whole():
+    os.makedirs("remote/logs")
+    write("remote/logs/day.txt", "old and longer\n")
+    write("day.txt", "new\n")
+    worker = make_worker()
+    worker.start()
+    worker.enqueue("day.txt", "/logs")
+    worker.stop(timeout=5)
+    assert open("remote/logs/day.txt").read() == "new\n"
+
+
+def test_pending_files_survive_a_restart():
+    write("day.txt", "a\n")
+    worker = make_worker()  # never started, like a process stopped before the upload
+    worker.enqueue("day.txt", "/measurements")
+    assert json.load(open("queue.json"))["pending"] == [["day.txt", "/measurements"]]
+
+    worker = make_worker()
+    assert worker.pending == {"day.txt": "/measurements"}
+    assert not worker.is_uploaded("day.txt")
+    worker.start()
+    worker.stop(timeout=5)
+    assert open("remote/measurements/day.txt").read() == "a\n"
+    assert worker.is_uploaded("day.txt")
+
+
+def test_queue_file_of_older_versions_and_unreadable_queue():
+    write("queue.json", json.dumps([["day.txt", "/logs"]]))
+    assert make_worker().pending == {"day.txt": "/logs"}
+    write("queue.json", "[[")
+    assert make_worker().pending == {}
+
+
+def test_enqueue_during_upload_keeps_the_file_queued():
+    write("day.txt", "a\n")
+    uploading, release = threading.Event(), threading.Event()
+
+    class SlowSession(LocalSftpStandIn):
+        def open(self, remote_path, mode='r'):
+            uploading.set()
+            release.wait(5)
+            return super().open(remote_path, mode)
+
+    worker = UploadWorker(connect=lambda: SlowSession("remote/"), queue_file="queue.json")
+    worker.start()
+    worker.enqueue("day.txt", "/measurements")
+    assert uploading.wait(5)
+    write("day.txt", "b\n", 'a')
+    worker.enqueue("day.txt", "/measurements")  # while the first upload is running
+    release.set()
+    worker.stop(timeout=5)
+    assert open("remote/measurements/day.txt").read() == "a\nb\n"
+    assert worker.is_uploaded("day.txt")
+
+
+def test_missing_file_is_dropped_from_the_queue():
+    worker = make_worker()
+    worker.start()
+    worker.enqueue("gone.txt", "/logs")
+    worker.stop(timeout=5)
+    assert worker.pending == {}
+    assert not worker.is_uploaded("gone.txt")
+
+
+def test_failed_connection_keeps_the_queue_and_retries():
+    write("day.txt", "a\n")
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("network unreachable")
+        return LocalSftpStandIn("remote/")
+
+    worker = UploadWorker(connect=connect, queue_file="queue.json", min_backoff=0.01)
+    worker.start()
+    worker.enqueue("day.txt", "/measurements")
+    worker.stop(timeout=5)
+    assert len(attempts) == 2
+    assert open("remote/measurements/day.txt").read() == "a\n"
+    assert worker.pending == {}
@@ -0,0 +1,123 @@
+import time
+
+
+# same values pyserial uses, so they can be passed through unchanged
+PARITY_NONE = 'N'
+STOPBITS_ONE = 1
+
+
+class TransportError(Exception):
+    pass
+
+
+class Transport:
+    """
+    Byte stream a SerialConnection talks GeoCOM over, the subset of the pyserial interface it relies on.
+    read blocks at most the transport timeout and returns b"" if nothing arrived.
+    """
+    timeout = 1
+
+    @property
+    def is_open(self):
+        raise NotImplementedError
+
+    @property
+    def in_waiting(self):
+        raise NotImplementedError
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def read(self, size=1):
+        raise NotImplementedError
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def clock(self):
+        # monotonic seconds, a replayed trace runs on the time of the trace instead, see serial_trace.py
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wall(self):
+        # seconds since epoch, advances with clock on a simulated clock
+        return time.time()
+
+    def reset_input_buffer(self):
+        while self.in_waiting:
+            self.read(self.in_waiting)
+
+    def readall(self):
+        # drains until the line stays quiet for one timeout
+        result = bytearray()
+        while True:
+            chunk = self.read(self.in_waiting or 1)
+            if not chunk:
+                return bytes(result)
+            result += chunk
+
+
+class PySerialTransport(Transport):
+    def __init__(self, port, baudrate=115200, parity=PARITY_NONE, stopbits=STOPBITS_ONE, timeout=1):
+        self.port = port
+        self.baudrate = baudrate
+        self.parity = parity
+        self.stopbits = stopbits
+        self.timeout = timeout
+
+        self.ser = None
+        self.serial_exception = Exception
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    @property
+    def in_waiting(self):
+        try:
+            return self.ser.in_waiting
+        except self.serial_exception as e:
+            raise TransportError(str(e))
+
+    def open(self):
+        import serial  # only needed when a real instrument is attached
+
+        self.serial_exception = serial.serialutil.SerialException
+        try:
+            self.ser = serial.Serial(self.port, baudrate=self.baudrate, parity=self.parity, stopbits=self.stopbits,
+                                     timeout=self.timeout)
+        except self.serial_exception as e:
+            raise TransportError(str(e))
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+
+    def read(self, size=1):
+        try:
+            return self.ser.read(size)
+        except self.serial_exception as e:
+            raise TransportError(str(e))
+
+    def write(self, data):
+        try:
+            return self.ser.write(data)
+        except self.serial_exception as e:
+            raise TransportError(str(e))
+
+    def reset_input_buffer(self):
+        try:
+            self.ser.reset_input_buffer()
+        except self.serial_exception as e:
+            raise TransportError(str(e))
+
+    def readall(self):
+        try:
+            return self.ser.readall()
+        except self.serial_exception as e:
+            raise TransportError(str(e))
@@ -0,0 +1,197 @@
+"""
+Background upload of measurement and log files. Files are queued with enqueue(), which returns at once. A worker
+thread keeps one SFTP session open and reconnects with exponential backoff when the network is down. It only
+sends the bytes appended since the last upload, resuming at the size of the remote file. The queue is persisted
+in upload_queue.json, so files still pending at shutdown are uploaded after the next start. The size every file had
+at its last complete upload is kept there as well, is_uploaded tells whether a file reached the server as it is now.
+"""
+
+import json
+import os
+import threading
+
+from logger import log
+from rotating_file import atomic_write
+
+
+SFTP_HOST = "matlab.tugraz.at"
+SFTP_USERNAME = "atraxoo"
+SFTP_PASSWORD = None  # enter password if no ssh key in authorized keys
+REMOTE_MEASUREMENT_FOLDER = "/home/a/atraxoo/Desktop/Sensorik/measurements"
+REMOTE_LOG_FOLDER = "/home/a/atraxoo/Desktop/Sensorik/logs"
+QUEUE_FILE = "upload_queue.json"
+CHUNK_SIZE = 64*1024
+
+
+def connect_sftp():
+    import pysftp  # only needed once something is uploaded
+
+    return pysftp.Connection(host=SFTP_HOST, username=SFTP_USERNAME, password=SFTP_PASSWORD)
+
+
+class LocalSftpStandIn:
+    """
+    Offers the part of pysftp.Connection the UploadWorker uses on a local directory, remote paths are placed below
+    root. For testing without a server: UploadWorker(connect=lambda: LocalSftpStandIn("remote/"))
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def stat(self, remote_path):
+        return os.stat(self.local_path(remote_path))
+
+    def open(self, remote_path, mode='r'):
+        return open(self.local_path(remote_path), mode)
+
+    def makedirs(self, remote_path):
+        os.makedirs(self.local_path(remote_path), exist_ok=True)
+
+    def close(self):
+        pass
+
+
+class UploadWorker(threading.Thread):
+    def __init__(self, connect=connect_sftp, queue_file=QUEUE_FILE, min_backoff=5, max_backoff=10*60):
+        """
+        :param connect: callable returning a session with stat, open, makedirs and close like pysftp.Connection
+        :param min_backoff: seconds to wait after the first failure, doubled with every further one up to max_backoff
+        """
+        super().__init__(daemon=True)
+        self.connect = connect
+        self.queue_file = queue_file
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.idle = threading.Event()
+        self.running = True
+        self.session = None
+        self.backoff = 0
+
+        self.pending = {}  # local path -> remote folder, in order of enqueueing
+        self.generations = {}  # local path -> number of its latest enqueue, a path enqueued during its upload stays
+        self.generation = 0
+        self.uploaded = {}  # normalized local path -> size at its last complete upload
+        if os.path.isfile(queue_file):
+            try:
+                with open(queue_file, 'r') as f:
+                    state = json.load(f)
+                if isinstance(state, list):
+                    state = {"pending": state}  # queue file of older versions
+                self.pending = dict(state["pending"])
+                self.uploaded = state.get("uploaded", {})
+            except (ValueError, KeyError, TypeError):
+                log.error("Upload queue " + queue_file + " unreadable, starting with an empty queue")
+
+    def enqueue(self, local_path, remote_folder):
+        with self.lock:
+            self.pending[local_path] = remote_folder
+            self.generation += 1
+            self.generations[local_path] = self.generation
+            self.save_queue()
+            self.idle.clear()
+        self.wake_up.set()
+
+    def is_uploaded(self, local_path):
+        """
+        :return: True if local_path is not queued and its last upload sent it at its current size
+        """
+        path = os.path.normpath(local_path)
+        with self.lock:
+            if any(os.path.normpath(pending) == path for pending in self.pending):
+                return False
+            size = self.uploaded.get(path)
+        return size is not None and os.path.isfile(path) and os.path.getsize(path) == size
+
+    def save_queue(self):
+        # sizes of files that are gone, e.g. compressed, are not kept
+        self.uploaded = {path: size for path, size in self.uploaded.items() if os.path.isfile(path)}
+        with atomic_write(self.queue_file) as f:
+            json.dump({"pending": list(self.pending.items()), "uploaded": self.uploaded}, f)
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                jobs = [(local_path, remote_folder, self.generations.get(local_path))
+                        for local_path, remote_folder in self.pending.items()]
+                if not jobs:
+                    self.idle.set()  # under the lock, a file enqueued right after clears it again
+            if not jobs:
+                self.wake_up.wait()
+                self.wake_up.clear()
+                continue
+
+            try:
+                if self.session is None:
+                    self.session = self.connect()
+                for local_path, remote_folder, generation in jobs:
+                    size = self.upload(local_path, remote_folder)
+                    with self.lock:
+                        if size is not None:
+                            self.uploaded[os.path.normpath(local_path)] = size
+                        if self.pending.get(local_path) == remote_folder \
+                                and self.generations.get(local_path) == generation:
+                            del self.pending[local_path]
+                            self.generations.pop(local_path, None)
+                            self.save_queue()
+                self.backoff = 0
+            except Exception as e:  # network errors come in many types from paramiko and socket
+                self.disconnect()
+                self.backoff = min(max(self.backoff*2, self.min_backoff), self.max_backoff)
+                log.error("Failed uploading file via SFTP (" + str(e) + "), retrying in " + str(self.backoff) + "s")
+                self.wake_up.wait(self.backoff)
+                self.wake_up.clear()
+
+    def upload(self, local_path, remote_folder):
+        """
+        :return: size of local_path that is on the server now, None if there is no such file
+        """
+        if not os.path.isfile(local_path):
+            log.warning("Not uploading missing file " + local_path)
+            return None
+        remote_path = remote_folder + '/' + os.path.basename(local_path)
+        local_size = os.path.getsize(local_path)
+        try:
+            remote_size = self.session.stat(remote_path).st_size
+        except (IOError, OSError):
+            remote_size = 0  # not uploaded yet
+            self.session.makedirs(remote_folder)
+
+        if remote_size == local_size:
+            return local_size
+        if remote_size > local_size:
+            remote_size = 0  # local file was rewritten, send it whole again
+
+        with open(local_path, 'rb') as local_file, \
+                self.session.open(remote_path, 'r+b' if remote_size else 'wb') as remote_file:
+            local_file.seek(remote_size)
+            remote_file.seek(remote_size)
+            while True:
+                chunk = local_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                remote_file.write(chunk)
+        log.info("Uploaded " + str(local_size - remote_size) + " bytes of " + local_path + " via SFTP")
+        return local_size
+
+    def disconnect(self):
+        if self.session is not None:
+            try:
+                self.session.close()
+            except Exception:
+                pass
+            self.session = None
+
+    def stop(self, timeout=None):
+        """
+        Waits up to timeout seconds for the queue to drain, then stops the worker. Files still pending stay queued.
+        """
+        self.idle.wait(timeout)
+        self.running = False
+        self.wake_up.set()
+        self.join(timeout=5)
+        self.disconnect()